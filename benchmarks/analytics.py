@@ -0,0 +1,54 @@
+"""
+Analytics benchmark. Times `gtfs_tripify.analytics` over a synthetic columnar logbook about the size of a month of
+subway data: `--rows` stop events spread over `--trips` trips, 500 stops and 25 routes, across 30 days.
+
+Run from the repository root: `python benchmarks/analytics.py [--rows N] [--trips N]`.
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, '.')
+from gtfs_tripify import analytics  # noqa: E402
+from gtfs_tripify.columnar import ColumnarLogbook  # noqa: E402
+
+
+def synthetic_logbook(n_rows, n_trips, seed=0):
+    rng = np.random.default_rng(seed)
+    n_rows = n_rows // n_trips * n_trips
+    minimum_time = rng.uniform(0, 30 * 86400, n_rows)
+    columns = {
+        'trip_id': np.repeat(np.array(['{0:06d}'.format(i) for i in range(n_trips)], dtype=object), n_rows // n_trips),
+        'route_id': rng.choice(np.array([str(i) for i in range(25)], dtype=object), n_rows),
+        'action': rng.choice(np.array(['STOPPED_AT', 'STOPPED_OR_SKIPPED'], dtype=object), n_rows),
+        'minimum_time': minimum_time,
+        'maximum_time': minimum_time + rng.uniform(30, 120, n_rows),
+        'stop_id': rng.choice(np.array(['{0:03d}N'.format(i) for i in range(500)], dtype=object), n_rows),
+        'latest_information_time': np.zeros(n_rows, dtype=np.int64)
+    }
+    keys = ['{0:06d}_0'.format(i) for i in range(n_trips)]
+    return ColumnarLogbook(keys, np.arange(n_trips + 1) * (n_rows // n_trips), columns)
+
+
+def timed(label, function):
+    start = time.perf_counter()
+    result = function()
+    print("  {0:<24} {1:8.2f} s".format(label, time.perf_counter() - start))
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10000000)
+    parser.add_argument('--trips', type=int, default=300000)
+    args = parser.parse_args()
+
+    logbook = synthetic_logbook(args.rows, args.trips)
+    print("{0} events, {1} trips".format(logbook.n_rows, len(logbook)))
+    events = timed("estimate_times", lambda: analytics.estimate_times(logbook))
+    events = timed("headways", lambda: analytics.headways(events))
+    timed("dwell_bounds", lambda: analytics.dwell_bounds(events))
+    cube = timed("cube (hourly)", lambda: analytics.cube(events))
+    print("{0} cube cells".format(len(cube)))
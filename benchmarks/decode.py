@@ -0,0 +1,52 @@
+"""
+Decoding benchmark. Compares the `gtfs_realtime_pb2` decoding path (`parse_feed_bytes` followed by `dictify`) with
+the wire-format decoder in `gtfs_tripify.wire`, on the test fixtures or on feed files given on the command line.
+
+Run from the repository root: `python benchmarks/decode.py [FEED ...]`.
+"""
+import glob
+import sys
+import time
+import warnings
+
+sys.path.insert(0, '.')
+from gtfs_tripify import decode, wire  # noqa: E402
+
+try:
+    from google.protobuf.internal import api_implementation
+    PROTOBUF_BACKEND = api_implementation.Type()
+except ImportError:
+    PROTOBUF_BACKEND = 'unknown'
+
+CANDIDATES = [
+    ('gtfs_realtime_pb2 parse only', decode.parse_feed_bytes),
+    ('gtfs_realtime_pb2 parse + dictify', decode.decode_content),
+    ('wire decode only (columns)', wire.decode),
+    ('wire decode + to_dictified', wire.dictify_content),
+]
+
+
+def time_function(function, contents, repeat=5):
+    """Returns the best-of-`repeat` wall time, in seconds, of applying `function` to every item in `contents`."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for content in contents:
+            function(content)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == '__main__':
+    warnings.simplefilter('ignore')
+    paths = sys.argv[1:] or sorted(glob.glob('tests/fixtures/gtfs-*'))
+    contents = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            contents.append(f.read())
+
+    print("{0} feeds, {1:.0f} KB total, protobuf backend: {2}".format(
+        len(contents), sum(map(len, contents)) / 1024, PROTOBUF_BACKEND))
+    for label, function in CANDIDATES:
+        elapsed = time_function(function, contents)
+        print("{0:<40} {1:8.2f} ms/feed".format(label, elapsed / len(contents) * 1000))
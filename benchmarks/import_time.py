@@ -0,0 +1,32 @@
+"""
+Import-time benchmark. Measures the wall time a fresh interpreter takes to import various parts of `gtfs-tripify`.
+
+Run from the repository root: `python benchmarks/import_time.py`.
+"""
+import subprocess
+import sys
+import time
+
+STATEMENTS = [
+    ('interpreter startup', 'pass'),
+    ('import gtfs_tripify', 'import gtfs_tripify'),
+    ('import gtfs_tripify.decode', 'import gtfs_tripify.decode'),
+    ('from gtfs_tripify import dictify', 'from gtfs_tripify import dictify'),
+    ('from gtfs_tripify import logify', 'from gtfs_tripify import logify'),
+    ('import pandas', 'import pandas'),
+]
+
+
+def time_statement(statement, repeat=5):
+    """Returns the best-of-`repeat` wall time, in seconds, of running `statement` in a fresh interpreter."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.check_call([sys.executable, '-c', statement])
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == '__main__':
+    for label, statement in STATEMENTS:
+        print("{0:<40} {1:8.1f} ms".format(label, time_statement(statement) * 1000))
@@ -0,0 +1,64 @@
+"""
+SQL schema benchmark. Compares the size of a database written using the default (v1) schema with one written using
+the normalized v2 schema (see `gtfs_tripify.io.logbook_to_sql`), and the latency of some common queries against
+each. The logbook built from the test fixtures is written `--copies` times over, to make a database of some size.
+
+Run from the repository root: `python benchmarks/sql_schema.py [--copies N]`.
+"""
+import argparse
+import glob
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import warnings
+
+sys.path.insert(0, '.')
+import gtfs_tripify as gt  # noqa: E402
+from gtfs_tripify.decode import parse_feed  # noqa: E402
+
+START, END = 1463025455, 1463025494
+STOP_QUERIES = {
+    1: "SELECT COUNT(*) FROM Logbooks WHERE stop_id = ? AND minimum_time < ? AND maximum_time >= ?;",
+    2: "SELECT COUNT(*) FROM Events WHERE stop_key = (SELECT stop_key FROM Stops WHERE stop_id = ?) "
+       "AND minimum_time < ? AND maximum_time >= ?;"
+}
+
+
+def best_of(function, repeat=5):
+    """Returns the best-of-`repeat` wall time, in seconds, of calling `function`."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == '__main__':
+    warnings.simplefilter('ignore')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--copies', type=int, default=50)
+    args = parser.parse_args()
+
+    feeds = [gt.dictify(parse_feed(path)) for path in sorted(glob.glob('tests/fixtures/gtfs-*'))]
+    logbook = gt.logify(feeds)
+    tmp = tempfile.mkdtemp()
+
+    for schema in (1, 2):
+        path = os.path.join(tmp, 'v{0}.db'.format(schema))
+        conn = sqlite3.connect(path)
+        start = time.perf_counter()
+        for _ in range(args.copies):
+            gt.io.logbook_to_sql(logbook, conn, schema=schema)
+        write_time = time.perf_counter() - start
+        conn.execute("VACUUM;")
+
+        print("v{0}: {1:.1f} MB, written in {2:.2f} s".format(schema, os.path.getsize(path) / 2 ** 20, write_time))
+        print("  {0:<36} {1:8.2f} ms".format("read everything", best_of(lambda: gt.io.sql_to_logbook(conn)) * 1000))
+        print("  {0:<36} {1:8.2f} ms".format("read route 1, by time", best_of(
+            lambda: gt.io.sql_to_logbook(conn, routes=['1'], start=START, end=END)) * 1000))
+        print("  {0:<36} {1:8.2f} ms".format("count stop 101S visits, by time", best_of(
+            lambda: conn.execute(STOP_QUERIES[schema], ('101S', END, START)).fetchone()) * 1000))
+        conn.close()
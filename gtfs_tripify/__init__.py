@@ -1,3 +1,59 @@
-from .tripify import (dictify, correct, actionify, tripify, logify, merge_logbooks)
-from .utils import synthesize_route
-from .io import (logbook_to_sql, stream_to_sql)
+"""
+`gtfs-tripify` public API.
+
+The public names are loaded lazily, on first attribute access, so that `import gtfs_tripify` stays cheap. Processes
+which only need to decode feeds should use `gtfs_tripify.decode`, which does not import `pandas` at all.
+"""
+import importlib
+import sys
+import types
+
+# Maps each public name to the submodule which defines it.
+_public_api = {
+    'dictify': 'decode',
+    'correct': 'decode',
+    'parse_feed': 'decode',
+    'actionify': 'tripify',
+    'tripify': 'tripify',
+    'logify': 'tripify',
+    'merge_logbooks': 'tripify',
+    'synthesize_route': 'utils',
+    'logbook_to_sql': 'io',
+    'sql_to_logbook': 'io',
+    'stream_to_sql': 'io',
+}
+
+_submodules = {'decode', 'tripify', 'utils', 'io'}
+
+__all__ = sorted(_public_api)
+
+
+def __getattr__(name):
+    if name in _public_api:
+        module = importlib.import_module('.' + _public_api[name], __name__)
+        value = getattr(module, name)
+    elif name in _submodules:
+        value = importlib.import_module('.' + name, __name__)
+    else:
+        raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_public_api) | _submodules)
+
+
+class _Package(types.ModuleType):
+    """
+    The `tripify` submodule shares its name with the `tripify` function. When the submodule is first imported the
+    import system binds it onto the package, which would shadow the function; keep the function in place instead.
+    """
+    def __setattr__(self, name, value):
+        if name == 'tripify' and isinstance(value, types.ModuleType):
+            value = value.tripify
+        super().__setattr__(name, value)
+
+
+sys.modules[__name__].__class__ = _Package
@@ -0,0 +1,187 @@
+"""
+A persistent, memory-mappable store of feed action tables.
+
+Turning an archive of GTFS-Realtime feeds into a logbook means decoding every feed, parsing it into action logs, and
+then tripifying those. The first two stages are by far the most expensive, but their output only depends on the
+feeds themselves, not on how the action logs are later assembled into trip logs. An `ActionStore` persists that
+output (the action tables of `gtfs_tripify.tripify.action_tables`), so that a logbook can be built over again, for
+instance after changing the tripification logic, straight from the store with `ActionStore.logify`.
+
+The store is a directory with one subdirectory per time partition (by default, one per hour), named after the
+timestamp at which the partition begins. Each write adds a segment to each partition it touches. A segment is a
+directory of `numpy` `.npy` column files, which are read using memory mapping:
+
+* `timestamp`: the timestamp of each feed.
+* `feed_offset`: the rows of the `i`th feed are `feed_offset[i]:feed_offset[i + 1]`.
+* `trip_id`, `has_lead_row`, `route_id`, `action`, `stop_id`, `time_assigned`: one row per trip in each feed,
+  holding the trip id and the lead row of its lean action record.
+* `stop_start`, `stop_end`, `stops`: the stops of the `j`th row are `stops[stop_start[j]:stop_end[j]]`. Stop lists
+  which are unchanged from the trip's row in the previous feed point at the same span.
+"""
+import os
+import shutil
+
+import numpy as np
+
+from gtfs_tripify.tripify import action_tables, logify, ACTION_LOG_COLUMNS
+
+LEAD_ROW_COLUMNS = ['route_id', 'action', 'stop_id', 'time_assigned']
+SEGMENT_COLUMNS = ['timestamp', 'feed_offset', 'trip_id', 'has_lead_row'] + LEAD_ROW_COLUMNS + \
+                  ['stop_start', 'stop_end', 'stops']
+
+
+def _strings(values):
+    # Fixed-width unicode arrays, unlike object arrays, can be memory mapped.
+    return np.array(values, dtype=str) if values else np.empty(0, dtype='<U1')
+
+
+def _write_segment(path, tables):
+    """Writes a list of `(timestamp, table)` action tables to a new segment directory at `path`."""
+    feed_offsets, trip_ids, has_lead_row = [0], [], []
+    lead_rows = {col: [] for col in LEAD_ROW_COLUMNS}
+    stop_starts, stop_ends, stops = [], [], []
+    blank = ('',) * len(ACTION_LOG_COLUMNS)
+    previous = dict()
+
+    for _, table in tables:
+        current = dict()
+        for trip_id, (lead_row, record_stops) in table.items():
+            trip_ids.append(trip_id)
+            has_lead_row.append(lead_row is not None)
+            for col, value in zip(ACTION_LOG_COLUMNS, lead_row if lead_row is not None else blank):
+                if col in lead_rows:
+                    lead_rows[col].append(value)
+
+            span = previous.get(trip_id)
+            if span is None or span[0] != record_stops:
+                span = (record_stops, len(stops), len(stops) + len(record_stops))
+                stops.extend(record_stops)
+            stop_starts.append(span[1])
+            stop_ends.append(span[2])
+            current[trip_id] = span
+        feed_offsets.append(len(trip_ids))
+        previous = current
+
+    columns = {'timestamp': np.array([timestamp for timestamp, _ in tables], dtype=np.int64),
+               'feed_offset': np.array(feed_offsets, dtype=np.int64),
+               'trip_id': _strings(trip_ids),
+               'has_lead_row': np.array(has_lead_row, dtype=bool),
+               'stop_start': np.array(stop_starts, dtype=np.int64),
+               'stop_end': np.array(stop_ends, dtype=np.int64),
+               'stops': _strings(stops)}
+    columns.update({col: _strings(lead_rows[col]) for col in LEAD_ROW_COLUMNS})
+
+    # Write to a temporary directory first and then move it into place, so that a crash never leaves a partial
+    # segment behind.
+    shutil.rmtree(path + '.tmp', ignore_errors=True)
+    os.makedirs(path + '.tmp')
+    for col in SEGMENT_COLUMNS:
+        np.save(os.path.join(path + '.tmp', col + '.npy'), columns[col])
+    os.replace(path + '.tmp', path)
+
+
+def _read_segment(path, start=None, end=None):
+    """Reads the action tables with a timestamp in `[start, end)` back out of a segment directory."""
+    columns = {col: np.load(os.path.join(path, col + '.npy'), mmap_mode='r') for col in SEGMENT_COLUMNS}
+    timestamps = columns['timestamp']
+    lo = 0 if start is None else int(np.searchsorted(timestamps, start, side='left'))
+    hi = len(timestamps) if end is None else int(np.searchsorted(timestamps, end, side='left'))
+    if lo >= hi:
+        return []
+
+    offsets = columns['feed_offset']
+    rows = slice(int(offsets[lo]), int(offsets[hi]))
+    trip_ids = columns['trip_id'][rows].tolist()
+    has_lead_row = columns['has_lead_row'][rows].tolist()
+    lead_rows = {col: columns[col][rows].tolist() for col in LEAD_ROW_COLUMNS}
+    stop_starts, stop_ends = columns['stop_start'][rows], columns['stop_end'][rows]
+
+    # Only the span of the memory-mapped `stops` column which these rows refer to is read in. Stop lists are shared
+    # with earlier feeds in the segment, so the span may begin before the first row's own stops.
+    base = int(stop_starts.min()) if len(stop_starts) else 0
+    stops = columns['stops'][base:int(stop_ends.max()) if len(stop_ends) else 0].tolist()
+    stop_starts, stop_ends = (stop_starts - base).tolist(), (stop_ends - base).tolist()
+
+    tables = []
+    for i in range(lo, hi):
+        timestamp, information_time = int(timestamps[i]), str(int(timestamps[i]))
+        table = dict()
+        for j in range(int(offsets[i]) - rows.start, int(offsets[i + 1]) - rows.start):
+            trip_id = trip_ids[j]
+            lead_row = ((trip_id, lead_rows['route_id'][j], information_time, lead_rows['action'][j],
+                         lead_rows['stop_id'][j], lead_rows['time_assigned'][j]) if has_lead_row[j] else None)
+            table[trip_id] = (lead_row, tuple(stops[stop_starts[j]:stop_ends[j]]))
+        tables.append((timestamp, table))
+    return tables
+
+
+class ActionStore:
+    """
+    A directory of persisted feed action tables, partitioned by time. See the module docstring for the layout.
+    """
+    def __init__(self, path, partition_seconds=3600):
+        self.path = path
+        self.partition_seconds = partition_seconds
+        os.makedirs(path, exist_ok=True)
+
+    def _partitions(self):
+        return sorted(int(name) for name in os.listdir(self.path) if name.isdigit())
+
+    def _segments(self, partition):
+        directory = os.path.join(self.path, str(partition))
+        names = sorted((name for name in os.listdir(directory) if not name.endswith('.tmp')),
+                       key=lambda name: tuple(int(t) for t in name.split('-')))
+        return [(tuple(int(t) for t in name.split('-')), os.path.join(directory, name)) for name in names]
+
+    def write_tables(self, tables):
+        """Writes a list of `(timestamp, table)` action tables (see `gtfs_tripify.tripify.action_tables`)."""
+        partitions = dict()
+        for timestamp, table in tables:
+            partition = timestamp - timestamp % self.partition_seconds
+            partitions.setdefault(partition, []).append((timestamp, table))
+
+        for partition, partition_tables in partitions.items():
+            partition_tables.sort(key=lambda t: t[0])
+            name = '{0}-{1}'.format(partition_tables[0][0], partition_tables[-1][0])
+            path = os.path.join(self.path, str(partition), name)
+            if os.path.exists(path):
+                shutil.rmtree(path)
+            _write_segment(path, partition_tables)
+
+    def write(self, feeds):
+        """Parses a timely list of dictified feeds into action tables, and writes them to the store."""
+        self.write_tables(action_tables(feeds))
+
+    def read(self, start=None, end=None):
+        """
+        Returns the action tables in the store with a timestamp in the half-open interval `[start, end)`, in time
+        order. Either bound may be None to leave that side of the interval open. Only the partitions and segments
+        overlapping the interval are read. If the same feed was written more than once, it is only returned once.
+        """
+        tables = []
+        for partition in self._partitions():
+            if end is not None and partition >= end:
+                break
+            if start is not None and partition + self.partition_seconds <= start:
+                continue
+            for (first, last), path in self._segments(partition):
+                if (end is None or first < end) and (start is None or last >= start):
+                    tables.extend(_read_segment(path, start, end))
+
+        tables.sort(key=lambda t: t[0])
+        return [t for i, t in enumerate(tables) if i == 0 or t[0] != tables[i - 1][0]]
+
+    def timestamps(self):
+        """Returns the timestamps of every feed in the store, in time order."""
+        timestamps = set()
+        for partition in self._partitions():
+            for _, path in self._segments(partition):
+                timestamps.update(np.load(os.path.join(path, 'timestamp.npy')).tolist())
+        return sorted(timestamps)
+
+    def logify(self, start=None, end=None, **kwargs):
+        """
+        Builds a logbook out of the feeds in the store with a timestamp in `[start, end)`, without decoding or parsing
+        any feeds. Additional keyword arguments are passed through to `gtfs_tripify.tripify.logify`.
+        """
+        return logify(actions=self.read(start, end), **kwargs)
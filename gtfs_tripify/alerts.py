@@ -0,0 +1,172 @@
+"""
+Alert processing.
+
+GTFS-Realtime alerts are not part of the trip logs that `logify` builds. Instead, an `AlertIndex` tracks the alerts in
+a stream of feeds separately, as time intervals: each alert is recorded once per trip (or, for alerts informing a whole
+route, once per route) that it informs, from the timestamp of the first feed it appeared in to that of the last one.
+Alert texts, which are repeated in every feed for as long as the alert is up, are interned, and only stored once.
+
+`attach_alerts` then joins the alerts onto the stops in a logbook in a single vectorized pass.
+"""
+import numpy as np
+import pandas as pd
+
+from gtfs_tripify.columnar import ColumnarLogbook
+
+ALERT_COLUMNS = ['trip_id', 'route_id', 'text', 'start', 'end']
+
+
+class AlertIndex:
+    """
+    An index of the alerts in a stream of dictified feeds. Push feeds into it in time order using `push`, or build it
+    all at once using `from_feeds`.
+
+    `intervals` is a `DataFrame` with one row per alert per informed entity, with the columns `trip_id` (empty for
+    alerts which inform a whole route), `route_id`, `text` (the position of the alert text in `texts`), `start`, and
+    `end`. An alert which is still up as of the latest feed ends at the timestamp of that feed. Rows are sorted by trip
+    id and then by start time.
+    """
+    def __init__(self):
+        self.texts = []
+        self.timestamp = None
+        self._text_ids = dict()
+
+        # `(trip_id, route_id, text)` -> `[start, end]` for the alerts which were up as of the latest feed, and
+        # `(trip_id, route_id, text, start, end)` tuples for the alerts which have since gone down.
+        self._open = dict()
+        self._closed = []
+        self._intervals = None
+
+    def __len__(self):
+        return len(self._open) + len(self._closed)
+
+    def _intern(self, text):
+        if text not in self._text_ids:
+            self._text_ids[text] = len(self.texts)
+            self.texts.append(text)
+        return self._text_ids[text]
+
+    def push(self, feed):
+        """Pushes a dictified feed into the index."""
+        timestamp = feed['header']['timestamp']
+
+        current = set()
+        for message in feed['entity']:
+            if message['type'] == 'alert':
+                text = self._intern(message['alert']['header_text']['translation']['text'])
+                current.update((entity['trip_id'], entity['route_id'], text)
+                               for entity in message['alert']['informed_entity'])
+
+        for key in [key for key in self._open if key not in current]:
+            self._closed.append(key + tuple(self._open.pop(key)))
+        for key in current:
+            self._open.setdefault(key, [timestamp, timestamp])[1] = timestamp
+
+        self.timestamp = timestamp
+        self._intervals = None
+
+    @classmethod
+    def from_feeds(cls, feeds):
+        """Builds an index of the alerts in a timely list of dictified feeds."""
+        index = cls()
+        for feed in feeds:
+            index.push(feed)
+        return index
+
+    @property
+    def intervals(self):
+        if self._intervals is None:
+            rows = self._closed + [key + tuple(span) for key, span in self._open.items()]
+            intervals = pd.DataFrame(rows, columns=ALERT_COLUMNS).astype(
+                {'trip_id': object, 'route_id': object, 'text': np.int64, 'start': np.int64, 'end': np.int64})
+            self._intervals = intervals.sort_values(['trip_id', 'start'], kind='stable').reset_index(drop=True)
+        return self._intervals
+
+    def query(self, trip_id=None, route_id=None, start=None, end=None):
+        """
+        Returns the alerts informing the given trip id or route id (or both), which were up at some point in the
+        closed interval `[start, end]`, as a `DataFrame` like `intervals`, but with the alert texts in the `text`
+        column. Any of the parameters may be None to leave it unconstrained.
+        """
+        intervals = self.intervals
+        if trip_id is not None:
+            # Rows are sorted by trip id, so the alerts informing a trip are a contiguous block.
+            trip_ids = intervals['trip_id'].values
+            intervals = intervals.iloc[np.searchsorted(trip_ids, trip_id, side='left'):
+                                       np.searchsorted(trip_ids, trip_id, side='right')]
+
+        mask = np.ones(len(intervals), dtype=bool)
+        if route_id is not None:
+            mask &= (intervals['route_id'] == route_id).values
+        if start is not None:
+            mask &= (intervals['end'] >= start).values
+        if end is not None:
+            mask &= (intervals['start'] <= end).values
+
+        result = intervals[mask].reset_index(drop=True)
+        return result.assign(text=np.array(self.texts, dtype=object)[result['text'].values]
+                             if len(result) else result['text'].astype(object))
+
+
+def _key_join(left, right):
+    """
+    Equi-joins two arrays of keys, returning the `(i, j)` index pairs with `left[i] == right[j]` as two arrays. The
+    right keys are sorted once, and every left key is looked up in them by binary search.
+    """
+    codes, _ = pd.factorize(np.concatenate([left, right]))
+    left, right = codes[:len(left)], codes[len(left):]
+
+    order = np.argsort(right, kind='stable')
+    lo = np.searchsorted(right[order], left, side='left')
+    counts = np.searchsorted(right[order], left, side='right') - lo
+    i = np.repeat(np.arange(len(left)), counts)
+    firsts = np.cumsum(counts) - counts
+    j = order[np.repeat(lo - firsts, counts) + np.arange(counts.sum())]
+    return i, j
+
+
+def attach_alerts(logbook, index):
+    """
+    Returns a copy of a logbook with an `alerts` column added to every trip log. The `alerts` entry of each stop is a
+    tuple of the texts of the alerts in `index` (an `AlertIndex`) which informed the trip (or its route) at some point
+    in the time window of the stop, from `minimum_time` to `maximum_time`. An unknown `minimum_time` or
+    `maximum_time` leaves that side of the window open.
+
+    Every stop of every trip is joined to every alert in a single vectorized pass over the concatenated logbook, so
+    the cost of this operation is proportional to the number of stops and alerts, not to the number of feeds.
+    """
+    columnar = logbook if isinstance(logbook, ColumnarLogbook) else ColumnarLogbook.from_logbook(logbook)
+    columns = columnar.columns
+    lo = np.nan_to_num(columns['minimum_time'], nan=-np.inf)
+    hi = np.nan_to_num(columns['maximum_time'], nan=np.inf)
+
+    # Alerts informing a trip are joined on trip id, and alerts informing a whole route on route id.
+    intervals = index.intervals
+    informs_trip = (intervals['trip_id'] != '').values
+    by_trip, by_route = np.flatnonzero(informs_trip), np.flatnonzero(~informs_trip)
+    trip_rows, trip_alerts = _key_join(columns['trip_id'], intervals['trip_id'].values[by_trip])
+    route_rows, route_alerts = _key_join(columns['route_id'], intervals['route_id'].values[by_route])
+    rows = np.concatenate([trip_rows, route_rows])
+    matches = np.concatenate([by_trip[trip_alerts], by_route[route_alerts]])
+
+    overlaps = (intervals['start'].values[matches] <= hi[rows]) & (intervals['end'].values[matches] >= lo[rows])
+    rows, text = rows[overlaps], intervals['text'].values[matches[overlaps]]
+
+    # Each text is attached to a stop once, in text order; `np.unique` both sorts and deduplicates the pairs.
+    n_texts = max(len(index.texts), 1)
+    pairs = np.unique(rows.astype(np.int64) * n_texts + text)
+    rows, text = pairs // n_texts, pairs % n_texts
+
+    alerts = np.empty(columnar.n_rows, dtype=object)
+    alerts.fill(())
+    if len(rows):
+        boundaries = np.flatnonzero(np.diff(rows)) + 1
+        groups = np.split(np.array(index.texts, dtype=object)[text], boundaries)
+        alerts[rows[np.concatenate([[0], boundaries])]] = np.fromiter(
+            (tuple(group) for group in groups), dtype=object, count=len(groups))
+
+    ret = dict()
+    for key in columnar:
+        start, end = columnar.trip_slice(key)
+        ret[key] = logbook[key].assign(alerts=alerts[start:end])
+    return ret
@@ -0,0 +1,121 @@
+"""
+Vectorized analytics over logbooks.
+
+`tripify` does not know exactly when a train stopped at a station, only that it did so at some point between the
+`minimum_time` and the `maximum_time` of the stop. The functions in this module turn these bounds into point estimates
+of event times, and then compute headways and summary statistics from them.
+
+Every function here works on the columns of a logbook as a whole, rather than trip by trip, so that they scale to many
+days of data. They accept any logbook, but are fastest on a `ColumnarLogbook` (such as the ones returned by
+`gtfs_tripify.io.sql_to_logbook`), which they do not need to convert first.
+"""
+import numpy as np
+import pandas as pd
+
+from gtfs_tripify.columnar import ColumnarLogbook
+
+COMPLETED_ACTIONS = ['STOPPED_AT', 'STOPPED_OR_SKIPPED']
+
+
+def _weight(method):
+    if method == 'midpoint':
+        return 0.5
+    elif method == 'minimum':
+        return 0.0
+    elif method == 'maximum':
+        return 1.0
+    elif isinstance(method, (int, float)) and 0 <= method <= 1:
+        return float(method)
+    raise ValueError("Expected 'midpoint', 'minimum', 'maximum', or a number between 0 and 1, but got {0!r}.".format(
+        method))
+
+
+def estimate_times(logbook, method='midpoint', actions=COMPLETED_ACTIONS):
+    """
+    Returns a `DataFrame` of stop events with point estimates of the time each one occurred at, in an `estimated_time`
+    column, alongside `unique_trip_id`, `route_id`, `stop_id`, `action`, `minimum_time`, and `maximum_time` columns.
+    Route ids, stop ids and actions are categorical.
+
+    `method` places the estimate within the `[minimum_time, maximum_time]` window: 'midpoint' (the default),
+    'minimum', 'maximum', or a number between 0 and 1, giving the fraction of the way through the window. Where only
+    one of the bounds is known, it is used as the estimate. Events where neither is known are dropped.
+
+    By default, only the stops trains are known to have passed through are included. Pass a different list of
+    `actions`, or None to include every stop.
+    """
+    weight = _weight(method)
+    logbook = logbook if isinstance(logbook, ColumnarLogbook) else ColumnarLogbook.from_logbook(logbook)
+    columns = logbook.columns
+
+    lo, hi = columns['minimum_time'], columns['maximum_time']
+    estimate = np.where(np.isnan(lo), hi, np.where(np.isnan(hi), lo, lo + weight * (hi - lo)))
+
+    events = pd.DataFrame({
+        'unique_trip_id': pd.Categorical.from_codes(
+            np.repeat(np.arange(len(logbook)), np.diff(logbook.offsets)), list(logbook)
+        ) if len(logbook) else pd.Categorical([]),
+        'route_id': pd.Categorical(columns['route_id']),
+        'stop_id': pd.Categorical(columns['stop_id']),
+        'action': pd.Categorical(columns['action']),
+        'minimum_time': lo,
+        'maximum_time': hi,
+        'estimated_time': estimate
+    })
+
+    mask = ~np.isnan(estimate)
+    if actions is not None:
+        mask &= events['action'].isin(actions).values
+    return events[mask].reset_index(drop=True)
+
+
+def headways(events, by=('route_id', 'stop_id')):
+    """
+    Given the output of `estimate_times`, returns it sorted by the `by` columns and then by time, with a `headway`
+    column added: the time elapsed since the previous event in the same group, or NaN for the first event in each
+    group. Group by `('stop_id',)` alone to compute headways across all of the routes serving each stop.
+
+    The events are sorted once, and the headways are computed in a single pass over the sorted events.
+    """
+    by = list(by)
+    codes = [events[col].cat.codes.values if hasattr(events[col], 'cat') else pd.factorize(events[col])[0]
+             for col in by]
+    order = np.lexsort([events['estimated_time'].values] + codes[::-1])
+    events = events.iloc[order].reset_index(drop=True)
+
+    times = events['estimated_time'].values
+    headway = np.empty(len(times), dtype=np.float64)
+    headway[:1] = np.nan
+    headway[1:] = np.diff(times)
+
+    new_group = np.zeros(len(times), dtype=bool)
+    new_group[:1] = True
+    for code in codes:
+        new_group[1:] |= code[order][1:] != code[order][:-1]
+    headway[new_group] = np.nan
+
+    return events.assign(headway=headway)
+
+
+def dwell_bounds(events):
+    """
+    Given the output of `estimate_times`, returns it with a `dwell_bound` column added. For trains that were seen
+    `STOPPED_AT` a stop, this is the width of the window the stop was made in, which is an upper bound on the time
+    the train spent at the stop. It is NaN for every other event, and where either bound is unknown.
+    """
+    stopped = (events['action'] == 'STOPPED_AT').values
+    window = (events['maximum_time'] - events['minimum_time']).values
+    return events.assign(dwell_bound=np.where(stopped, window, np.nan))
+
+
+def cube(events, value='headway', freq=3600, stats=('count', 'mean', 'median')):
+    """
+    Aggregates a column of per-event values (such as the `headway` column added by `headways`) into a route by stop
+    by time-bucket cube. Returns a `DataFrame` indexed by `route_id`, `stop_id`, and `bucket`, the Unix timestamp at
+    which each `freq`-second bucket (by default, hourly) of `estimated_time` starts, with one column per statistic in
+    `stats`. Missing values are ignored, and combinations with no events are left out.
+    """
+    buckets = (events['estimated_time'].values // freq * freq).astype(np.int64)
+    grouped = (events[['route_id', 'stop_id', value]]
+               .assign(bucket=buckets)
+               .groupby(['route_id', 'stop_id', 'bucket'], observed=True, sort=True)[value])
+    return grouped.agg(list(stats))
@@ -0,0 +1,248 @@
+"""
+Seekable indexes over local archives of GTFS-Realtime feeds.
+
+An archive is either a directory of feed files or a tar file of them. Its index is a sidecar file which records the
+header timestamp, location, size, content hash and modification time of every feed in the archive, sorted by
+timestamp. With an index on hand, `read_feeds` can pull out just the feeds falling within a time range, seeking
+directly to each one, instead of reading the whole archive.
+
+Seeking requires a directory or an uncompressed tar file. Compressed tar files may be indexed too, but reading from
+them still has to decompress every member up to the last one read.
+"""
+import bisect
+import calendar
+import csv
+import datetime
+import hashlib
+import os
+import tarfile
+from concurrent.futures import ProcessPoolExecutor
+
+from gtfs_tripify.decode import decode_content, FeedDeduplicator
+from gtfs_tripify.wire import read_header
+
+INDEX_SUFFIX = '.gtindex'
+INDEX_COLUMNS = ['timestamp', 'offset', 'size', 'hash', 'name', 'mtime']
+
+
+class FeedIndex:
+    """
+    An index of the feeds in an archive. Entries are `(timestamp, offset, size, hash, name, mtime)` tuples, kept sorted
+    by timestamp. Feeds whose header could not be read are recorded with a timestamp of -1, so that they are not
+    re-read every time the index is updated, but are never returned by `query`.
+    """
+    def __init__(self, entries=()):
+        self.entries = sorted(entries)
+        self.timestamps = [entry[0] for entry in self.entries]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def names(self):
+        return {entry[4] for entry in self.entries}
+
+    def query(self, start=None, end=None):
+        """
+        Returns the entries with a timestamp in the half-open interval `[start, end)`, in time order. `start` and
+        `end` may be Unix timestamps or `datetime` objects (naive ones are taken to be in UTC), and either may be None
+        to leave that side of the interval open. Takes O(log n) time, plus the time to copy out the result.
+        """
+        lo = bisect.bisect_left(self.timestamps, max(_to_epoch(start), 0) if start is not None else 0)
+        hi = bisect.bisect_left(self.timestamps, _to_epoch(end)) if end is not None else len(self.entries)
+        return self.entries[lo:hi]
+
+    def save(self, path):
+        # Write to a temporary file first and then move it into place, so that a crash never leaves a corrupt index.
+        # Names containing tabs, newlines or quotes are quoted.
+        with open(path + '.tmp', 'w', newline='') as f:
+            writer = csv.writer(f, delimiter='\t', lineterminator='\n')
+            writer.writerow(INDEX_COLUMNS)
+            writer.writerows(self.entries)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads an index saved using `save`. Entries in indexes written before modification times were recorded get an
+        `mtime` of -1, so that `build_index` reads them again.
+        """
+        entries = []
+        with open(path, newline='') as f:
+            reader = csv.reader(f, delimiter='\t')
+            next(reader)
+            for row in reader:
+                timestamp, offset, size, digest, name = row[:5]
+                mtime = int(row[5]) if len(row) > 5 else -1
+                entries.append((int(timestamp), int(offset), int(size), digest, name, mtime))
+        return cls(entries)
+
+
+def _to_epoch(t):
+    if isinstance(t, datetime.datetime):
+        return int(t.timestamp()) if t.tzinfo is not None else calendar.timegm(t.timetuple())
+    return int(t)
+
+
+def index_path(archive):
+    """Returns the path of the sidecar index file of an archive."""
+    return archive.rstrip(os.sep) + INDEX_SUFFIX
+
+
+def _list_members(archive):
+    """
+    Returns `(name, offset, size, mtime)` tuples for every feed in an archive. For directories `offset` is always 0,
+    and `mtime` is in nanoseconds; for tar files `offset` is the position of the member's data within the
+    (uncompressed) tar stream, and `mtime` is the member's modification time, in seconds.
+    """
+    if os.path.isdir(archive):
+        members = []
+        for name in sorted(os.listdir(archive)):
+            path = os.path.join(archive, name)
+            if os.path.isfile(path) and not name.startswith('.'):
+                stat = os.stat(path)
+                members.append((name, 0, stat.st_size, stat.st_mtime_ns))
+        return members
+    else:
+        with tarfile.open(archive, 'r:*') as tar:
+            return [(m.name, m.offset_data, m.size, int(m.mtime)) for m in tar.getmembers() if m.isfile()]
+
+
+def _is_seekable(archive):
+    """Directories and uncompressed tar files can be read from at arbitrary offsets; compressed tar files cannot."""
+    if os.path.isdir(archive):
+        return True
+    with open(archive, 'rb') as f:
+        magic = f.read(6)
+    return not magic.startswith((b'\x1f\x8b', b'BZh', b'\xfd7zXZ'))
+
+
+def _read_member(archive, name, offset, size):
+    """Reads the raw bytes of a single feed out of a directory or an uncompressed tar file."""
+    if os.path.isdir(archive):
+        with open(os.path.join(archive, name), 'rb') as f:
+            return f.read()
+    else:
+        with open(archive, 'rb') as f:
+            f.seek(offset)
+            return f.read(size)
+
+
+def _index_entry(content, name, offset, size, mtime):
+    try:
+        timestamp = read_header(content)['timestamp']
+    except (ValueError, IndexError, UnicodeDecodeError):
+        timestamp = -1
+    return timestamp, offset, size, hashlib.sha1(content).hexdigest(), name, mtime
+
+
+def _index_members(archive, members):
+    """Computes the index entries for a batch of `(name, offset, size, mtime)` members. The unit of parallel work."""
+    return [_index_entry(_read_member(archive, name, offset, size), name, offset, size, mtime)
+            for name, offset, size, mtime in members]
+
+
+def _index_compressed_tar(archive, members):
+    """Computes the index entries for the given members of a compressed tar file, in a single pass over it."""
+    wanted = {member[0] for member in members}
+    entries = []
+    with tarfile.open(archive, 'r:*') as tar:
+        for member in tar:
+            if member.isfile() and member.name in wanted:
+                content = tar.extractfile(member).read()
+                entries.append(_index_entry(content, member.name, member.offset_data, member.size, int(member.mtime)))
+    return entries
+
+
+def build_index(archive, path=None, workers=1, batch_size=256):
+    """
+    Builds or updates the index of an archive, saves it to `path` (by default, the archive path plus `.gtindex`),
+    and returns it.
+
+    Indexing is incremental: feeds which are already in an existing index are not read again. Entries for feeds which
+    have since been deleted are dropped, and feeds whose location, size or modification time have changed are read
+    again. Feed headers are read in `workers` processes, in batches of `batch_size` feeds.
+    """
+    path = path or index_path(archive)
+    index = FeedIndex.load(path) if os.path.exists(path) else FeedIndex()
+
+    current = {name: (name, offset, size, mtime) for name, offset, size, mtime in _list_members(archive)}
+    kept = [entry for entry in index.entries
+            if current.get(entry[4]) == (entry[4], entry[1], entry[2], entry[5])]
+    indexed = {entry[4] for entry in kept}
+    members = [member for name, member in current.items() if name not in indexed]
+    if not members:
+        if len(kept) != len(index):
+            index = FeedIndex(kept)
+            index.save(path)
+        return index
+
+    batches = [members[i:i + batch_size] for i in range(0, len(members), batch_size)]
+    if not _is_seekable(archive):
+        # Compressed tar files cannot be read out of order efficiently, so these are indexed in a single pass.
+        new_entries = _index_compressed_tar(archive, members)
+    elif workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            new_entries = [entry for result in executor.map(_index_members, [archive] * len(batches), batches)
+                           for entry in result]
+    else:
+        new_entries = [entry for batch in batches for entry in _index_members(archive, batch)]
+
+    index = FeedIndex(kept + new_entries)
+    index.save(path)
+    return index
+
+
+def iter_feed_bytes(archive, start=None, end=None, index=None):
+    """
+    Yields the raw bytes of each feed in an archive with a header timestamp in `[start, end)`, in time order (see
+    `FeedIndex.query`). Feeds whose content is an exact duplicate of one already yielded are skipped. If no `index`
+    is given, the archive's index is built or updated first.
+    """
+    index = index if index is not None else build_index(archive)
+    entries = index.query(start, end)
+    seen = set()
+
+    if _is_seekable(archive):
+        for _, offset, size, digest, name, _ in entries:
+            if digest not in seen:
+                seen.add(digest)
+                yield _read_member(archive, name, offset, size)
+    else:
+        # Members are read in a single pass over the archive, which ends as soon as the last one wanted has been read.
+        # Each is yielded as soon as every feed before it in time order has been; only members which come earlier in
+        # the archive than in time order are held in memory, none at all if the archive is in time order already.
+        wanted = []
+        for _, offset, _, digest, name, _ in entries:
+            if digest not in seen:
+                seen.add(digest)
+                wanted.append((name, offset))
+        if not wanted:
+            return
+
+        wanted_offsets = {(name, offset) for name, offset in wanted}
+        last_offset = max(offset for _, offset in wanted)
+        contents, i = {}, 0
+        with tarfile.open(archive, 'r:*') as tar:
+            for member in tar:
+                if member.offset_data > last_offset:
+                    break
+                if (member.name, member.offset_data) not in wanted_offsets:
+                    continue
+
+                contents[member.name, member.offset_data] = tar.extractfile(member).read()
+                while i < len(wanted) and wanted[i] in contents:
+                    yield contents.pop(wanted[i])
+                    i += 1
+
+
+def read_feeds(archive, start=None, end=None, index=None, decoder=decode_content, **kwargs):
+    """
+    Returns the dictified feeds in an archive with a header timestamp in `[start, end)`, in time order, using the
+    archive's index to read only those feeds (see `iter_feed_bytes`). Bad feeds and duplicate feeds are dropped.
+
+    `decoder` is the function used to decode each feed; additional keyword arguments (such as `routes`) are passed
+    through to it.
+    """
+    deduplicator = FeedDeduplicator()
+    return deduplicator.deduplicate(decoder(content, **kwargs)
+                                    for content in iter_feed_bytes(archive, start, end, index=index))
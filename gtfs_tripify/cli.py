@@ -0,0 +1,301 @@
+"""
+The `gtfs-tripify` command-line ingest tool.
+
+Reads a directory, glob, or tar archive of GTFS-Realtime feed files, and writes the resulting logbooks to a SQLite
+database or to a directory of Parquet files. Run `gtfs-tripify --help` for usage.
+"""
+import argparse
+import functools
+import glob
+import itertools
+import json
+import os
+import sqlite3
+import sys
+import tarfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from gtfs_tripify.decode import decode_content, FeedDeduplicator
+
+
+def iter_inputs(source):
+    """
+    Yields `(name, content)` pairs for every feed file in `source`, in name order, where `content` is the raw bytes
+    of the file. `source` may be a directory, a glob pattern, or a tar archive (compressed or not).
+    """
+    def read(path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            path = os.path.join(source, name)
+            if os.path.isfile(path):
+                yield path, read(path)
+    elif os.path.isfile(source) and tarfile.is_tarfile(source):
+        with tarfile.open(source, 'r:*') as archive:
+            for member in sorted((m for m in archive.getmembers() if m.isfile()), key=lambda m: m.name):
+                yield member.name, archive.extractfile(member).read()
+    else:
+        for path in sorted(glob.glob(source)):
+            if os.path.isfile(path):
+                yield path, read(path)
+
+
+def _rss_bytes():
+    """Returns the resident set size of the current process, in bytes."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        # Not the current RSS, but the peak RSS; the best that is available on platforms without procfs.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def iter_chunks(inputs, chunk_size, workers=1, max_memory=None, deduplicator=None, decoder=decode_content,
+                receiver=None):
+    """
+    Decodes `inputs` (as yielded by `iter_inputs`) and groups the results into chunks of at most `chunk_size`
+    feeds. A chunk is also cut early if the resident memory of this process exceeds `max_memory` bytes. Yields
+    `(names, feeds)` pairs, where `feeds` is in time order; bad and duplicate feeds are dropped from `feeds`, but not
+    from `names`. Pass a `FeedDeduplicator` to `deduplicator` to inspect how many feeds were dropped.
+
+    `decoder` is the function used to turn raw bytes into a dictified feed (or None, for bad feeds). If `receiver`
+    is provided, `decoder` may return something else (such as a shared memory descriptor, see `wire.decode_to_shared`)
+    instead, which `receiver` turns into a dictified feed (or None) in this process.
+    """
+    deduplicator = deduplicator if deduplicator is not None else FeedDeduplicator()
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    batch_size = workers * 4
+
+    try:
+        names, feeds = [], []
+        while True:
+            batch = list(itertools.islice(inputs, min(batch_size, chunk_size - len(names))))
+            if not batch:
+                break
+
+            # Exact duplicates are dropped before they are decoded.
+            contents = [content for _, content in batch if not deduplicator.is_duplicate_content(content)]
+            decoded = executor.map(decoder, contents) if executor else map(decoder, contents)
+            names += [name for name, _ in batch]
+            feeds += list(decoded) if receiver is None else [receiver(result) for result in decoded]
+
+            if len(names) >= chunk_size or (max_memory is not None and _rss_bytes() > max_memory):
+                yield names, deduplicator.deduplicate(feeds)
+                names, feeds = [], []
+
+        if names:
+            yield names, deduplicator.deduplicate(feeds)
+    finally:
+        if executor:
+            executor.shutdown()
+
+
+def _load_checkpoint(path):
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return set(json.load(f)['completed'])
+
+
+def _save_checkpoint(path, completed):
+    # Write to a temporary file first and then move it into place, so that a crash never leaves a corrupt checkpoint.
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'completed': sorted(completed)}, f)
+    os.replace(path + '.tmp', path)
+
+
+def _decoders():
+    from gtfs_tripify.wire import dictify_content
+    return {'protobuf': decode_content, 'wire': dictify_content}
+
+
+def _infer_format(output):
+    return 'parquet' if output.endswith('.parquet') or os.path.isdir(output) else 'sqlite'
+
+
+def _make_writer(output, fmt, resume=False):
+    """
+    Returns a function which writes the logbook built from a chunk of feeds to the output target, and a function which
+    closes the target. Trips which span two chunks are merged into a single trip. `resume` should be set when picking
+    up a run that was cut short, and the close function told whether the run completed.
+    """
+    import gtfs_tripify.io
+
+    if fmt == 'sqlite':
+        conn = sqlite3.connect(output)
+
+        def write(logbook, feeds):
+            gtfs_tripify.io.upsert_logbook_to_sql(logbook, conn, feeds[0], feeds[-1])
+            return len(logbook)
+
+        def close(complete=True):
+            conn.close()
+
+        return write, close
+
+    import pandas as pd
+
+    # Parquet files cannot be updated in place, so trips still in progress at the end of each chunk are held back
+    # until the chunk in which they finish, or until the run completes. These are saved to a sidecar file after every
+    # chunk, before the checkpoint is, so that a resumed run can pick them up again. Keys are numbered after the
+    # largest key in use for their trip id in the output directory, as they are in a SQLite database.
+    os.makedirs(output, exist_ok=True)
+    held_path = output.rstrip(os.sep) + '.open.parquet'
+    parts = sorted(glob.glob(os.path.join(output, 'part-*.parquet')))
+    part = itertools.count(len(parts))
+    held = dict()
+    if resume and os.path.exists(held_path):
+        held.update(gtfs_tripify.io.parquet_to_logbook(held_path))
+    elif os.path.exists(held_path):
+        os.remove(held_path)
+
+    used = dict()
+    for path in parts:
+        for unique_trip_id in pd.read_parquet(path, columns=['unique_trip_id'])['unique_trip_id'].unique():
+            trip_id, n = gtfs_tripify.io._split_key(unique_trip_id)
+            used[trip_id] = max(n, used.get(trip_id, -1))
+
+    def write_part(logbook):
+        if len(logbook) > 0:
+            path = os.path.join(output, 'part-{0:05d}.parquet'.format(next(part)))
+            gtfs_tripify.io.logbook_to_parquet(logbook, path)
+
+    def write(logbook, feeds):
+        finished_open, finished, still_open = gtfs_tripify.io.carry_open_trips(
+            logbook, held, feeds[0], feeds[-1], used=used
+        )
+        write_part(finished_open)
+        write_part(finished)
+        held.clear()
+        held.update(still_open)
+
+        # Write to a temporary file first and then move it into place, so that a crash never leaves a corrupt file.
+        if held:
+            gtfs_tripify.io.logbook_to_parquet(held, held_path + '.tmp')
+            os.replace(held_path + '.tmp', held_path)
+        elif os.path.exists(held_path):
+            os.remove(held_path)
+        return len(finished_open) + len(finished)
+
+    def close(complete=True):
+        # Trips still held back when a run is cut short are left in the sidecar file, for the resumed run.
+        if complete:
+            write_part(held)
+            held.clear()
+            if os.path.exists(held_path):
+                os.remove(held_path)
+
+    return write, close
+
+
+def ingest(source, output, fmt=None, workers=1, chunk_size=1000, max_memory=None, checkpoint=None,
+           progress=None, decoder='protobuf', routes=None, trip_filter=None):
+    """
+    Runs the complete pipeline over the feeds in `source`, writing the result to `output`. Returns the number of
+    feeds processed.
+
+    Feeds are processed `chunk_size` at a time, and trips which span two chunks are merged into a single trip (see
+    `gtfs_tripify.io.upsert_logbook_to_sql`). Feeds are put in time order within each chunk; a feed no newer than the
+    last feed of the previous chunk arrived too late to be merged in, and is dropped. If a `checkpoint` file path is
+    provided, the names of the feeds that have been written out are recorded there after every chunk, and feeds
+    already recorded there are skipped. When writing Parquet, trips still in progress are kept in an
+    `OUTPUT.open.parquet` file alongside the output until they finish, so that a resumed run can pick them up again.
+    If `progress` is a file object, throughput is reported to it after every chunk.
+
+    Feeds are decoded using `gtfs_realtime_pb2` by default. Set `decoder` to 'wire' to use the faster wire-format
+    decoder in `gtfs_tripify.wire` instead. `routes` and `trip_filter` are passed through to the decoder (see
+    `dictify`); when using more than one worker, `trip_filter` must be picklable.
+    """
+    from gtfs_tripify.tripify import logify
+
+    fmt = fmt or _infer_format(output)
+    completed = _load_checkpoint(checkpoint) if checkpoint else set()
+    inputs = ((name, content) for name, content in iter_inputs(source) if name not in completed)
+    write, close = _make_writer(output, fmt, resume=bool(completed))
+    deduplicator = FeedDeduplicator()
+    decode = functools.partial(_decoders()[decoder], routes=routes, trip_filter=trip_filter)
+    receiver = None
+
+    # When decoding with the wire decoder in worker processes, send the decoded columns back through shared memory,
+    # and only build the dictified feeds in this process, rather than pickling them over.
+    if decoder == 'wire' and workers > 1:
+        from gtfs_tripify.wire import decode_to_shared, from_shared
+        decode, receiver = functools.partial(decode_to_shared, routes=routes, trip_filter=trip_filter), from_shared
+
+    start, n_feeds, n_trips, n_late, latest = time.time(), 0, 0, 0, None
+    complete = False
+    try:
+        for names, feeds in iter_chunks(inputs, chunk_size, workers=workers, max_memory=max_memory,
+                                        deduplicator=deduplicator, decoder=decode, receiver=receiver):
+            # Feeds are put in time order within each chunk. A feed older than the end of the previous chunk arrived
+            # too late to be merged in, and is dropped.
+            if latest is not None:
+                n_late += sum(1 for feed in feeds if feed['header']['timestamp'] <= latest)
+                feeds = [feed for feed in feeds if feed['header']['timestamp'] > latest]
+            if feeds:
+                n_trips += write(logify(feeds), feeds)
+                latest = feeds[-1]['header']['timestamp']
+
+            n_feeds += len(names)
+            if checkpoint:
+                completed.update(names)
+                _save_checkpoint(checkpoint, completed)
+            if progress:
+                elapsed = time.time() - start
+                progress.write(
+                    "{0} feeds ({1:.1f} feeds/s), {2} trips written, {3:.0f} MB resident; {duplicates} duplicate, "
+                    "{bad} bad and {reordered} out-of-order feeds, {late} dropped as late\n".format(
+                        n_feeds, n_feeds / elapsed if elapsed else 0, n_trips, _rss_bytes() / 2 ** 20,
+                        late=n_late, **deduplicator.report()
+                    )
+                )
+                progress.flush()
+        complete = True
+    finally:
+        close(complete)
+
+    return n_feeds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='gtfs-tripify', description='Turn a set of GTFS-Realtime feed files into a logbook of trips.'
+    )
+    parser.add_argument('source', help='A directory, glob pattern, or tar archive of GTFS-Realtime feed files.')
+    parser.add_argument('output', help='A SQLite database, or a directory (or *.parquet path) for Parquet output.')
+    parser.add_argument('--format', choices=['sqlite', 'parquet'], default=None,
+                        help='Output format. Inferred from the output path by default.')
+    parser.add_argument('-j', '--workers', type=int, default=1,
+                        help='Number of worker processes used to decode feeds.')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='Number of feeds processed at once.')
+    parser.add_argument('--max-memory', type=float, default=None,
+                        help='Memory ceiling, in megabytes. Chunks are cut short when it is exceeded.')
+    parser.add_argument('--checkpoint', default=None,
+                        help='Checkpoint file path. Defaults to OUTPUT.checkpoint when --resume is set.')
+    parser.add_argument('--resume', action='store_true', help='Skip feeds recorded in the checkpoint file.')
+    parser.add_argument('--decoder', choices=['protobuf', 'wire'], default='protobuf',
+                        help='Feed decoder: the gtfs_realtime_pb2 bindings, or the built-in wire-format decoder.')
+    parser.add_argument('--routes', default=None,
+                        help='Comma-separated list of route ids. Trips on other routes are skipped while decoding.')
+    parser.add_argument('-q', '--quiet', action='store_true', help='Do not report progress.')
+    args = parser.parse_args(argv)
+
+    checkpoint = args.checkpoint
+    if args.resume and not checkpoint:
+        checkpoint = args.output.rstrip(os.sep) + '.checkpoint'
+    if checkpoint and not args.resume and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+    ingest(args.source, args.output, fmt=args.format, workers=args.workers, chunk_size=args.chunk_size,
+           max_memory=args.max_memory * 2 ** 20 if args.max_memory else None, checkpoint=checkpoint,
+           progress=None if args.quiet else sys.stderr, decoder=args.decoder,
+           routes=args.routes.split(',') if args.routes else None)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
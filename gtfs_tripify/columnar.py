@@ -0,0 +1,100 @@
+"""
+A columnar logbook representation.
+
+A logbook is ordinarily a `dict` of trip log `DataFrame` objects, which is convenient to work with but expensive to
+build and to hold in memory in bulk: every trip log carries its own index, its own columns, and its own per-object
+overhead. A `ColumnarLogbook` instead stores the rows of every trip log end to end in one set of typed `numpy`
+columns, alongside an offset index recording where each trip begins and ends.
+"""
+from collections.abc import Mapping
+
+import numpy as np
+import pandas as pd
+
+from gtfs_tripify.shared import SharedColumns
+
+TRIP_LOG_COLUMNS = ['trip_id', 'route_id', 'action', 'minimum_time', 'maximum_time', 'stop_id',
+                    'latest_information_time']
+COLUMN_DTYPES = {'trip_id': object, 'route_id': object, 'action': object, 'minimum_time': np.float64,
+                 'maximum_time': np.float64, 'stop_id': object, 'latest_information_time': np.int64}
+
+
+class ColumnarLogbook(Mapping):
+    """
+    A read-only logbook, keyed by unique trip id, backed by a single set of columns.
+
+    `columns` maps each of the trip log columns to a `numpy` array holding that column for every trip, in key order.
+    The rows of the `i`th trip are `offsets[i]:offsets[i + 1]`. Looking up a key returns its trip log as a
+    `DataFrame`, as in an ordinary logbook, so a `ColumnarLogbook` may be used anywhere a logbook is expected.
+    """
+    def __init__(self, keys, offsets, columns):
+        self._keys = list(keys)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.columns = {col: np.asarray(columns[col], dtype=COLUMN_DTYPES[col]) for col in TRIP_LOG_COLUMNS}
+        self._positions = {key: i for i, key in enumerate(self._keys)}
+
+        if len(self.offsets) != len(self._keys) + 1:
+            raise ValueError("Expected {0} offsets for {1} trips, but got {2}.".format(
+                len(self._keys) + 1, len(self._keys), len(self.offsets)))
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __contains__(self, key):
+        return key in self._positions
+
+    def __getitem__(self, key):
+        start, end = self.trip_slice(key)
+        return pd.DataFrame({col: self.columns[col][start:end] for col in TRIP_LOG_COLUMNS})
+
+    def trip_slice(self, key):
+        """Returns the `(start, end)` row offsets of the given trip."""
+        i = self._positions[key]
+        return self.offsets[i], self.offsets[i + 1]
+
+    @property
+    def n_rows(self):
+        return int(self.offsets[-1])
+
+    def to_logbook(self):
+        """Returns the equivalent ordinary logbook (a `dict` of trip log `DataFrame` objects)."""
+        return {key: self[key] for key in self._keys}
+
+    def to_frame(self):
+        """Returns every trip log in a single `DataFrame`, with the logbook keys in a `unique_trip_id` column."""
+        frame = pd.DataFrame(self.columns)
+        frame.insert(1, 'unique_trip_id', np.repeat(np.array(self._keys, dtype=object), np.diff(self.offsets)))
+        return frame
+
+    @classmethod
+    def from_logbook(cls, logbook):
+        """Builds a `ColumnarLogbook` out of an ordinary logbook."""
+        keys = list(logbook.keys())
+        offsets = np.concatenate([[0], np.cumsum([len(logbook[key]) for key in keys])])
+        if keys:
+            columns = {col: np.concatenate([np.asarray(logbook[key][col]) for key in keys]).astype(COLUMN_DTYPES[col])
+                       for col in TRIP_LOG_COLUMNS}
+        else:
+            columns = {col: np.empty(0, dtype=COLUMN_DTYPES[col]) for col in TRIP_LOG_COLUMNS}
+        return cls(keys, offsets, columns)
+
+    def to_shared(self):
+        """
+        Copies the logbook into shared memory, returning a `gtfs_tripify.shared.SharedColumns` descriptor, which may
+        be sent to another process much more cheaply than the logbook itself. Rebuild it there using `from_shared`.
+        """
+        return SharedColumns.create({'keys': self._keys, 'offsets': self.offsets, 'columns': self.columns})
+
+    @classmethod
+    def from_shared(cls, descriptor, unlink=True):
+        """
+        Rebuilds a logbook sent using `to_shared`. The columns are copied out of shared memory once, and then (if
+        `unlink` is True) the shared memory is freed.
+        """
+        with descriptor.attach(unlink=unlink) as shared:
+            columns = shared['columns']
+            return cls(list(shared['keys']), np.array(shared['offsets'], dtype=np.int64),
+                       {col: np.array(columns[col], dtype=COLUMN_DTYPES[col]) for col in TRIP_LOG_COLUMNS})
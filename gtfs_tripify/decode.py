@@ -0,0 +1,333 @@
+"""
+Lightweight decoding stage. Turns raw GTFS-Realtime files into dictified feeds.
+
+This module deliberately does not import `pandas` or `numpy`, so that processes which only need to decode feeds
+(short-lived cron workers, process pool children) do not pay for importing the rest of the package.
+"""
+import hashlib
+import warnings
+
+# This module will only work if the Google parser is provided, but we do not want to make it a package dependency.
+try:
+    from google.transit import gtfs_realtime_pb2
+except ImportError:
+    pass
+
+
+def parse_feed(filepath):
+    """Helper function for reading a feed in using Protobuf. Handles bad feeds by replacing them with None."""
+    with open(filepath, "rb") as f:
+        return parse_feed_bytes(f.read())
+
+
+def parse_feed_bytes(content):
+    """Like `parse_feed`, but for a feed which has already been read into memory as raw bytes."""
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+
+        try:
+            fm = gtfs_realtime_pb2.FeedMessage()
+            fm.ParseFromString(content)
+            return fm
+
+        # Protobuf occasionally raises an unexpected tag RuntimeWarning. This occurs when a feed that we
+        # read has unexpected problems, but is still valid overall. This warning corresponds with data loss in
+        # most cases. `gtfs-tripify` is sensitive to the disappearance of trips in the record. If data is lost,
+        # it's best to excise the message entirely. Hence we catch these warnings and return a flag value None,
+        # to be taken into account upstream. For further information see the following thread:
+        # https://groups.google.com/forum/#!msg/mtadeveloperresources/9Fb4SLkxBmE/BlmaHWbfw6kJ
+        except RuntimeWarning:
+            return None
+
+        # Raise for system and user interrupt signals.
+        except (KeyboardInterrupt, SystemExit):
+            raise
+
+        # Return the same None flag value for all other (Protobuf-thrown) errors.
+        # TODO: do not use bare except.
+        except:
+            return None
+
+
+def decode_content(content, routes=None, trip_filter=None):
+    """
+    Decodes the raw bytes of a feed into a dictified feed, or None if the feed is bad. This is a convenient unit of
+    work to ship to worker processes. `routes` and `trip_filter` are passed through to `dictify`.
+    """
+    feed = parse_feed_bytes(content)
+    return None if feed is None else dictify(feed, routes=routes, trip_filter=trip_filter)
+
+
+def trip_predicate(routes=None, trip_filter=None):
+    """
+    Combines the `routes` and `trip_filter` decoding options into a single `(trip_id, route_id) -> bool` predicate.
+    Returns None if neither option is set.
+    """
+    if routes is None and trip_filter is None:
+        return None
+
+    routes = None if routes is None else set(routes)
+
+    def keep(trip_id, route_id):
+        return (routes is None or route_id in routes) and (trip_filter is None or trip_filter(trip_id, route_id))
+
+    return keep
+
+
+def dictify(feed, routes=None, trip_filter=None):
+    """
+    Parses a GTFS-Realtime feed that has been loaded into a `gtfs_realtime_pb2` object into a native dictionary
+    representation.
+
+    To only keep some of the trips in the feed, pass a list of route ids to `routes`, or a `(trip_id, route_id) ->
+    bool` function to `trip_filter`, or both. Trips which are filtered out are skipped before anything is built for
+    them. Filtering is done trip by trip, so each trip that is kept is kept along with all of its messages.
+    """
+    _feed = feed
+    feed = {
+        'header': {'gtfs_realtime_version': _feed.header.gtfs_realtime_version,
+                   'timestamp': _feed.header.timestamp},
+        'entity': []
+    }
+
+    # Helper functions for determining message types in the gtfs_realtime_pb2` object.
+    def is_vehicle_update(message):
+        return str(message.trip_update.trip.route_id) == '' and str(message.alert) == ''
+
+    def is_alert(message):
+        return str(message.alert) != ''
+
+    def is_trip_update(message):
+        return not is_vehicle_update(message) and not is_alert(message)
+
+    # Helper function for assigning status.
+    def munge_status(status_code):
+        statuses = {
+            0: 'INCOMING_AT',
+            1: 'STOPPED_AT',
+            2: 'IN_TRANSIT_TO'
+        }
+        return statuses[status_code]
+
+    # When filtering, find the trips that are being dropped first, so that their vehicle updates get dropped too.
+    keep = trip_predicate(routes, trip_filter)
+    kept_trip_ids = dropped_trip_ids = set()
+
+    if keep is not None:
+        kept_trip_ids, dropped_trip_ids = set(), set()
+        for _message in _feed.entity:
+            if is_trip_update(_message):
+                trip = _message.trip_update.trip
+                (kept_trip_ids if keep(trip.trip_id, trip.route_id) else dropped_trip_ids).add(trip.trip_id)
+        dropped_trip_ids -= kept_trip_ids
+
+    def is_dropped(message):
+        if keep is None:
+            return False
+        elif is_alert(message):
+            return not any(_entity.trip.trip_id in kept_trip_ids or keep(_entity.trip.trip_id, _entity.trip.route_id)
+                           for _entity in message.alert.informed_entity)
+        elif is_vehicle_update(message):
+            return message.vehicle.trip.trip_id in dropped_trip_ids
+        else:
+            return message.trip_update.trip.trip_id not in kept_trip_ids
+
+    for _message in _feed.entity:
+        if is_dropped(_message):
+            continue
+        elif is_trip_update(_message):
+            message = {
+                'id': _message.id,
+                'trip_update': {
+                    'trip': {
+                        'trip_id': _message.trip_update.trip.trip_id,
+                        'start_date': _message.trip_update.trip.start_date,
+                        'route_id': _message.trip_update.trip.route_id
+                    },
+                    'stop_time_update': [
+                        {
+                            'stop_id': _update.stop_id,
+                            'arrival': float('nan') if str(_update.arrival) == "" else _update.arrival.time,
+                            'departure': float('nan') if str(_update.departure) == "" else _update.departure.time
+                        } for _update in _message.trip_update.stop_time_update]
+                },
+                'type': 'trip_update'
+            }
+            feed['entity'].append(message)
+        elif is_vehicle_update(_message):
+            message = {
+                'id': _message.id,
+                'vehicle': {
+                    'trip': {
+                        'trip_id': _message.vehicle.trip.trip_id,
+                        'start_date': _message.vehicle.trip.start_date,
+                        'route_id': _message.vehicle.trip.route_id
+                    },
+                    'current_stop_sequence': _message.vehicle.current_stop_sequence,
+                    'current_status': munge_status(_message.vehicle.current_status),
+                    'timestamp': _message.vehicle.timestamp,
+                    'stop_id': _message.vehicle.stop_id
+                },
+                'type': 'vehicle_update'
+            }
+            feed['entity'].append(message)
+        else:  # is_alert
+            message = {
+                'id': _message.id,
+                'alert': {
+                    'header_text': {
+                        'translation': {
+                            # TODO
+                            'text': _message.alert.header_text.translation[0].text
+                        }
+                    },
+                    'informed_entity': [
+                        {
+                            'trip_id': _trip.trip.trip_id,
+                            'route_id': _trip.trip.route_id
+                        } for _trip in _message.alert.informed_entity]
+                },
+                'type': 'alert'
+            }
+            feed['entity'].append(message)
+
+    # Correct and warn about feed errors.
+    feed = correct(feed)
+
+    return feed
+
+
+def correct(feed):
+    """
+    Verifies that the inputted dictified feed has the expected schema. Raises warnings wherever issues are found,
+    and attempts to cure them.
+    """
+    # Capture and throw away vehicle updates that do not also have trip updates.
+    vehicle_update_ids = {m['vehicle']['trip']['trip_id'] for m in feed['entity'] if m['type'] == 'vehicle_update'}
+    trip_update_ids = {m['trip_update']['trip']['trip_id'] for m in feed['entity'] if m['type'] == 'trip_update'}
+    trip_update_only_ids = vehicle_update_ids.difference(trip_update_ids)
+
+    if len(trip_update_only_ids) > 0:
+        warnings.warn("The trips with IDs {0} are provided vehicle updates but not trip updates in the GTFS-R feed "
+                      "for {1}. These invalid trips were removed from the feed during pre-processing.".format(
+            trip_update_only_ids, feed['header']['timestamp'])
+        )
+        feed['entity'] = [m for m in feed['entity'] if (m['type'] != 'vehicle_update' or
+                                                        m['vehicle']['trip']['trip_id'] not in trip_update_only_ids)]
+
+    # Capture and throw away messages which have a null (empty string, '') trip id.
+    nonalert_ids = vehicle_update_ids | trip_update_ids
+    if '' in nonalert_ids:
+        warnings.warn("Some of the messages in the GTFS-R feed for {0} have a null trip id. These invalid messages "
+                      "were removed from the feed during pre-processing.".format(
+            trip_update_only_ids, feed['header']['timestamp'])
+        )
+        feed['entity'] = [m for m in feed['entity'] if ((m['type'] == 'vehicle_update' and
+                                                         m['vehicle']['trip']['trip_id'] != "") or
+                                                        (m['type'] == 'trip_update') and
+                                                         m['trip_update']['trip']['trip_id'] != "")]
+
+    return feed
+
+
+class FeedDeduplicator:
+    """
+    Ingest-stage deduplication and sorting of feeds.
+
+    Archive dumps frequently contain duplicate snapshots of the same feed, and are not always in time order. `logify`
+    assumes that its input is both unique and time-ordered: duplicates cost a redundant pass each, and out-of-order
+    feeds corrupt trip termination. Feeds are keyed on a hash of their raw content, so that exact duplicates can be
+    dropped before they are decoded at all, and then on their `header.timestamp`, which catches duplicate snapshots
+    which differ at the byte level.
+
+    Only the feeds seen within `horizon` seconds of the latest feed are remembered, so that memory use stays bounded
+    over a long stream: a duplicate of a feed older than that is no longer caught. Set `horizon` to None to remember
+    every feed. Counts of what was dropped or reordered are kept on the object, and reported by `report`.
+    """
+    def __init__(self, horizon=3600):
+        self.horizon = horizon
+        self.latest = None
+        # The feeds have not been decoded yet when their content hashes are recorded, so each hash is mapped to None
+        # at first, and then to the latest timestamp of the next batch of feeds deduplicated.
+        self.hashes = dict()
+        self.timestamps = set()
+        self.n_seen = 0
+        self.n_duplicates = 0
+        self.n_bad = 0
+        self.n_reordered = 0
+
+    def is_duplicate_content(self, content):
+        """
+        Returns True if a feed with this exact raw content has been seen before, and records it as seen otherwise.
+        Use this to skip decoding duplicate files.
+        """
+        digest = hashlib.sha1(content).digest()
+        self.n_seen += 1
+
+        if digest in self.hashes:
+            self.n_duplicates += 1
+            return True
+
+        self.hashes[digest] = None
+        return False
+
+    def deduplicate(self, feeds):
+        """
+        Given a list of dictified feeds (None values, standing in for bad feeds, are allowed), returns them with bad
+        feeds and feeds with an already-seen timestamp removed, sorted in time order.
+        """
+        ret = []
+        latest = None
+
+        for feed in feeds:
+            if feed is None:
+                self.n_bad += 1
+                continue
+
+            timestamp = feed['header']['timestamp']
+            if timestamp in self.timestamps:
+                self.n_duplicates += 1
+                continue
+
+            if latest is not None and timestamp < latest:
+                self.n_reordered += 1
+            latest = timestamp if latest is None else max(latest, timestamp)
+
+            self.timestamps.add(timestamp)
+            ret.append(feed)
+
+        if ret:
+            self.latest = max(latest, self.latest if self.latest is not None else latest)
+            self._forget()
+        return sorted(ret, key=lambda feed: feed['header']['timestamp'])
+
+    def _forget(self):
+        """Drops the hashes and timestamps of feeds which are more than `horizon` seconds older than the latest."""
+        if self.horizon is None:
+            return
+
+        cutoff = self.latest - self.horizon
+        self.timestamps = {timestamp for timestamp in self.timestamps if timestamp >= cutoff}
+        self.hashes = {digest: self.latest if seen is None else seen for digest, seen in self.hashes.items()
+                       if seen is None or seen >= cutoff}
+
+    def report(self):
+        """Returns a dict summarizing the feeds seen, dropped, and reordered so far."""
+        return {'duplicates': self.n_duplicates, 'bad': self.n_bad, 'reordered': self.n_reordered}
+
+
+def deduplicate_feeds(contents, routes=None, trip_filter=None):
+    """
+    Decodes and dictifies a list of raw feeds (as bytes), dropping exact duplicates before decoding them, and then
+    dropping bad feeds and feeds with a duplicate `header.timestamp`. Returns the remaining feeds in time order, and
+    a report (as returned by `FeedDeduplicator.report`) of how many feeds were dropped or reordered. `routes` and
+    `trip_filter` are passed through to `dictify`.
+    """
+    deduplicator = FeedDeduplicator()
+    feeds = []
+
+    for content in contents:
+        if not deduplicator.is_duplicate_content(content):
+            feeds.append(decode_content(content, routes=routes, trip_filter=trip_filter))
+
+    return deduplicator.deduplicate(feeds), deduplicator.report()
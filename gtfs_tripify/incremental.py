@@ -0,0 +1,264 @@
+"""
+Incremental tripification. Where `logify` processes a finite list of feeds all at once, `IncrementalLogifier`
+accepts feeds one at a time, and emits trip logs as soon as the trips they describe are known to have finished.
+"""
+import json
+import os
+from collections import defaultdict
+
+from gtfs_tripify.tripify import _tripsort, _delta_action_log, _assemble_trip_log
+
+
+class IncrementalLogifier:
+    """
+    Incremental counterpart to `logify`. Push dictified feeds into it in time order using `push`. Each call returns a
+    logbook of the trips which were found to have finished as of that feed; trips still in progress may be inspected
+    at any time using `snapshot`.
+
+    Pushing a list of feeds through this object and then calling `snapshot` produces the same trip logs, under the
+    same keys, as calling `logify` on that same list. The `lean` parameter has the same meaning as it does there.
+
+    To carry trips which are still in progress over from one processing run to the next (for instance, trips running
+    across midnight, from one daily archive into the next), save the engine's `state` at the end of the first run,
+    and resume the next run from it using `from_state`.
+
+    To bound the memory the engine uses, set `max_records` to the number of action records (one per trip per feed) it
+    may hold in memory. Once there are more than that, the records of the longest-running trips are spilled to a
+    `gtfs_tripify.spill.SpillStore` on disk (in a temporary directory, or in `spill_path` if given) until at most half
+    that many are left, and paged back in when these trips finish. Spill volumes are reported in `metrics`. The engine
+    must be lean. Call `close` (or use the engine as a context manager) to delete the spilled trips once done; a
+    temporary spill directory is otherwise removed once the engine is garbage collected, or the interpreter exits.
+
+    By default, a trip is finished as soon as it is missing from a feed, as it is in `logify`. A feed glitch which
+    briefly drops trips from the feed would then split each of them in two. To tolerate such glitches in a
+    long-running process, set `ttl_feeds`, `ttl_seconds`, or both: a trip missing from the feed is then only finished
+    once it has gone unseen for `ttl_feeds` feeds or `ttl_seconds` seconds, whichever comes first, and carries on as
+    before if it reappears sooner. Trips finished this way are terminated as of the first feed they were missing from,
+    just as they would have been without a TTL, and are emitted and dropped from the engine.
+
+    Setting a TTL also bounds the memory the engine uses over weeks of operation, by forgetting the trip ids of trips
+    which have finished. If such a trip id is reused later on, its trip still gets a key of its own, but a different
+    one than `logify` would have given it.
+    """
+    def __init__(self, lean=True, max_records=None, spill_path=None, ttl_feeds=None, ttl_seconds=None):
+        if max_records is not None and not lean:
+            raise ValueError("Only a lean IncrementalLogifier can spill trips to disk.")
+        if ttl_feeds is not None and ttl_feeds < 1:
+            raise ValueError("Expected a ttl_feeds of at least 1, but got {0}.".format(ttl_feeds))
+        self.lean = lean
+        self.max_records = max_records
+        self.ttl_feeds = ttl_feeds
+        self.ttl_seconds = ttl_seconds
+        self._spill_path = spill_path
+        self._spill = None
+
+        # Timestamp of the most recent feed pushed.
+        self.timestamp = None
+
+        # Number of feeds pushed so far, and the number of those feeds each trip id was present in. Together these
+        # determine the key suffix assigned to a trip id, in the same way that `_feedsort` assigns it.
+        self._n_feeds = 0
+        self._presence = defaultdict(int)
+
+        # Action logs of the trips currently in progress, keyed by trip id, and the logbook key of each such trip.
+        # `_previous` holds the `_delta_action_log` state of each such trip.
+        self._action_logs = dict()
+        self._keys = dict()
+        self._previous = dict()
+
+        # Number of action records in `_action_logs`. Records spilled to disk are not counted.
+        self._n_records = 0
+
+        # Trips in progress which were missing from the latest feed, as `trip_id -> (number of feeds pushed before the
+        # first feed the trip was missing from, the timestamp of that feed, the timestamp of the last feed the trip
+        # was in)`.
+        self._absent = dict()
+
+    def __len__(self):
+        return len(self._action_logs)
+
+    @property
+    def active_trips(self):
+        """The logbook keys of the trips currently in progress."""
+        return list(self._keys.values())
+
+    def push(self, feed):
+        """
+        Pushes a dictified feed into the engine. Returns a logbook of the trips which terminated as of this feed,
+        which may be empty.
+        """
+        timestamp = feed['header']['timestamp']
+        table = _tripsort(feed)
+
+        # Trips which are in progress but absent from this feed have terminated, or, if a TTL is set, have terminated
+        # once they have been absent for longer than it.
+        finished = dict()
+        for trip_id in self._action_logs:
+            if trip_id not in table and trip_id not in self._absent:
+                self._absent[trip_id] = (self._n_feeds, timestamp, self.timestamp)
+        for trip_id in [trip_id for trip_id in self._absent if trip_id not in table]:
+            first_absent, terminated_time, last_seen = self._absent[trip_id]
+            if self._expired(self._n_feeds + 1 - first_absent, timestamp - last_seen):
+                key, trip_log = self._finish(trip_id, terminated_time)
+                finished[key] = trip_log
+
+        for trip_id, messages in table.items():
+            self._absent.pop(trip_id, None)
+            if trip_id not in self._action_logs:
+                self._keys[trip_id] = "{0}_{1}".format(trip_id, self._n_feeds - self._presence[trip_id])
+                self._action_logs[trip_id] = []
+
+            self._previous[trip_id] = _delta_action_log(messages, timestamp, self._previous.get(trip_id),
+                                                        lean=self.lean)
+            self._action_logs[trip_id].append(self._previous[trip_id][1])
+            self._presence[trip_id] += 1
+        self._n_records += len(table)
+
+        if self.max_records is not None and self._n_records > self.max_records:
+            self._spill_trips()
+
+        self._n_feeds += 1
+        self.timestamp = timestamp
+        return finished
+
+    def _expired(self, unseen_feeds, unseen_seconds):
+        """Whether a trip missing from the feed for the given number of feeds and seconds has terminated."""
+        if self.ttl_feeds is None and self.ttl_seconds is None:
+            return True
+        return ((self.ttl_feeds is not None and unseen_feeds >= self.ttl_feeds) or
+                (self.ttl_seconds is not None and unseen_seconds >= self.ttl_seconds))
+
+    @property
+    def metrics(self):
+        """
+        Memory and spill metrics: the number of trips in progress (including the number of those missing from the
+        latest feed, which have yet to reach their TTL), the number of trip ids tracked, the number of action records
+        held in memory, and the `SpillStore` metrics (the number of spills, and the number of trips, records and bytes
+        spilled to and paged back in from disk).
+        """
+        metrics = {'active_trips': len(self._action_logs), 'absent_trips': len(self._absent),
+                   'tracked_trip_ids': len(self._presence), 'records_in_memory': self._n_records}
+        if self._spill is not None:
+            metrics.update(self._spill.metrics)
+        return metrics
+
+    def _spill_trips(self):
+        """
+        Spills the action records of the longest-running trips to disk, until at most half of `max_records` are left
+        in memory. Trips are held in the order they were first seen in, so the longest-running ones come first.
+        """
+        from gtfs_tripify.spill import SpillStore
+        if self._spill is None:
+            self._spill = SpillStore(self._spill_path)
+
+        spilled = dict()
+        for trip_id, action_logs in self._action_logs.items():
+            if self._n_records <= self.max_records // 2:
+                break
+            if action_logs:
+                spilled[trip_id] = action_logs
+                self._n_records -= len(action_logs)
+        self._spill.write(spilled)
+        for trip_id in spilled:
+            self._action_logs[trip_id] = []
+
+    def _trip_action_logs(self, trip_id, pop=False):
+        """Returns the action records of a trip in progress, including any spilled to disk."""
+        action_logs = self._action_logs.pop(trip_id) if pop else self._action_logs[trip_id]
+        if self._spill is not None and trip_id in self._spill:
+            action_logs = self._spill.read(trip_id, pop=pop) + action_logs
+        return action_logs
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Deletes any trips spilled to disk. The engine may not be used afterwards."""
+        if self._spill is not None:
+            self._spill.close()
+
+    def snapshot(self):
+        """
+        Returns a logbook of the trips currently in progress. These trip logs are not terminated.
+        """
+        return {self._keys[trip_id]: _assemble_trip_log(self._trip_action_logs(trip_id), lean=self.lean)
+                for trip_id in self._action_logs}
+
+    def state(self):
+        """
+        Returns the state of the engine as a JSON-serializable `dict`, from which `from_state` can resume it. Only the
+        trips currently in progress are included, so the state stays small however long the engine has been running.
+
+        The state does not include the trip ids of trips that have already finished. If such a trip id is reused after
+        resuming, its trip still gets a key of its own, but a different one than `logify` would have given it. The
+        engine must be lean.
+        """
+        if not self.lean:
+            raise ValueError("Only the state of a lean IncrementalLogifier can be saved.")
+
+        trips = []
+        for trip_id in self._action_logs:
+            action_logs = self._trip_action_logs(trip_id)
+            # Stop lists rarely change from one feed to the next, so only the ones that do are written out.
+            records, stops = [], None
+            for lead_row, record_stops in action_logs:
+                records.append([lead_row, record_stops if record_stops != stops else None])
+                stops = record_stops
+            trips.append({'trip_id': trip_id, 'key': self._keys[trip_id], 'presence': self._presence[trip_id],
+                          'action_logs': records, 'absent': self._absent.get(trip_id)})
+
+        return {'timestamp': self.timestamp, 'n_feeds': self._n_feeds, 'trips': trips}
+
+    @classmethod
+    def from_state(cls, state, **kwargs):
+        """
+        Returns an engine resumed from a state returned by `state`. Keyword arguments (such as `max_records`) are
+        passed through to the constructor.
+        """
+        logifier = cls(lean=True, **kwargs)
+        logifier.timestamp = state['timestamp']
+        logifier._n_feeds = state['n_feeds']
+
+        for trip in state['trips']:
+            action_logs, stops = [], None
+            for lead_row, record_stops in trip['action_logs']:
+                stops = tuple(record_stops) if record_stops is not None else stops
+                action_logs.append((tuple(lead_row) if lead_row is not None else None, stops))
+
+            trip_id = trip['trip_id']
+            logifier._action_logs[trip_id] = action_logs
+            logifier._keys[trip_id] = trip['key']
+            logifier._presence[trip_id] = trip['presence']
+            if trip.get('absent') is not None:
+                logifier._absent[trip_id] = tuple(trip['absent'])
+            logifier._n_records += len(action_logs)
+
+        if logifier.max_records is not None and logifier._n_records > logifier.max_records:
+            logifier._spill_trips()
+        return logifier
+
+    def save(self, path):
+        """Saves the `state` of the engine to a JSON file."""
+        # Write to a temporary file first and then move it into place, so that a crash never leaves a corrupt state.
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.state(), f)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        """Returns an engine resumed from a state saved by `save`. Keyword arguments are passed to `from_state`."""
+        with open(path) as f:
+            return cls.from_state(json.load(f), **kwargs)
+
+    def _finish(self, trip_id, timestamp):
+        """Terminates the given trip at the given time, dropping it from the engine. Returns its key and trip log."""
+        key = self._keys.pop(trip_id)
+        self._previous.pop(trip_id, None)
+        self._absent.pop(trip_id, None)
+        if self.ttl_feeds is not None or self.ttl_seconds is not None:
+            del self._presence[trip_id]
+        self._n_records -= len(self._action_logs[trip_id])
+        return key, _assemble_trip_log(self._trip_action_logs(trip_id, pop=True), timestamp, lean=self.lean)
@@ -1,20 +1,48 @@
+import multiprocessing
+import os
+import sqlite3
+import time
+from queue import Empty, Full
+
+import numpy as np
 import pandas as pd
 import gtfs_tripify as gt
-import warnings
+from gtfs_tripify.columnar import ColumnarLogbook, TRIP_LOG_COLUMNS, COLUMN_DTYPES
+from gtfs_tripify.tripify import _join_trip_logs, _finish_trip
+from gtfs_tripify.decode import parse_feed, deduplicate_feeds  # noqa: F401 (parse_feed is re-exported)
 
-# This module will only work if the Google parser is provided, but we do not want to make it a package dependency.
-try:
-    from google.transit import gtfs_realtime_pb2
-except ImportError:
-    pass
 
+LOGBOOK_COLUMNS = ['trip_id', 'unique_trip_id', 'route_id', 'action', 'minimum_time', 'maximum_time', 'stop_id',
+                   'latest_information_time']
+
+
+SCHEMA_V2 = """
+CREATE TABLE IF NOT EXISTS Routes ("route_key" INTEGER PRIMARY KEY, "route_id" TEXT UNIQUE);
+CREATE TABLE IF NOT EXISTS Stops ("stop_key" INTEGER PRIMARY KEY, "stop_id" TEXT UNIQUE);
+CREATE TABLE IF NOT EXISTS Actions ("action_key" INTEGER PRIMARY KEY, "action" TEXT UNIQUE);
+CREATE TABLE IF NOT EXISTS Trips (
+  "trip_key" INTEGER PRIMARY KEY, "unique_trip_id" TEXT UNIQUE, "trip_id" TEXT,
+  "route_key" INTEGER REFERENCES Routes
+);
+CREATE TABLE IF NOT EXISTS Events (
+  "trip_key" INTEGER REFERENCES Trips, "seq" INTEGER, "route_key" INTEGER REFERENCES Routes,
+  "stop_key" INTEGER REFERENCES Stops, "action_key" INTEGER REFERENCES Actions,
+  "minimum_time" INTEGER, "maximum_time" INTEGER, "latest_information_time" INTEGER,
+  PRIMARY KEY (trip_key, seq)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS events_route_time ON Events (route_key, minimum_time, maximum_time);
+CREATE INDEX IF NOT EXISTS events_stop_time ON Events (stop_key, minimum_time, maximum_time, action_key);
+"""
+
+
+def _create_tables(c, schema=1):
+    """Creates the tables (and indexes) of the given version of the database schema, if they do not already exist."""
+    if schema == 2:
+        for statement in SCHEMA_V2.split(';'):
+            if statement.strip():
+                c.execute(statement)
+        return
 
-def logbook_to_sql(logbook, conn):
-    """
-    Write a logbook to a SQL database in a durable manner.
-    """
-    # Initialize the database.
-    c = conn.cursor()
     c.execute("""
 CREATE TABLE IF NOT EXISTS Logbooks (
   "event_id" INTEGER PRIMARY KEY,
@@ -22,117 +50,749 @@ CREATE TABLE IF NOT EXISTS Logbooks (
   "action" TEXT, "minimum_time" REAL, "maximum_time" REAL,
   "stop_id" TEXT, "latest_information_time" TEXT
 );""")
+    _create_indexes(c)
+
+
+def _schema_version(conn):
+    """Returns 2 if the database holds logbooks in the v2 schema, and 1 otherwise."""
+    tables = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table';")}
+    return 2 if 'Events' in tables else 1
+
+
+def _split_key(key):
+    """Splits a logbook key into its trip id and its integer suffix."""
+    idx = key.rfind("_")
+    return key[:idx], int(key[idx + 1:])
+
+
+def _used_suffixes(c, trip_id, schema=1):
+    """Returns the suffixes of the keys already in use in the database for the given trip id."""
+    # Keys for the trip id sort between `trip_id + '_'` and `trip_id + '`'`, the character after the underscore.
+    # Range queries like this one use the index on `unique_trip_id`.
+    used = set()
+    for (unique_trip_id,) in c.execute("""SELECT DISTINCT unique_trip_id FROM {0}
+                                          WHERE unique_trip_id >= ? AND unique_trip_id < ?;""".format(
+                                           'Trips' if schema == 2 else 'Logbooks'),
+                                       (trip_id + '_', trip_id + '`')):
+        root, _, suffix = unique_trip_id.rpartition('_')
+        if root == trip_id and suffix.isdigit():
+            used.add(int(suffix))
+    return used
+
+
+def _trip_log_rows(trip_log):
+    """Returns the rows of a trip log as tuples of native Python values, in `TRIP_LOG_COLUMNS` order."""
+    return list(trip_log.assign(stop_id=trip_log.stop_id.astype(str))[TRIP_LOG_COLUMNS]
+                .astype(object).itertuples(index=False, name=None))
+
+
+def _assign_keys(c, trips, schema=1):
+    """
+    Given trips as a list of `(key, rows)` pairs (see `_trip_log_rows`), returns a list of `(unique_trip_id, rows)`
+    pairs. Each trip keeps its logbook key, unless that key is already in use in the database, in which case it gets
+    a new key, numbered after the largest key in use for that trip id. Must be run inside of the same transaction as
+    the write for the keys assigned to be unique.
+    """
+    by_trip_id = dict()
+    for key, rows in trips:
+        trip_id, n = _split_key(key)
+        by_trip_id.setdefault(trip_id, []).append((n, rows))
+
+    ret = []
+    for trip_id, fragments in by_trip_id.items():
+        used = _used_suffixes(c, trip_id, schema=schema)
+        next_n = max(used | {n for n, _ in fragments}) + 1
+
+        for n, rows in fragments:
+            if n in used:
+                n, next_n = next_n, next_n + 1
+            used.add(n)
+            ret.append(("{0}_{1}".format(trip_id, n), rows))
+
+    return ret
+
+
+def _dimension(c, table, key_column, value_column, values):
+    """
+    Returns a dict mapping each of the given values to its integer key in a dimension table, adding the values
+    which are not in the table yet.
+    """
+    keys = dict((value, key) for key, value in c.execute("SELECT {0}, {1} FROM {2};".format(
+        key_column, value_column, table)))
+    missing = [value for value in set(values) if value not in keys]
+    if missing:
+        c.executemany("INSERT INTO {0} ({1}) VALUES (?);".format(table, value_column), [(v,) for v in missing])
+        keys.update((value, key) for key, value in c.execute(
+            "SELECT {0}, {1} FROM {2} WHERE {0} > ?;".format(key_column, value_column, table),
+            (max(keys.values(), default=0),)))
+    return keys
+
+
+def _epoch(t):
+    """Converts a time value to an integer epoch time, or None if it is missing."""
+    return None if t is None or t != t else int(t)
+
+
+def _insert_trips(c, trips, schema=1):
+    """Inserts trips, given as a list of `(unique_trip_id, rows)` pairs, into the database."""
+    if schema != 2:
+        c.executemany("""INSERT INTO Logbooks ({0}) VALUES ({1});""".format(
+            ', '.join(LOGBOOK_COLUMNS), ', '.join('?' * len(LOGBOOK_COLUMNS))),
+            [(row[0], unique_trip_id) + row[1:] for unique_trip_id, rows in trips for row in rows])
+        return
+
+    # Columns are indexed as in `TRIP_LOG_COLUMNS`.
+    routes = _dimension(c, 'Routes', 'route_key', 'route_id', (row[1] for _, rows in trips for row in rows))
+    actions = _dimension(c, 'Actions', 'action_key', 'action', (row[2] for _, rows in trips for row in rows))
+    stops = _dimension(c, 'Stops', 'stop_key', 'stop_id', (row[5] for _, rows in trips for row in rows))
+
+    events = []
+    for unique_trip_id, rows in trips:
+        if not rows:
+            continue
+        route_key = routes[rows[0][1]]
+        c.execute("INSERT INTO Trips (unique_trip_id, trip_id, route_key) VALUES (?, ?, ?);",
+                  (unique_trip_id, rows[0][0], route_key))
+        trip_key = c.lastrowid
+        events.extend((trip_key, seq, routes[row[1]], stops[row[5]], actions[row[2]], _epoch(row[3]),
+                       _epoch(row[4]), _epoch(row[6])) for seq, row in enumerate(rows))
+
+    c.executemany("INSERT INTO Events VALUES (?, ?, ?, ?, ?, ?, ?, ?);", events)
+
+
+def _write_trip_rows(c, trips, schema=1):
+    """Appends trips, given as a list of `(key, rows)` pairs, to the database, assigning them unique keys."""
+    _insert_trips(c, _assign_keys(c, trips, schema=schema), schema=schema)
+
+
+def _check_no_transaction(conn):
+    """
+    Raises a ValueError if the connection has a transaction open. Writes are made in transactions of their own, and
+    starting one would otherwise mean committing the caller's pending changes along with them.
+    """
+    if conn.in_transaction:
+        raise ValueError("The connection has a transaction open. Commit or roll it back before writing to it.")
+
+
+def _write_trips(conn, trips, schema=1):
+    """
+    Writes trips, given as a list of `(key, rows)` pairs, to the database in a single transaction. The transaction
+    takes the database write lock up front, so that the keys assigned cannot collide with those being assigned by
+    any other writer at the same time. Raises a ValueError if the connection has a transaction open already.
+    """
+    _check_no_transaction(conn)
+    c = conn.cursor()
+    try:
+        c.execute("BEGIN IMMEDIATE;")
+        _write_trip_rows(c, trips, schema=schema)
+        conn.commit()
+    except:
+        conn.rollback()
+        raise
+    finally:
+        c.close()
+
+
+def logbook_to_sql(logbook, conn, schema=1):
+    """
+    Write a logbook to a SQL database in a durable manner.
+
+    The `trip_id` values included in the GTFS-Realtime streams are not unique, and neither are the logbook keys
+    built from them: a trip id that gets reused across two different logbooks will be appended a 0 counter in both
+    logbooks. So each trip is written to the `unique_trip_id` column under its logbook key only if that key is not in
+    use in the database yet, and under the next free key for its trip id otherwise.
+
+    By default, every stop in every trip log is written to a single `Logbooks` table. Set `schema` to 2 to use the
+    more compact v2 schema instead. It stores routes, stops, actions and trips in dimension tables, and the stops
+    themselves in an `Events` table, referring to these by integer key, with integer epoch times. Use
+    `migrate_to_v2` to convert an existing database. `sql_to_logbook` reads either schema.
+
+    The logbook is written in a transaction of its own, so `conn` must not have a transaction open.
+    """
+    _check_no_transaction(conn)
+    c = conn.cursor()
+    _create_tables(c, schema=schema)
+    conn.commit()
+    c.close()
+
+    _write_trips(conn, [(key, _trip_log_rows(trip_log)) for key, trip_log in logbook.items()], schema=schema)
+
+
+def migrate_to_v2(conn, drop=False, chunk_size=65536):
+    """
+    Copies every trip in the `Logbooks` table of a database written using the (default) v1 schema into the v2 schema
+    (see `logbook_to_sql`), in a single transaction. Trips keep their `unique_trip_id`. If `drop` is True, the
+    `Logbooks` table is dropped afterwards, and the database vacuumed to reclaim the space it used. `conn` must not
+    have a transaction open.
+    """
+    _check_no_transaction(conn)
+    c = conn.cursor()
+    _create_tables(c, schema=2)
     conn.commit()
 
-    database_unique_ids = set(
-        [r[0] for r in c.execute("""SELECT DISTINCT unique_trip_id FROM Logbooks;""").fetchall()]
-    )
-    root_id_modifier_pairs = set((did[:-2], int(did[-1:])) for did in database_unique_ids)
-
-    # The `trip_id` values included in the GTFS-Realtime streams are not unique. This was the source of much pain
-    # in the design of the `gtfs-tripify` library. Furthermore, the modified trip key values used in the trip
-    # logs, which are unique within the triplog, are not unique in time: a trip id that gets reused across two
-    # different logbooks will be appended a 0 counter in both triplogs, which de-uniquifies the trip when it is
-    # written to the database.
-    #
-    # For the purposes of long-term storage, we must come up with our own unique keys.
-
-    # TODO: Address the Schlemiel the Painter's Algorithm characteristics of this algorithm.
-    # We should count up more smartly than just taking step sizes of 1.
-    # TODO: Investigate why this algorithm results in such high numbers when used for writing to the database.
-    # A typical `unique_trip_id` in the database might be 052800_GS.N03R_792, for no immediately identifiable reason.
-    # What the heck?
-    key_modifications = {}
-    for trip_id in logbook.keys():
-        idx = trip_id.rfind("_")
-        root, mod = trip_id[:idx], trip_id[idx + 1:]
-        orig_mod = mod
+    reader = conn.cursor()
+    try:
+        c.execute("BEGIN IMMEDIATE;")
+        reader.execute("SELECT unique_trip_id, {0} FROM Logbooks ORDER BY unique_trip_id, event_id;".format(
+            ', '.join(TRIP_LOG_COLUMNS)))
+
+        # Rows arrive grouped by trip. A trip may straddle two chunks, so the last trip in each chunk is held back.
+        pending = []
         while True:
-            if (root, mod) in root_id_modifier_pairs:
-                mod += 1
-            else:
-                new_mod = mod
-
-                # If the modifier is unchanged, break now---the key is servicable.
-                if new_mod == orig_mod:
-                    break
-
-                # If it has changed, there has been a collision in the table.
-                # Make sure to pick a new key that does not collide with anything in the logbook.
-                while True:
-                    potential_new_key = "{0}_{1}".format(root, new_mod)
-
-                    if potential_new_key in logbook.keys() or (root, new_mod) in root_id_modifier_pairs:
-                        new_mod += 1
-                    else:
-                        root_id_modifier_pairs.add((root, new_mod))
-                        key_modifications["{0}_{1}".format(root, orig_mod)] = "{0}_{1}".format(root, new_mod)
-                        break
+            rows = reader.fetchmany(chunk_size)
+            trips = pending
+            for row in rows:
+                if not trips or trips[-1][0] != row[0]:
+                    trips.append((row[0], []))
+                trips[-1][1].append(row[1:])
+            if not rows:
+                _insert_trips(c, trips, schema=2)
                 break
+            pending = trips[-1:]
+            _insert_trips(c, trips[:-1], schema=2)
+
+        if drop:
+            c.execute("DROP TABLE Logbooks;")
+        conn.commit()
+    except:
+        conn.rollback()
+        raise
+    finally:
+        reader.close()
+        c.close()
+
+    if drop:
+        conn.execute("VACUUM;")
+
+
+def _writer_loop(path, queue, batch_rows, flush_interval, schema, errors=None):
+    """
+    The body of the `SQLWriter` process. If it fails, the exception is sent back through the `errors` connection, so
+    that `SQLWriter.close` can raise it in the process which owns the writer.
+    """
+    try:
+        _write_queue(path, queue, batch_rows, flush_interval, schema)
+    except BaseException as e:
+        if errors is not None:
+            try:
+                errors.send(e)
+            except Exception:
+                # The exception itself could not be pickled.
+                errors.send(RuntimeError(repr(e)))
+        raise
+
+
+def _write_queue(path, queue, batch_rows, flush_interval, schema):
+    conn = sqlite3.connect(path, timeout=60)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    c = conn.cursor()
+    _create_tables(c, schema=schema)
+    conn.commit()
+    c.close()
+
+    done = False
+    while not done:
+        # Block until there is something to write, then keep collecting chunks until the batch is large enough, the
+        # queue runs dry for `flush_interval` seconds, or the writer is closed.
+        item = queue.get()
+        batch, n_rows = [], 0
+        deadline = time.monotonic() + flush_interval
+
+        while True:
+            if item is None:
+                done = True
+                break
+            batch.extend(item)
+            n_rows += sum(len(rows) for _, rows in item)
+            if n_rows >= batch_rows:
+                break
+            try:
+                item = queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except Empty:
+                break
+
+        if batch:
+            _write_trips(conn, batch, schema=schema)
+
+    conn.close()
+
+
+class SQLWriter:
+    """
+    A dedicated writer process for a SQLite database, for use when several processes are writing logbooks into the
+    same database at once.
+
+    Rather than each process writing to the database itself, and contending with the others for its locks, each
+    sends the logbooks it produces to this writer using `put`. The writer batches them up into large transactions
+    of at least `batch_rows` rows (or whatever has arrived within `flush_interval` seconds) and writes them out, one
+    at a time, assigning keys in the same way that `logbook_to_sql` does (and using the schema version `schema`). The
+    database is put into WAL mode, so that it may be read from while it is being written to.
+
+    Converting each logbook into rows happens in `put`, in the sending process, so that the writer has as little work
+    to do as possible. The writer may be passed to `multiprocessing.Process` workers as an argument. To use it with a
+    process pool instead, create it with a `multiprocessing.Manager().Queue()` as its `queue`.
+
+    Call `close` (or use the writer as a context manager) to wait for everything sent to be written. If the writer
+    process fails, the exception it failed with is raised by `close`, or by the `put` which finds it gone.
+    """
+    def __init__(self, path, batch_rows=100000, flush_interval=1.0, queue=None, maxsize=64, schema=1):
+        self.path = path
+        self.schema = schema
+        self.batch_rows = batch_rows
+        self.flush_interval = flush_interval
+        self.queue = queue if queue is not None else multiprocessing.Queue(maxsize)
+        self._process = None
+        self._errors = None
+        self._pid = None
+
+    def __getstate__(self):
+        # Worker processes only need the queue, and process handles cannot be pickled anyway.
+        state = self.__dict__.copy()
+        state['_process'] = None
+        state['_errors'] = None
+        return state
 
-    for key in key_modifications:
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start(self):
+        """Starts the writer process. Returns the writer."""
+        self._errors, errors = multiprocessing.Pipe(duplex=False)
+        self._process = multiprocessing.Process(
+            target=_writer_loop,
+            args=(self.path, self.queue, self.batch_rows, self.flush_interval, self.schema, errors),
+            daemon=True
+        )
+        self._process.start()
+        self._pid = os.getpid()
+        return self
+
+    def _send(self, item):
+        """
+        Puts an item on the queue, blocking while it is full. Gives up if the writer process dies in the meantime,
+        which only the process that started the writer can check for. Returns whether the item was sent.
+        """
+        while self._process is None or self._pid != os.getpid() or self._process.is_alive():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def put(self, logbook):
+        """Sends a logbook to the writer. Blocks if the writer is too far behind."""
+        if len(logbook) > 0 and not self._send([(key, _trip_log_rows(trip_log)) for key, trip_log in logbook.items()]):
+            self.close()
+
+    def close(self):
+        """
+        Waits for every logbook sent so far to be written, then stops the writer process. Raises the exception the
+        writer process failed with, if it failed.
+        """
+        if self._process is None:
+            return
+        sent = self._send(None)
+        self._process.join()
+        exitcode, self._process = self._process.exitcode, None
         try:
-            logbook[key_modifications[key]] = logbook.pop(key)
-        except:
-            import pdb; pdb.set_trace()
-            pass
+            error = self._errors.recv() if self._errors.poll() else None
+        except EOFError:
+            # The writer process exited without sending anything.
+            error = None
+        self._errors.close()
+        self._errors = None
 
-    # Write out.
-    if len(logbook) > 0:
-        pd.concat(
-            (logbook[trip_id]
-                .assign(unique_trip_id=trip_id)
-                [['trip_id', 'unique_trip_id', 'route_id', 'action', 'minimum_time', 'maximum_time', 'stop_id',
-                  'latest_information_time']]
-            ) for trip_id in logbook.keys()
-        ).to_sql('Logbooks', conn, if_exists='append', index=False)
+        if not sent or exitcode != 0:
+            # Whatever is left on the queue will never be read, so do not wait for it to be flushed on exit.
+            if hasattr(self.queue, 'cancel_join_thread'):
+                self.queue.cancel_join_thread()
+        if error is not None:
+            raise error
+        if exitcode != 0:
+            raise RuntimeError("The SQL writer process exited with code {0}.".format(exitcode))
+
+
+def _trip_ids(feed):
+    return {m['trip_update']['trip']['trip_id'] for m in feed['entity'] if m['type'] == 'trip_update'}
+
+
+def _open_keys(logbook, last_feed):
+    """Returns the keys of the trips in a logbook built from a chunk of a stream which are in progress at its end."""
+    # These are the latest trip under each trip id in the last feed. `_feedsort` numbers trips sharing a trip id in
+    # time order, so this is the one with the largest suffix.
+    latest = dict()
+    for key in logbook.keys():
+        trip_id, n = _split_key(key)
+        latest[trip_id] = max(n, latest.get(trip_id, n))
+    return {"{0}_{1}".format(trip_id, latest[trip_id]) for trip_id in _trip_ids(last_feed) if trip_id in latest}
+
+
+def carry_open_trips(logbook, open_trips, first_feed, last_feed, used=None):
+    """
+    The in-memory counterpart to `upsert_logbook_to_sql`, for writing consecutive chunks of the same stream to a
+    target that cannot be updated in place, such as a set of Parquet files.
+
+    `open_trips` is the logbook of trips which were still in progress at the end of the previous chunk, as returned
+    by the previous call. Each of these which is still present in this chunk's first feed is joined with its
+    continuation in `logbook`, and keeps its key, and every other one is finished, as of that feed. All other trips
+    get a fresh key, numbered after the largest key in use for their trip id. `used` maps trip ids to the largest key
+    suffix already in use in the target for them, and is updated with the keys assigned; pass the same dict to every
+    call to keep keys unique across the whole target.
+
+    Returns three logbooks: the open trips which have finished, the trips in this chunk which have finished, and the
+    trips still in progress at the end of this chunk, which should be held back and passed to the next call.
+    """
+    used = used if used is not None else dict()
+    for key in open_trips:
+        trip_id, n = _split_key(key)
+        used[trip_id] = max(n, used.get(trip_id, -1))
+
+    start_time = first_feed['header']['timestamp']
+    continuing_trip_ids = _trip_ids(first_feed)
+    open_keys = _open_keys(logbook, last_feed)
+
+    continued, finished_open = dict(), dict()
+    for key, trip_log in open_trips.items():
+        trip_id, _ = _split_key(key)
+        if trip_id in continuing_trip_ids and "{0}_0".format(trip_id) in logbook:
+            continued[trip_id] = (key, trip_log)
+        else:
+            finished_open[key] = _finish_trip(trip_log.copy(), start_time)
+
+    finished, still_open = dict(), dict()
+    for key, trip_log in logbook.items():
+        trip_id, n = _split_key(key)
+
+        if n == 0 and trip_id in continued:
+            unique_trip_id, open_trip_log = continued[trip_id]
+            trip_log = _join_trip_logs(open_trip_log, trip_log)
+        else:
+            used[trip_id] = used.get(trip_id, -1) + 1
+            unique_trip_id = "{0}_{1}".format(trip_id, used[trip_id])
+
+        if key in open_keys:
+            still_open[unique_trip_id] = trip_log
+        else:
+            finished[unique_trip_id] = trip_log
+
+    return finished_open, finished, still_open
+
+
+def _terminate_trip(c, unique_trip_id, timestamp, schema=1):
+    """Finishes a trip already in the database as of the given time, as `_finish_trip` does for a trip log."""
+    if schema != 2:
+        c.execute("""UPDATE Logbooks SET action = 'STOPPED_OR_SKIPPED'
+                     WHERE unique_trip_id = ? AND action IN ('EN_ROUTE_TO', 'EXPECTED_TO_SKIP');""",
+                  (unique_trip_id,))
+        c.execute("""UPDATE Logbooks SET maximum_time = ?
+                     WHERE unique_trip_id = ? AND maximum_time IS NULL;""", (timestamp, unique_trip_id))
+        return
+
+    actions = _dimension(c, 'Actions', 'action_key', 'action',
+                         ['STOPPED_OR_SKIPPED', 'EN_ROUTE_TO', 'EXPECTED_TO_SKIP'])
+    trip_key = c.execute("SELECT trip_key FROM Trips WHERE unique_trip_id = ?;", (unique_trip_id,)).fetchone()[0]
+    c.execute("UPDATE Events SET action_key = ? WHERE trip_key = ? AND action_key IN (?, ?);",
+              (actions['STOPPED_OR_SKIPPED'], trip_key, actions['EN_ROUTE_TO'], actions['EXPECTED_TO_SKIP']))
+    c.execute("UPDATE Events SET maximum_time = ? WHERE trip_key = ? AND maximum_time IS NULL;",
+              (_epoch(timestamp), trip_key))
+
+
+def _pop_trip(conn, c, unique_trip_id, schema=1):
+    """Reads a trip already in the database back out as a trip log, and deletes it from the database."""
+    if schema != 2:
+        trip_log = pd.read_sql("""SELECT * FROM Logbooks WHERE unique_trip_id = ? ORDER BY event_id;""", conn,
+                               params=(unique_trip_id,))
+        c.execute("""DELETE FROM Logbooks WHERE unique_trip_id = ?;""", (unique_trip_id,))
+    else:
+        trip_log = pd.read_sql("""
+SELECT Trips.trip_id, Routes.route_id, Actions.action, Events.minimum_time, Events.maximum_time, Stops.stop_id,
+  Events.latest_information_time
+FROM Events JOIN Trips USING (trip_key) JOIN Routes ON Events.route_key = Routes.route_key
+  JOIN Actions USING (action_key) JOIN Stops USING (stop_key)
+WHERE Trips.unique_trip_id = ? ORDER BY Events.seq;""", conn, params=(unique_trip_id,))
+        c.execute("DELETE FROM Events WHERE trip_key = (SELECT trip_key FROM Trips WHERE unique_trip_id = ?);",
+                  (unique_trip_id,))
+        c.execute("DELETE FROM Trips WHERE unique_trip_id = ?;", (unique_trip_id,))
+    return trip_log[TRIP_LOG_COLUMNS].astype(
+        {'minimum_time': float, 'maximum_time': float, 'latest_information_time': int})
+
+
+def upsert_logbook_to_sql(logbook, conn, first_feed, last_feed, schema=None):
+    """
+    Write the logbook generated from one chunk of a feed stream to a SQL database, merging trips which span chunk
+    boundaries into a single trip. `first_feed` and `last_feed` are the first and last (dictified) feeds in the chunk.
+
+    Use this method instead of `logbook_to_sql` when writing consecutive chunks of the same stream, one after the
+    other. Trips still in progress at the end of a chunk are recorded in an `OpenTrips` table. When the next chunk is
+    written, every open trip which is still present in that chunk's first feed is joined with its continuation (as
+    in `merge_logbooks`), and every open trip which is not is finished, as of that feed. The rows of the affected
+    trips are replaced, and the new trips appended, in a single transaction.
+
+    `schema` is the version of the database schema to write (see `logbook_to_sql`). By default, it is the version
+    of the tables already in the database, or 1 if there are none. `conn` must not have a transaction open.
+    """
+    _check_no_transaction(conn)
+    schema = schema if schema is not None else _schema_version(conn)
+    c = conn.cursor()
+    _create_tables(c, schema=schema)
+    c.execute("""
+CREATE TABLE IF NOT EXISTS OpenTrips ("unique_trip_id" TEXT PRIMARY KEY, "trip_id" TEXT);""")
+    conn.commit()
+
+    start_time = first_feed['header']['timestamp']
+    continuing_trip_ids = _trip_ids(first_feed)
+    open_keys = _open_keys(logbook, last_feed)
+
+    try:
+        c.execute("BEGIN IMMEDIATE;")
+        open_trips = dict(c.execute("""SELECT trip_id, unique_trip_id FROM OpenTrips;""").fetchall())
+
+        # Open trips which are not in the first feed of this chunk terminated before it.
+        for trip_id, unique_trip_id in open_trips.items():
+            if trip_id not in continuing_trip_ids or "{0}_0".format(trip_id) not in logbook:
+                _terminate_trip(c, unique_trip_id, start_time, schema=schema)
+        c.execute("""DELETE FROM OpenTrips;""")
+
+        # The rest are joined with their continuation in this chunk, and keep their database key. All other trips
+        # get a fresh key, numbered after the largest key already in use for their trip id.
+        used = dict()
+        trips = []
+        for key, trip_log in logbook.items():
+            trip_id, n = _split_key(key)
+
+            if n == 0 and trip_id in open_trips and trip_id in continuing_trip_ids:
+                unique_trip_id = open_trips[trip_id]
+                trip_log = _join_trip_logs(_pop_trip(conn, c, unique_trip_id, schema=schema), trip_log)
+            else:
+                if trip_id not in used:
+                    used[trip_id] = max(_used_suffixes(c, trip_id, schema=schema), default=-1)
+                used[trip_id] += 1
+                unique_trip_id = "{0}_{1}".format(trip_id, used[trip_id])
+
+            if key in open_keys:
+                c.execute("""INSERT INTO OpenTrips VALUES (?, ?);""", (unique_trip_id, trip_id))
+
+            trips.append((unique_trip_id, _trip_log_rows(trip_log)))
+
+        _insert_trips(c, trips, schema=schema)
+        conn.commit()
+    except:
+        conn.rollback()
+        raise
+    finally:
         c.close()
 
 
-def parse_feed(filepath):
-    """Helper function for reading a feed in using Protobuf. Handles bad feeds by replacing them with None."""
-    # TODO: tests.
-    with warnings.catch_warnings():
-        warnings.simplefilter("error")
+def _create_indexes(c):
+    """Creates the indexes `sql_to_logbook` relies upon, if they do not already exist."""
+    c.execute("""CREATE INDEX IF NOT EXISTS logbooks_unique_trip_id ON Logbooks (unique_trip_id);""")
+    c.execute("""CREATE INDEX IF NOT EXISTS logbooks_route_id_minimum_time ON Logbooks (route_id, minimum_time);""")
+    c.execute("""CREATE INDEX IF NOT EXISTS logbooks_minimum_time ON Logbooks (minimum_time);""")
+
+
+def _fetch_columns(c, query, params, dtypes, chunk_size):
+    """
+    Runs a query and returns its result as a list of `numpy` arrays, one per column, with the given dtypes (NULL
+    values become NaN in float columns). Each chunk of rows is converted into typed columns as soon as it arrives,
+    so that the rows themselves never pile up.
+    """
+    chunks = [[] for _ in dtypes]
+    c.execute(query, params)
+    while True:
+        rows = c.fetchmany(chunk_size)
+        if not rows:
+            break
+        for chunk, dtype, values in zip(chunks, dtypes, zip(*rows)):
+            chunk.append(np.array(values, dtype=dtype))
+    return [np.concatenate(chunk) if chunk else np.empty(0, dtype=dtype) for chunk, dtype in zip(chunks, dtypes)]
+
+
+def _trip_offsets(keys):
+    """Given the key of every row, grouped by trip, returns the offset index of the trips."""
+    boundaries = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+    return np.concatenate([[0], boundaries, [len(keys)]]) if len(keys) else np.zeros(1, dtype=np.int64)
+
+
+def _time_conditions(start, end):
+    conditions, params = [], []
+    if end is not None:
+        conditions.append("minimum_time < ?")
+        params.append(end)
+    if start is not None:
+        conditions.append("(maximum_time >= ? OR maximum_time IS NULL)")
+        params.append(start)
+    return conditions, params
+
+
+def sql_to_logbook(conn, routes=None, start=None, end=None, chunk_size=65536):
+    """
+    Read a logbook back out of a SQL database written to by `logbook_to_sql`, `upsert_logbook_to_sql`, or
+    `stream_to_sql`, in either schema version. Returns a `ColumnarLogbook` keyed by `unique_trip_id`.
+
+    To only read some of the trips in the database, pass a list of route ids to `routes`, or Unix timestamps to
+    `start` and `end`, or both. A trip is read if it has any stop with a time window overlapping `[start, end)`;
+    trips are always read in full. Filtering is done by the database, using its indexes (in the v1 schema, these are
+    created if they do not exist yet). Rows are fetched `chunk_size` at a time.
+    """
+    if _schema_version(conn) == 2:
+        return _sql_to_logbook_v2(conn, routes, start, end, chunk_size)
+
+    # Committing the new indexes would commit the caller's pending changes too, so these are skipped (and the read
+    # done without them) if a transaction is open.
+    c = conn.cursor()
+    if not conn.in_transaction:
+        try:
+            _create_indexes(c)
+            conn.commit()
+        except sqlite3.OperationalError:  # e.g. a read-only database
+            pass
+
+    conditions, params = _time_conditions(start, end)
+    if routes is not None:
+        routes = list(routes)
+        conditions.append("route_id IN ({0})".format(', '.join('?' * len(routes))))
+        params += routes
+
+    columns = ['unique_trip_id'] + TRIP_LOG_COLUMNS
+    query = "SELECT {0} FROM Logbooks".format(', '.join(columns))
+    if conditions:
+        query += " WHERE unique_trip_id IN (SELECT DISTINCT unique_trip_id FROM Logbooks WHERE {0})".format(
+            ' AND '.join(conditions))
+    query += " ORDER BY unique_trip_id, event_id;"
+
+    values = _fetch_columns(c, query, params, [COLUMN_DTYPES.get(col, object) for col in columns], chunk_size)
+    c.close()
+
+    # The rows are sorted by key, so each trip starts wherever the key changes.
+    data = dict(zip(columns, values))
+    keys = data.pop('unique_trip_id')
+    offsets = _trip_offsets(keys)
+    return ColumnarLogbook(keys[offsets[:-1]], offsets, data)
 
-        with open(filepath, "rb") as f:
-            try:
-                fm = gtfs_realtime_pb2.FeedMessage()
-                fm.ParseFromString(f.read())
-                return fm
 
-            # Protobuf occasionally raises an unexpected tag RuntimeWarning. This occurs when a feed that we
-            # read has unexpected problems, but is still valid overall. This warning corresponds with data loss in
-            # most cases. `gtfs-tripify` is sensitive to the disappearance of trips in the record. If data is lost,
-            # it's best to excise the message entirely. Hence we catch these warnings and return a flag value None,
-            # to be taken into account upstream. For further information see the following thread:
-            # https://groups.google.com/forum/#!msg/mtadeveloperresources/9Fb4SLkxBmE/BlmaHWbfw6kJ
-            except RuntimeWarning:
-                return None
+def _sql_to_logbook_v2(conn, routes, start, end, chunk_size):
+    """`sql_to_logbook`, for databases using the v2 schema."""
+    c = conn.cursor()
+
+    def dimension(table, key_column, value_column):
+        pairs = c.execute("SELECT {0}, {1} FROM {2};".format(key_column, value_column, table)).fetchall()
+        values = np.empty(max((key for key, _ in pairs), default=0) + 1, dtype=object)
+        for key, value in pairs:
+            values[key] = value
+        return values
+
+    route_ids = dimension('Routes', 'route_key', 'route_id')
+    stop_ids = dimension('Stops', 'stop_key', 'stop_id')
+    actions = dimension('Actions', 'action_key', 'action')
+
+    conditions, params = _time_conditions(start, end)
+    if routes is not None:
+        routes = list(routes)
+        conditions.insert(0, "route_key IN (SELECT route_key FROM Routes WHERE route_id IN ({0}))".format(
+            ', '.join('?' * len(routes))))
+        params = routes + params
+    where = " WHERE trip_key IN (SELECT DISTINCT trip_key FROM Events WHERE {0})".format(
+        ' AND '.join(conditions)) if conditions else ""
+
+    # Fetch the events as integer keys, and resolve these against the dimension tables afterwards, all at once.
+    trip_keys, route_keys, action_keys, minimum_time, maximum_time, stop_keys, latest_information_time = \
+        _fetch_columns(c, "SELECT trip_key, route_key, action_key, minimum_time, maximum_time, stop_key, "
+                          "latest_information_time FROM Events{0} ORDER BY trip_key, seq;".format(where), params,
+                       [np.int64] * 3 + [np.float64] * 2 + [np.int64] * 2, chunk_size)
+    trip_table_keys, unique_trip_ids, trip_ids = _fetch_columns(
+        c, "SELECT trip_key, unique_trip_id, trip_id FROM Trips{0} ORDER BY trip_key;".format(where), params,
+        [np.int64, object, object], chunk_size)
+    c.close()
+
+    offsets = _trip_offsets(trip_keys)
+    trips = np.searchsorted(trip_table_keys, trip_keys[offsets[:-1]])
+    data = {
+        'trip_id': np.repeat(trip_ids[trips], np.diff(offsets)),
+        'route_id': route_ids[route_keys],
+        'action': actions[action_keys],
+        'minimum_time': minimum_time,
+        'maximum_time': maximum_time,
+        'stop_id': stop_ids[stop_keys],
+        'latest_information_time': latest_information_time
+    }
+    return ColumnarLogbook(unique_trip_ids[trips], offsets, data)
 
-            # Raise for system and user interrupt signals.
-            except (KeyboardInterrupt, SystemExit):
-                raise
 
-            # Return the same None flag value for all other (Protobuf-thrown) errors.
-            # TODO: do not use bare except.
-            except:
-                return None
+def logbook_to_parquet(logbook, path):
+    """
+    Write a logbook to a Parquet file. The logbook keys are written to the `unique_trip_id` column. Requires one of
+    the `pyarrow` or `fastparquet` packages, which `pandas` uses to write Parquet.
+    """
+    columns = LOGBOOK_COLUMNS
+
+    if len(logbook) > 0:
+        df = pd.concat(logbook[trip_id].assign(unique_trip_id=trip_id)[columns] for trip_id in logbook.keys())
+    else:
+        df = pd.DataFrame(columns=columns)
+
+    df.reset_index(drop=True).to_parquet(path, index=False)
 
 
-def stream_to_sql(stream, conn, transform=None):
+def parquet_to_logbook(path):
+    """
+    Read a logbook written using `logbook_to_parquet` back out of a Parquet file, keyed by its `unique_trip_id`
+    column.
+    """
+    df = pd.read_parquet(path)
+    return {unique_trip_id: trip_log[TRIP_LOG_COLUMNS].reset_index(drop=True)
+            for unique_trip_id, trip_log in df.groupby('unique_trip_id', sort=False)}
+
+
+def stream_to_sql(stream, conn, transform=None, routes=None, trip_filter=None, upsert=False, sketches=None,
+                  schema=None):
     """
     Write the logbook generated from a parsed Protobuf stream into a SQL database in a durable manner. To transform
     the data in the logbook before writing to the database, provide a method doing so to the `transform` parameter.
+
+    When writing a long stream one chunk at a time, set `upsert` to True to have trips spanning two chunks merged into
+    a single trip in the database (see `upsert_logbook_to_sql`), instead of being written out as two partial trips.
+
+    `schema` is the version of the database schema to write (see `logbook_to_sql`). By default, it is the version of
+    the tables already in the database, or 1 if there are none.
+
+    When several processes are writing to the same database at once, pass each of them the same started `SQLWriter`
+    as `conn`, instead of a connection. `upsert` is not supported in this case, and the schema is the writer's own.
+
+    Duplicate feeds are dropped, and the remaining feeds are put in time order, before processing. To only process
+    some of the trips in the stream, use the `routes` and `trip_filter` parameters (see `dictify`).
+
+    To keep running travel time percentiles up to date as the stream is ingested, pass a
+    `gtfs_tripify.sketches.TravelTimeSketches` object to `sketches`. It is updated with the finished trips in the
+    logbook written.
     """
-    stream = [parse_feed(feed) for feed in stream]
-    stream = [feed for feed in stream if feed is not None]
-    stream = [gt.dictify(feed) for feed in stream]
+    if upsert and isinstance(conn, SQLWriter):
+        raise ValueError("Upserting through a SQLWriter is not supported.")
+
+    def read(filepath):
+        with open(filepath, "rb") as f:
+            return f.read()
+
+    stream, _ = deduplicate_feeds((read(filepath) for filepath in stream), routes=routes, trip_filter=trip_filter)
 
     logbook = gt.logify(stream)
+    boundary = (stream[0], stream[-1]) if stream else None
     del stream
 
     if transform:
         logbook = transform(logbook)
+    if sketches is not None:
+        sketches.update(logbook)
 
-    gt.io.logbook_to_sql(logbook, conn)
+    if isinstance(conn, SQLWriter):
+        conn.put(logbook)
+        return
+    schema = schema if schema is not None else _schema_version(conn)
+    if not upsert:
+        gt.io.logbook_to_sql(logbook, conn, schema=schema)
+    elif boundary is not None:
+        upsert_logbook_to_sql(logbook, conn, *boundary, schema=schema)
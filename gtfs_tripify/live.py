@@ -0,0 +1,112 @@
+"""
+Live GTFS-Realtime feed polling, built on `asyncio`.
+
+`iter_feeds` polls a GTFS-Realtime endpoint on a fixed cadence and yields each new feed it finds. `poll` pushes those
+feeds through an `IncrementalLogifier`, and yields the trips that finish as soon as they do.
+"""
+import asyncio
+import functools
+import http.client
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from gtfs_tripify.decode import decode_content
+
+
+class KeepAliveClient:
+    """
+    A minimal blocking HTTP client which reuses a single persistent connection to the feed endpoint between
+    requests, reconnecting only after an error. `fetch` is meant to be called from a worker thread.
+    """
+    def __init__(self, url, timeout=10.0, headers=None):
+        parsed = urllib.parse.urlsplit(url)
+        self.https = parsed.scheme == 'https'
+        self.host = parsed.netloc
+        self.path = (parsed.path or '/') + ('?' + parsed.query if parsed.query else '')
+        self.timeout = timeout
+        self.headers = dict(headers or {})
+        self._conn = None
+
+    def fetch(self):
+        """Returns the body of a GET request to the endpoint. Raises on network errors and non-200 responses."""
+        if self._conn is None:
+            connection_class = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            self._conn = connection_class(self.host, timeout=self.timeout)
+
+        try:
+            self._conn.request('GET', self.path, headers=self.headers)
+            response = self._conn.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException):
+            self.close()
+            raise
+
+        if response.status != 200:
+            raise http.client.HTTPException("GET {0} returned HTTP {1}.".format(self.path, response.status))
+        return body
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+async def iter_feeds(url, interval=30.0, timeout=10.0, headers=None, executor=None, routes=None, trip_filter=None):
+    """
+    Asynchronously polls the GTFS-Realtime endpoint at `url` every `interval` seconds, yielding each new dictified
+    feed.
+
+    Requests time out after `timeout` seconds; failed requests and bad feeds are skipped over. Feeds whose
+    `header.timestamp` is not newer than that of the last feed yielded (the endpoint has not updated yet, or has
+    served a stale copy) are dropped. Decoding happens off of the event loop, in `executor` if one is provided (a
+    `concurrent.futures.ProcessPoolExecutor` is a good choice), and in the default thread pool otherwise. `routes`
+    and `trip_filter` are passed through to `dictify`.
+    """
+    loop = asyncio.get_running_loop()
+    decode = functools.partial(decode_content, routes=routes, trip_filter=trip_filter)
+    client = KeepAliveClient(url, timeout=timeout, headers=headers)
+
+    # The client is not thread safe, so all requests go through a single dedicated thread.
+    fetcher = ThreadPoolExecutor(max_workers=1)
+    last_timestamp = None
+    next_poll = loop.time()
+
+    try:
+        while True:
+            try:
+                content = await asyncio.wait_for(loop.run_in_executor(fetcher, client.fetch), timeout)
+            except (OSError, http.client.HTTPException, asyncio.TimeoutError):
+                content = None
+
+            if content is not None:
+                feed = await loop.run_in_executor(executor, decode, content)
+
+                if feed is not None and (last_timestamp is None or feed['header']['timestamp'] > last_timestamp):
+                    last_timestamp = feed['header']['timestamp']
+                    yield feed
+
+            next_poll = max(next_poll + interval, loop.time())
+            await asyncio.sleep(next_poll - loop.time())
+    finally:
+        fetcher.submit(client.close)
+        fetcher.shutdown(wait=False)
+
+
+async def poll(url, interval=30.0, timeout=10.0, headers=None, executor=None, logifier=None, routes=None,
+               trip_filter=None):
+    """
+    Asynchronously polls the GTFS-Realtime endpoint at `url` (see `iter_feeds`), yielding a logbook of the trips
+    which finished every time at least one trip does.
+
+    Pass an `IncrementalLogifier` to `logifier` to keep a handle on the trips which are still in progress, or to
+    configure it, for instance with a TTL to ride out feed glitches (see `IncrementalLogifier`).
+    """
+    from gtfs_tripify.incremental import IncrementalLogifier
+
+    logifier = logifier if logifier is not None else IncrementalLogifier()
+
+    async for feed in iter_feeds(url, interval=interval, timeout=timeout, headers=headers, executor=executor,
+                                 routes=routes, trip_filter=trip_filter):
+        finished = logifier.push(feed)
+        if finished:
+            yield finished
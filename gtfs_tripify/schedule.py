@@ -0,0 +1,306 @@
+"""
+Static GTFS schedules.
+
+GTFS-Realtime feeds only ever list the stops that a train has left to make, so `tripify` has to piece the complete
+order of the stops on a trip together out of many partial lists (see `synthesize_route`). The static GTFS schedule
+for the same system lists the stops of every scheduled trip in order. A `Schedule` is a compact index of that
+information, built from the `trips.txt`, `stop_times.txt`, and (optionally) `stops.txt`, `calendar.txt`,
+`calendar_dates.txt`, and `agency.txt` files of a static GTFS feed, using `load_schedule`.
+
+Pass a schedule to `logify` to order the stops of each trip using it. Use `adherence` to compare the times that trips
+actually stopped at with the scheduled ones.
+
+Trips in a GTFS-Realtime feed are matched to scheduled trips by trip id. Realtime trip ids may also match the end of
+a scheduled trip id, after its first underscore. For instance, the MTA schedules trip `A20160501WKD_000850_1..N03R`
+as `000850_1..N03R` in its realtime feeds. Where several scheduled trips match, for instance the same trip run on
+weekdays and on weekends, the one that runs on the date given is used.
+
+Schedules may be saved to a directory of `numpy` `.npy` files, which `Schedule.load` reads using memory mapping.
+"""
+import datetime
+import io
+import os
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from gtfs_tripify.analytics import estimate_times
+
+TRIP_COLUMNS = ['trip_id', 'route_id', 'service_id', 'offset']
+STOP_TIME_COLUMNS = ['stop_id', 'arrival', 'departure']
+STOP_COLUMNS = ['stop_table_id', 'stop_name']
+CALENDAR_COLUMNS = ['calendar_service_id', 'weekdays', 'start_date', 'end_date']
+CALENDAR_DATE_COLUMNS = ['exception_service_id', 'exception_date', 'exception_type']
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+
+def _read_table(path, name, required=True):
+    """Reads a GTFS table out of a directory or a zip file, with every column as a string."""
+    if os.path.isdir(path):
+        filepath = os.path.join(path, name)
+        if not os.path.exists(filepath):
+            if required:
+                raise FileNotFoundError("The GTFS feed at {0!r} has no {1}.".format(path, name))
+            return None
+        return pd.read_csv(filepath, dtype=str, keep_default_na=False)
+
+    with zipfile.ZipFile(path) as archive:
+        if name not in archive.namelist():
+            if required:
+                raise FileNotFoundError("The GTFS feed at {0!r} has no {1}.".format(path, name))
+            return None
+        with archive.open(name) as f:
+            return pd.read_csv(io.TextIOWrapper(f, encoding='utf-8-sig'), dtype=str, keep_default_na=False)
+
+
+def _parse_times(times):
+    """Parses `HH:MM:SS` GTFS times (which may run past 24:00:00) into seconds, with -1 for missing times."""
+    times = pd.Series(times, dtype=object).str.strip()
+    parts = times.str.split(':', expand=True)
+    if parts.shape[1] != 3:
+        return np.full(len(times), -1, dtype=np.int32)
+    seconds = (pd.to_numeric(parts[0], errors='coerce') * 3600 + pd.to_numeric(parts[1], errors='coerce') * 60 +
+               pd.to_numeric(parts[2], errors='coerce'))
+    return seconds.fillna(-1).astype(np.int32).values
+
+
+def _strings(values):
+    # Fixed-width unicode arrays, unlike object arrays, can be memory mapped.
+    values = list(values)
+    return np.array(values, dtype=str) if values else np.empty(0, dtype='<U1')
+
+
+def _integers(table, columns):
+    """Parses the given columns of a GTFS table as integers, dropping the rows with a blank or malformed value."""
+    values = {col: pd.to_numeric(table[col], errors='coerce') for col in columns}
+    valid = np.logical_and.reduce([values[col].notna().values for col in columns])
+    return table.assign(**values).loc[valid].astype({col: np.int64 for col in columns})
+
+
+def _date(date):
+    """Converts a `datetime.date` or a `YYYYMMDD` string or integer into a `YYYYMMDD` integer."""
+    if isinstance(date, (datetime.date, datetime.datetime)):
+        return date.year * 10000 + date.month * 100 + date.day
+    return int(date)
+
+
+class Schedule:
+    """
+    An index of the scheduled stop sequences of every trip in a static GTFS feed.
+
+    `columns` holds the trips (`trip_id`, `route_id`, `service_id`, and `offset`), the stop times of each trip in
+    stop sequence order (`stop_id`, and `arrival` and `departure` in seconds after the start of the service day, or
+    -1 if not given), the names of the stops, and the service calendar. The stop times of the `i`th trip are
+    `offset[i]:offset[i + 1]`. `timezone` is the timezone the schedule is in.
+    """
+    def __init__(self, columns, timezone=None):
+        self.columns = columns
+        self.timezone = timezone
+
+        trip_ids = columns['trip_id'].tolist()
+        self._trips = dict()
+        for i, trip_id in enumerate(trip_ids):
+            self._trips.setdefault(trip_id, []).append(i)
+            if '_' in trip_id:
+                self._trips.setdefault(trip_id.split('_', 1)[1], []).append(i)
+        self._stop_names = dict(zip(columns['stop_table_id'].tolist(), columns['stop_name'].tolist()))
+        self._stop_orders = dict()
+        self._has_calendar = len(columns['calendar_service_id']) > 0 or len(columns['exception_service_id']) > 0
+
+    def __len__(self):
+        return len(self.columns['trip_id'])
+
+    def stop_name(self, stop_id):
+        """Returns the name of a stop, or None if the schedule does not list it."""
+        return self._stop_names.get(stop_id)
+
+    def services(self, date):
+        """Returns the set of service ids running on a date."""
+        date = _date(date)
+        weekday = datetime.date(date // 10000, date // 100 % 100, date % 100).weekday()
+        c = self.columns
+
+        running = ((c['start_date'] <= date) & (c['end_date'] >= date) & ((c['weekdays'] >> weekday) & 1 == 1))
+        services = set(c['calendar_service_id'][running].tolist())
+        on_date = c['exception_date'] == date
+        services |= set(c['exception_service_id'][on_date & (c['exception_type'] == 1)].tolist())
+        services -= set(c['exception_service_id'][on_date & (c['exception_type'] == 2)].tolist())
+        return services
+
+    def find_trips(self, trip_id, date=None):
+        """
+        Returns the positions of the scheduled trips matching a realtime trip id. If a `date` is given, only trips
+        running on that date are returned, unless the schedule has no service calendar at all.
+        """
+        matches = self._trips.get(trip_id, [])
+        if date is not None and matches and self._has_calendar:
+            services = self.services(date)
+            matches = [i for i in matches if self.columns['service_id'][i] in services]
+        return matches
+
+    def stop_order(self, trip_id, date=None):
+        """
+        Returns the scheduled order of the stops of a realtime trip id, as a tuple of stop ids, or None if it is not
+        in the schedule. If several scheduled trips match, the first one running on `date` (if given) is used.
+        """
+        if (trip_id, date) not in self._stop_orders:
+            matches = self.find_trips(trip_id, date)
+            if matches:
+                offset = self.columns['offset']
+                order = tuple(self.columns['stop_id'][offset[matches[0]]:offset[matches[0] + 1]].tolist())
+            else:
+                order = None
+            self._stop_orders[(trip_id, date)] = order
+        return self._stop_orders[(trip_id, date)]
+
+    def service_dates(self, timestamp):
+        """
+        Returns the service dates a trip seen at a Unix timestamp may be running on, as `YYYYMMDD` integers: the local
+        date in the schedule's timezone, and the day before it, since service days run past midnight.
+        """
+        local = pd.Timestamp(timestamp, unit='s', tz='UTC').tz_convert(self.timezone or 'UTC').date()
+        return [_date(local), _date(local - datetime.timedelta(days=1))]
+
+    def service_day_start(self, date):
+        """
+        Returns the Unix timestamp that schedule times on the given date are counted from: noon, local time, less
+        twelve hours (which is midnight, except on days when daylight saving time begins or ends).
+        """
+        date = _date(date)
+        noon = pd.Timestamp(year=date // 10000, month=date // 100 % 100, day=date % 100, hour=12)
+        if self.timezone:
+            noon = noon.tz_localize(self.timezone)
+        else:
+            noon = noon.tz_localize('UTC')
+        return int(noon.timestamp()) - 12 * 3600
+
+    def scheduled_times(self, date):
+        """
+        Returns the scheduled stop times of every trip running on a date, as a `DataFrame` with `trip_id` (the
+        realtime trip id, that is, the scheduled trip id after its first underscore, if it has one), `route_id`,
+        `stop_id`, `scheduled_arrival`, and `scheduled_departure` columns. Times are Unix timestamps, or NaN if not
+        given.
+        """
+        c = self.columns
+        running = np.isin(c['service_id'], list(self.services(date)))
+        trips = np.flatnonzero(running)
+        starts, ends = c['offset'][trips], c['offset'][trips + 1]
+        rows = np.concatenate([np.arange(s, e) for s, e in zip(starts, ends)]) if len(trips) else \
+            np.empty(0, dtype=np.int64)
+        trip_of_row = np.repeat(trips, ends - starts)
+
+        base = self.service_day_start(date)
+        arrival, departure = c['arrival'][rows].astype(np.float64), c['departure'][rows].astype(np.float64)
+        trip_ids = pd.Series(c['trip_id'][trips].astype(object))
+        realtime_ids = np.where(trip_ids.str.contains('_', regex=False), trip_ids.str.split('_', n=1).str[-1],
+                                trip_ids).astype(object)
+        return pd.DataFrame({
+            'trip_id': realtime_ids[np.searchsorted(trips, trip_of_row)],
+            'route_id': c['route_id'][trip_of_row].astype(object),
+            'stop_id': c['stop_id'][rows].astype(object),
+            'scheduled_arrival': np.where(arrival < 0, np.nan, arrival + base),
+            'scheduled_departure': np.where(departure < 0, np.nan, departure + base)
+        })
+
+    def save(self, path):
+        """Saves the schedule to a directory of `.npy` files at `path`."""
+        os.makedirs(path, exist_ok=True)
+        for col, values in self.columns.items():
+            np.save(os.path.join(path, col + '.npy'), values)
+        with open(os.path.join(path, 'timezone'), 'w') as f:
+            f.write(self.timezone or '')
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Loads a schedule saved using `save`, memory mapping its columns unless `mmap` is False."""
+        columns = {name[:-len('.npy')]: np.load(os.path.join(path, name), mmap_mode='r' if mmap else None)
+                   for name in os.listdir(path) if name.endswith('.npy')}
+        with open(os.path.join(path, 'timezone')) as f:
+            timezone = f.read() or None
+        return cls(columns, timezone=timezone)
+
+
+def load_schedule(path):
+    """
+    Builds a `Schedule` out of a static GTFS feed, which may be either a directory or a zip file. Only `trips.txt`
+    and `stop_times.txt` are required.
+    """
+    trips = _read_table(path, 'trips.txt')
+    stop_times = _read_table(path, 'stop_times.txt')
+    stops = _read_table(path, 'stops.txt', required=False)
+    calendar = _read_table(path, 'calendar.txt', required=False)
+    calendar_dates = _read_table(path, 'calendar_dates.txt', required=False)
+    agency = _read_table(path, 'agency.txt', required=False)
+
+    # Put the stop times in trip order, and in stop sequence order within each trip.
+    trip_positions = pd.Series(np.arange(len(trips)), index=trips['trip_id'].values)
+    stop_times = stop_times.assign(
+        trip=trip_positions.reindex(stop_times['trip_id'].values).values,
+        sequence=pd.to_numeric(stop_times['stop_sequence'])
+    ).dropna(subset=['trip'])
+    stop_times = stop_times.sort_values(['trip', 'sequence'], kind='stable')
+    counts = np.bincount(stop_times['trip'].astype(np.int64).values, minlength=len(trips))
+
+    columns = {
+        'trip_id': _strings(trips['trip_id']),
+        'route_id': _strings(trips['route_id']),
+        'service_id': _strings(trips['service_id'] if 'service_id' in trips else [''] * len(trips)),
+        'offset': np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+        'stop_id': _strings(stop_times['stop_id']),
+        'arrival': _parse_times(stop_times['arrival_time']),
+        'departure': _parse_times(stop_times['departure_time']),
+        'stop_table_id': _strings(stops['stop_id'] if stops is not None else []),
+        'stop_name': _strings(stops['stop_name'] if stops is not None and 'stop_name' in stops else
+                              ([''] * len(stops) if stops is not None else [])),
+    }
+
+    calendar = calendar if calendar is not None else pd.DataFrame(columns=['service_id', 'start_date', 'end_date'] +
+                                                                  WEEKDAYS)
+    calendar = _integers(calendar, ['start_date', 'end_date'] + WEEKDAYS)
+    weekdays = np.zeros(len(calendar), dtype=np.int64)
+    for i, day in enumerate(WEEKDAYS):
+        weekdays |= (calendar[day].astype(np.int64).values & 1) << i
+    columns.update({
+        'calendar_service_id': _strings(calendar['service_id']),
+        'weekdays': weekdays,
+        'start_date': calendar['start_date'].astype(np.int64).values,
+        'end_date': calendar['end_date'].astype(np.int64).values
+    })
+
+    calendar_dates = calendar_dates if calendar_dates is not None else \
+        pd.DataFrame(columns=['service_id', 'date', 'exception_type'])
+    calendar_dates = _integers(calendar_dates, ['date', 'exception_type'])
+    columns.update({
+        'exception_service_id': _strings(calendar_dates['service_id']),
+        'exception_date': calendar_dates['date'].astype(np.int64).values,
+        'exception_type': calendar_dates['exception_type'].astype(np.int64).values
+    })
+
+    timezone = agency['agency_timezone'].iloc[0] if agency is not None and len(agency) and \
+        'agency_timezone' in agency else None
+    return Schedule(columns, timezone=timezone)
+
+
+def adherence(logbook, schedule, date, method='midpoint'):
+    """
+    Joins the stops in a logbook against their scheduled times on the given date (a `datetime.date`, or a `YYYYMMDD`
+    string or integer). Returns the output of `gtfs_tripify.analytics.estimate_times`, restricted to stops that are
+    in the schedule, with `scheduled_arrival`, `scheduled_departure`, and `delay` columns added. `delay` is the
+    estimated time less the scheduled arrival time (or departure time, if there is no arrival time), in seconds.
+
+    Trips are matched to the schedule on their trip id and the stop id, in a single hash join over every stop in the
+    logbook.
+    """
+    events = estimate_times(logbook, method=method)
+    scheduled = schedule.scheduled_times(date).drop(columns='route_id')
+
+    # Trips running on a date are unique by trip id, but a trip may make the same stop more than once; keep the
+    # first visit.
+    scheduled = scheduled.drop_duplicates(['trip_id', 'stop_id'])
+
+    events = events.assign(trip_id=events['unique_trip_id'].astype(str).str.rsplit('_', n=1).str[0],
+                           stop_id=events['stop_id'].astype(object))
+    joined = events.merge(scheduled, on=['trip_id', 'stop_id'], how='inner')
+    reference = joined['scheduled_arrival'].fillna(joined['scheduled_departure'])
+    return joined.assign(delay=joined['estimated_time'] - reference)
@@ -0,0 +1,184 @@
+"""
+Shared-memory hand-off of columnar data between processes.
+
+Sending decoded feeds, action logs, or trip logs to or from a worker process ordinarily means pickling them, and for
+nested `dict` objects and `DataFrame` objects that serialization cost quickly outweighs the gain from working in
+parallel. Instead, `SharedColumns.create` copies a set of columns into a single `multiprocessing.shared_memory`
+block, and returns a small descriptor object which is cheap to send to another process. That process attaches to
+the block using `SharedColumns.attach`, which maps the columns back out without copying them.
+
+Like `gtfs_tripify.decode`, this module does not import `numpy` or `pandas`.
+"""
+import contextlib
+import os
+import pickle
+from array import array
+from collections.abc import Sequence
+from multiprocessing import shared_memory
+
+# Windows frees a shared memory block as soon as the last handle to it is closed, which means that a block cannot
+# outlive the process which created it. There, the data travels inside of the descriptor instead.
+_INLINE = os.name == 'nt'
+
+# Column storage kinds: a typed buffer, a list of strings, or (for anything else) a pickle.
+_BUFFER, _STRINGS, _PICKLE = 'a', 's', 'p'
+
+
+class SharedStrings(Sequence):
+    """
+    A read-only list of strings, stored as UTF-8 bytes laid end to end, plus the offset of each one. Strings are only
+    decoded when they are read.
+    """
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        return str(self.data[self.offsets[i]:self.offsets[i + 1]], 'utf-8')
+
+
+def _is_strings(value):
+    return isinstance(value, (list, tuple, SharedStrings)) and all(isinstance(v, str) for v in value)
+
+
+def _encode(value):
+    """
+    Returns the storage kind of a column, its type code (for typed buffers), and the list of byte buffers it is
+    stored as.
+    """
+    if getattr(value, 'dtype', None) is not None and value.dtype.kind == 'O':
+        value = list(value)
+
+    if isinstance(value, (array, memoryview)) or hasattr(value, '__array_interface__'):
+        view = memoryview(value)
+        data = view.cast('B') if view.c_contiguous else memoryview(view.tobytes())
+        # Some formats carry a byte order prefix (e.g. '<d'); the last character is the type code.
+        return _BUFFER, view.format[-1], [data]
+    elif _is_strings(value):
+        encoded = [s.encode('utf-8') for s in value]
+        offsets = array('q', [0])
+        total = 0
+        for s in encoded:
+            total += len(s)
+            offsets.append(total)
+        return _STRINGS, 'q', [b''.join(encoded), memoryview(offsets).cast('B')]
+    else:
+        return _PICKLE, '', [pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)]
+
+
+def _flatten(columns, path=()):
+    """Yields a `(path, value)` pair for every column in a (possibly nested) `dict` of columns."""
+    for key, value in columns.items():
+        if isinstance(value, dict) and value and all(isinstance(k, str) for k in value):
+            yield from _flatten(value, path + (key,))
+        else:
+            yield path + (key,), value
+
+
+class SharedColumns:
+    """
+    A descriptor of a set of columns held in a shared memory block. Create one using `create`; send it to another
+    process (it pickles to a few hundred bytes); and map the columns back out there using `attach`.
+
+    Columns may be one-dimensional typed buffers (`array.array` objects, `numpy` arrays of numbers, or `memoryview`
+    objects), which are mapped back out as `memoryview` objects over the block; lists of strings (or `numpy` object
+    arrays of strings), which are mapped back out as `SharedStrings` objects over the block; or any other picklable
+    value, which is pickled. Nested `dict` objects of columns are supported.
+
+    The block belongs to whichever process consumes it, which should pass `unlink=True` to `attach` (or call
+    `unlink`) once it is done with it.
+    """
+    def __init__(self, name, layout, size, data=None):
+        self.name = name
+        self.layout = layout
+        self.size = size
+        self.data = data
+
+    @classmethod
+    def create(cls, columns):
+        """Copies a `dict` of columns into a new shared memory block, returning its descriptor."""
+        layout, buffers, offset = [], [], 0
+        for path, value in _flatten(columns):
+            kind, typecode, parts = _encode(value)
+            spans = []
+            for part in parts:
+                spans.append((offset, len(part)))
+                buffers.append((offset, part))
+                # Keep every buffer 8-byte aligned, so that typed views over the block are aligned.
+                offset += (len(part) + 7) // 8 * 8
+            layout.append((path, kind, typecode, spans))
+
+        if _INLINE:
+            data = bytearray(offset)
+            for start, part in buffers:
+                data[start:start + len(part)] = part
+            return cls(None, layout, offset, bytes(data))
+
+        shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        try:
+            for start, part in buffers:
+                shm.buf[start:start + len(part)] = part
+        finally:
+            shm.close()
+        return cls(shm.name, layout, offset)
+
+    @contextlib.contextmanager
+    def attach(self, unlink=False):
+        """
+        Context manager which maps the columns in the block back out, without copying them, as a nested `dict`
+        shaped like the one passed to `create`. The columns are only valid inside of the `with` block: copy out
+        anything which needs to outlive it. If `unlink` is True, the block is freed afterwards.
+        """
+        shm = None if self.data is not None else shared_memory.SharedMemory(name=self.name)
+        buf = memoryview(self.data) if shm is None else shm.buf
+        views = []
+
+        def view(span, typecode='B'):
+            start, length = span
+            v = buf[start:start + length]
+            views.append(v)
+            if typecode != 'B':
+                v = v.cast(typecode)
+                views.append(v)
+            return v
+
+        try:
+            columns = dict()
+            for path, kind, typecode, spans in self.layout:
+                if kind == _BUFFER:
+                    value = view(spans[0], typecode)
+                elif kind == _STRINGS:
+                    value = SharedStrings(view(spans[0]), view(spans[1], typecode))
+                else:
+                    start, length = spans[0]
+                    value = pickle.loads(buf[start:start + length])
+
+                target = columns
+                for key in path[:-1]:
+                    target = target.setdefault(key, dict())
+                target[path[-1]] = value
+
+            yield columns
+        finally:
+            for v in reversed(views):
+                v.release()
+            if shm is None:
+                buf.release()
+            else:
+                shm.close()
+                if unlink:
+                    shm.unlink()
+
+    def unlink(self):
+        """Frees the block without reading it."""
+        if self.data is None:
+            shm = shared_memory.SharedMemory(name=self.name)
+            shm.close()
+            shm.unlink()
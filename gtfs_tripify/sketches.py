@@ -0,0 +1,261 @@
+"""
+Mergeable quantile sketches of travel times.
+
+Computing travel time percentiles over a large database means reading every stop in it. Instead, a
+`TravelTimeSketches` object keeps a small `QuantileSketch` of the travel times between each pair of consecutive stops
+on each route, in each hour, and is updated with every logbook as it is ingested. Percentiles can then be read off of
+the sketches at any time.
+
+The sketches follow the DDSketch design: values are counted in buckets whose bounds grow geometrically, so that every
+quantile is estimated to within a fixed relative error. Merging two sketches adds their bucket counts together, which
+is associative and commutative, so the sketches for separate shards of the data can be built in parallel and combined
+afterwards in any order.
+"""
+import json
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+from gtfs_tripify.analytics import estimate_times
+
+SKETCH_KEY_COLUMNS = ['route_id', 'from_stop', 'to_stop', 'bucket']
+
+
+class QuantileSketch:
+    """
+    A quantile sketch of non-negative values. Quantiles estimated from it are within `relative_accuracy` of a value
+    of the true quantile. Values smaller than `min_value` are counted as zero.
+    """
+    def __init__(self, relative_accuracy=0.01, min_value=1e-3):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("Expected a relative accuracy between 0 and 1, but got {0}.".format(relative_accuracy))
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+
+        self.bins = dict()
+        self.zero_count = 0
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def __len__(self):
+        return self.count
+
+    def bin_indices(self, values):
+        """Returns the bin index of each of the given values. Values below `min_value` belong in the zero count."""
+        values = np.asarray(values, dtype=np.float64)
+        return np.ceil(np.log(np.maximum(values, self.min_value)) / self._log_gamma).astype(np.int64)
+
+    def add(self, values, counts=None):
+        """
+        Adds a value, or an array of values, to the sketch. If `counts` is given, the `i`th value is added `counts[i]`
+        times.
+        """
+        self.update_many(np.atleast_1d(np.asarray(values, dtype=np.float64)),
+                         None if counts is None else np.atleast_1d(counts))
+
+    def update_many(self, values, counts=None):
+        """
+        Adds an array of values to the sketch in a single vectorized pass: every value is binned at once, and the
+        number of values falling into each bin is tallied before the bins are updated. If `counts` is given, the `i`th
+        value is added `counts[i]` times.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        counts = np.ones(len(values), dtype=np.int64) if counts is None else np.asarray(counts)
+        if len(values) == 0:
+            return
+
+        if (values < 0).any():
+            raise ValueError("Quantile sketches only accept non-negative values.")
+
+        zero = values < self.min_value
+        self.zero_count += int(counts[zero].sum())
+        indices, index_counts = np.unique(self.bin_indices(values[~zero]), return_inverse=True)
+        for index, count in zip(indices.tolist(), np.bincount(index_counts, weights=counts[~zero]).tolist()):
+            self.bins[index] = self.bins.get(index, 0) + int(count)
+
+        self.count += int(counts.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    def _check_compatible(self, other):
+        if (other.relative_accuracy, other.min_value) != (self.relative_accuracy, self.min_value):
+            raise ValueError("Cannot merge sketches with different relative accuracies or minimum values.")
+
+    def merge(self, other):
+        """Merges another sketch, with the same parameters, into this one. Returns this sketch."""
+        self._check_compatible(other)
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def quantile(self, q):
+        """Returns an estimate of the `q`th quantile (for `q` between 0 and 1), or NaN if the sketch is empty."""
+        if self.count == 0:
+            return math.nan
+
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return self.min
+
+        seen = self.zero_count
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def to_dict(self):
+        """Returns the sketch as a JSON-serializable `dict`."""
+        return {'relative_accuracy': self.relative_accuracy, 'min_value': self.min_value,
+                'bins': [[index, count] for index, count in sorted(self.bins.items())],
+                'zero_count': self.zero_count, 'count': self.count,
+                'min': self.min if self.count else None, 'max': self.max if self.count else None}
+
+    @classmethod
+    def from_dict(cls, state):
+        """Rebuilds a sketch from the output of `to_dict`."""
+        sketch = cls(state['relative_accuracy'], state['min_value'])
+        sketch.bins = {index: count for index, count in state['bins']}
+        sketch.zero_count, sketch.count = state['zero_count'], state['count']
+        if sketch.count:
+            sketch.min, sketch.max = state['min'], state['max']
+        return sketch
+
+
+class TravelTimeSketches:
+    """
+    Quantile sketches of the travel times between consecutive stops, keyed by `(route_id, from_stop, to_stop,
+    bucket)`, where `bucket` is the Unix timestamp at which the `freq`-second bucket (by default, hourly) the train
+    left `from_stop` in starts.
+
+    Travel times are taken between the estimated times (see `gtfs_tripify.analytics.estimate_times`) of consecutive
+    stops that a train is known to have passed through. Only finished trips are counted, so that a trip which is
+    still in progress in one logbook is not counted a second time once it finishes in the next.
+    """
+    def __init__(self, relative_accuracy=0.01, freq=3600, method='midpoint'):
+        self.relative_accuracy = relative_accuracy
+        self.freq = freq
+        self.method = method
+        self.sketches = dict()
+
+    def __len__(self):
+        return len(self.sketches)
+
+    def _new_sketch(self):
+        return QuantileSketch(self.relative_accuracy)
+
+    def segments(self, logbook):
+        """
+        Returns the travel time segments of the finished trips in a logbook, as a `DataFrame` with the
+        `SKETCH_KEY_COLUMNS` and a `travel_time` column.
+        """
+        events = estimate_times(logbook, method=self.method, actions=None)
+        trips = events['unique_trip_id'].cat.codes.values
+
+        # A trip is finished if there are no stops left that it is still en route to.
+        en_route = np.bincount(trips[(events['action'] == 'EN_ROUTE_TO').values],
+                               minlength=len(events['unique_trip_id'].cat.categories)) > 0
+        passed = events['action'].isin(['STOPPED_AT', 'STOPPED_OR_SKIPPED']).values & ~en_route[trips]
+        events = events[passed]
+        trips = trips[passed]
+
+        times = events['estimated_time'].values
+        same_trip = trips[1:] == trips[:-1]
+        stops, routes = events['stop_id'].astype(object).values, events['route_id'].astype(object).values
+        return pd.DataFrame({
+            'route_id': routes[:-1][same_trip],
+            'from_stop': stops[:-1][same_trip],
+            'to_stop': stops[1:][same_trip],
+            'bucket': (times[:-1][same_trip] // self.freq * self.freq).astype(np.int64),
+            'travel_time': np.maximum(times[1:] - times[:-1], 0)[same_trip]
+        })
+
+    def update(self, logbook):
+        """Adds the travel times of the finished trips in a logbook to the sketches."""
+        segments = self.segments(logbook)
+        if len(segments) == 0:
+            return
+
+        # Group the travel times by sketch in one pass, in order of first appearance, then add each group to its
+        # sketch all at once.
+        groups = segments.groupby(SKETCH_KEY_COLUMNS, sort=False).ngroup().values
+        order = np.argsort(groups, kind='stable')
+        boundaries = np.flatnonzero(np.diff(groups[order])) + 1
+        keys = segments[SKETCH_KEY_COLUMNS].values[order[np.concatenate([[0], boundaries])]].tolist()
+
+        for (route_id, from_stop, to_stop, bucket), values in zip(
+                keys, np.split(segments['travel_time'].values[order], boundaries)):
+            key = (route_id, from_stop, to_stop, int(bucket))
+            sketch = self.sketches.get(key)
+            if sketch is None:
+                sketch = self.sketches[key] = self._new_sketch()
+            sketch.update_many(values)
+
+    def merge(self, other):
+        """Merges another set of sketches, with the same parameters, into this one. Returns this object."""
+        if (other.relative_accuracy, other.freq) != (self.relative_accuracy, self.freq):
+            raise ValueError("Cannot merge travel time sketches with different accuracies or bucket sizes.")
+        for key, sketch in other.sketches.items():
+            if key in self.sketches:
+                self.sketches[key].merge(sketch)
+            else:
+                self.sketches[key] = QuantileSketch.from_dict(sketch.to_dict())
+        return self
+
+    def quantiles(self, qs=(0.5, 0.9, 0.99), route_id=None, bucketed=True):
+        """
+        Returns a `DataFrame` of travel time quantiles, indexed by the sketch keys, with a `count` column and one
+        column per quantile in `qs` (named `p50`, `p90`, and so on). Pass a `route_id` to only include that route. If
+        `bucketed` is False, the sketches for each pair of stops are first merged across every time bucket.
+        """
+        sketches = {key: sketch for key, sketch in self.sketches.items() if route_id is None or key[0] == route_id}
+        key_columns = SKETCH_KEY_COLUMNS
+        if not bucketed:
+            merged = dict()
+            for key, sketch in sketches.items():
+                if key[:3] in merged:
+                    merged[key[:3]].merge(sketch)
+                else:
+                    merged[key[:3]] = QuantileSketch.from_dict(sketch.to_dict())
+            sketches, key_columns = merged, SKETCH_KEY_COLUMNS[:3]
+
+        columns = ['p{0:g}'.format(q * 100) for q in qs]
+        rows = [key + (sketch.count,) + tuple(sketch.quantile(q) for q in qs)
+                for key, sketch in sorted(sketches.items())]
+        return pd.DataFrame(rows, columns=key_columns + ['count'] + columns).set_index(key_columns)
+
+    def to_dict(self):
+        """Returns the sketches as a JSON-serializable `dict`."""
+        return {'relative_accuracy': self.relative_accuracy, 'freq': self.freq, 'method': self.method,
+                'sketches': [list(key) + [sketch.to_dict()] for key, sketch in self.sketches.items()]}
+
+    @classmethod
+    def from_dict(cls, state):
+        """Rebuilds a set of sketches from the output of `to_dict`."""
+        sketches = cls(state['relative_accuracy'], state['freq'], state['method'])
+        for route_id, from_stop, to_stop, bucket, sketch in state['sketches']:
+            sketches.sketches[(route_id, from_stop, to_stop, bucket)] = QuantileSketch.from_dict(sketch)
+        return sketches
+
+    def save(self, path):
+        """Saves the sketches to a JSON file."""
+        # Write to a temporary file first and then move it into place, so that a crash never leaves a corrupt file.
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.to_dict(), f)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path):
+        """Loads a set of sketches saved using `save`."""
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
@@ -0,0 +1,173 @@
+"""
+On-disk spill storage for the action logs of trips in progress.
+
+An `IncrementalLogifier` holds the action log of every trip in progress in memory until the trip finishes. On a
+disrupted service day, thousands of trips may linger for hours, and these logs grow with every feed. A `SpillStore`
+lets the engine move the logs of some of these trips out to disk, and page them back in once the trips finish.
+
+The store is a directory of segments, one per spill. Like the segments of a `gtfs_tripify.actionstore.ActionStore`, a
+segment is a directory of `numpy` `.npy` column files, which are read using memory mapping:
+
+* `has_lead_row` and the `ACTION_LOG_COLUMNS`: one row per lean action record, holding its lead row. The
+  records of each trip are contiguous, and in order.
+* `stop_start`, `stop_end`, `stops`: the stops of the `j`th record are `stops[stop_start[j]:stop_end[j]]`. Stop lists
+  which are unchanged from the trip's previous record point at the same span.
+
+The span of rows each trip occupies in each segment is kept in memory. A segment is deleted once every trip in it has
+been paged back in.
+"""
+import os
+import shutil
+import tempfile
+import weakref
+
+import numpy as np
+
+from gtfs_tripify.tripify import ACTION_LOG_COLUMNS
+
+SPILL_COLUMNS = ['has_lead_row'] + ACTION_LOG_COLUMNS + ['stop_start', 'stop_end', 'stops']
+
+
+def _strings(values):
+    # Fixed-width unicode arrays, unlike object arrays, can be memory mapped.
+    return np.array(values, dtype=str) if values else np.empty(0, dtype='<U1')
+
+
+class SpillStore:
+    """
+    A directory of spilled lean action records, keyed by trip id. If no `path` is given, a temporary directory is
+    used, which is removed again by `close`, or, failing that, once the store is garbage collected or the interpreter
+    exits. The store may be used as a context manager, which closes it on exit.
+
+    `metrics` reports the number of spills, and the number of trips, records and bytes spilled and paged back in.
+    """
+    def __init__(self, path=None):
+        self._temporary = path is None
+        self.path = tempfile.mkdtemp(prefix='gtfs-tripify-spill-') if path is None else path
+        os.makedirs(self.path, exist_ok=True)
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self.path, ignore_errors=True) \
+            if self._temporary else None
+
+        # Trip id -> list of `(segment, start, end)` row spans, oldest first, and segment -> number of trips in it
+        # which have not been paged back in yet, and the size of its columns.
+        self._spans = dict()
+        self._live = dict()
+        self._sizes = dict()
+        self._n_segments = 0
+
+        self.metrics = {'spills': 0, 'spilled_trips': 0, 'spilled_records': 0, 'spilled_bytes': 0,
+                        'paged_trips': 0, 'paged_records': 0, 'segments': 0, 'bytes_on_disk': 0}
+
+    def __contains__(self, trip_id):
+        return trip_id in self._spans
+
+    def __len__(self):
+        return len(self._spans)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _segment_path(self, segment):
+        return os.path.join(self.path, str(segment))
+
+    def write(self, trips):
+        """Spills a `{trip_id: lean action records}` dict of trips to a new segment."""
+        trips = {trip_id: records for trip_id, records in trips.items() if records}
+        if not trips:
+            return
+
+        segment = self._n_segments
+        has_lead_row, lead_rows = [], {col: [] for col in ACTION_LOG_COLUMNS}
+        stop_starts, stop_ends, stops = [], [], []
+        blank = ('',) * len(ACTION_LOG_COLUMNS)
+
+        for trip_id, records in trips.items():
+            start, span = len(has_lead_row), None
+            for lead_row, record_stops in records:
+                has_lead_row.append(lead_row is not None)
+                for col, value in zip(ACTION_LOG_COLUMNS, lead_row if lead_row is not None else blank):
+                    lead_rows[col].append(value)
+                if span is None or span[0] != record_stops:
+                    span = (record_stops, len(stops), len(stops) + len(record_stops))
+                    stops.extend(record_stops)
+                stop_starts.append(span[1])
+                stop_ends.append(span[2])
+            self._spans.setdefault(trip_id, []).append((segment, start, len(has_lead_row)))
+
+        columns = {'has_lead_row': np.array(has_lead_row, dtype=bool),
+                   'stop_start': np.array(stop_starts, dtype=np.int64),
+                   'stop_end': np.array(stop_ends, dtype=np.int64),
+                   'stops': _strings(stops)}
+        columns.update({col: _strings(lead_rows[col]) for col in ACTION_LOG_COLUMNS})
+
+        # Write to a temporary directory first and then move it into place, so that a crash never leaves a partial
+        # segment behind.
+        path = self._segment_path(segment)
+        shutil.rmtree(path + '.tmp', ignore_errors=True)
+        os.makedirs(path + '.tmp')
+        for col in SPILL_COLUMNS:
+            np.save(os.path.join(path + '.tmp', col + '.npy'), columns[col])
+        os.replace(path + '.tmp', path)
+
+        n_bytes = sum(values.nbytes for values in columns.values())
+        self._live[segment] = len(trips)
+        self._sizes[segment] = n_bytes
+        self._n_segments += 1
+        self.metrics['spills'] += 1
+        self.metrics['spilled_trips'] += len(trips)
+        self.metrics['spilled_records'] += len(has_lead_row)
+        self.metrics['spilled_bytes'] += n_bytes
+        self.metrics['bytes_on_disk'] += n_bytes
+        self.metrics['segments'] += 1
+
+    def _read_span(self, segment, start, end):
+        path = self._segment_path(segment)
+        columns = {col: np.load(os.path.join(path, col + '.npy'), mmap_mode='r') for col in SPILL_COLUMNS}
+        has_lead_row = columns['has_lead_row'][start:end].tolist()
+        lead_rows = list(zip(*[columns[col][start:end].tolist() for col in ACTION_LOG_COLUMNS]))
+        stop_starts, stop_ends = columns['stop_start'][start:end].tolist(), columns['stop_end'][start:end].tolist()
+        lo, hi = (min(stop_starts), max(stop_ends)) if stop_starts else (0, 0)
+        stops = columns['stops'][lo:hi].tolist()
+
+        records, span = [], None
+        for i in range(end - start):
+            if span is None or span[0] != (stop_starts[i], stop_ends[i]):
+                span = ((stop_starts[i], stop_ends[i]), tuple(stops[stop_starts[i] - lo:stop_ends[i] - lo]))
+            records.append((lead_rows[i] if has_lead_row[i] else None, span[1]))
+        return records
+
+    def read(self, trip_id, pop=True):
+        """
+        Returns the spilled records of a trip, oldest first, or an empty list if none were spilled. Unless `pop` is
+        False, the records are dropped from the store.
+        """
+        spans = self._spans.pop(trip_id, []) if pop else self._spans.get(trip_id, [])
+        records = []
+        for segment, start, end in spans:
+            records.extend(self._read_span(segment, start, end))
+
+        if pop and spans:
+            self.metrics['paged_trips'] += 1
+            self.metrics['paged_records'] += len(records)
+            for segment in {segment for segment, _, _ in spans}:
+                self._live[segment] -= 1
+                if self._live[segment] == 0:
+                    self._drop_segment(segment)
+        return records
+
+    def _drop_segment(self, segment):
+        shutil.rmtree(self._segment_path(segment))
+        del self._live[segment]
+        self.metrics['segments'] -= 1
+        self.metrics['bytes_on_disk'] -= self._sizes.pop(segment)
+
+    def close(self):
+        """Deletes every segment in the store, and the store directory itself if it is a temporary one."""
+        for segment in list(self._live):
+            self._drop_segment(segment)
+        self._spans = dict()
+        if self._finalizer is not None:
+            self._finalizer()
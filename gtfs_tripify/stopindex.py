@@ -0,0 +1,156 @@
+"""
+A stop-level index of the events in a logbook.
+
+Finding the trains which stopped at a given stop within a given time window means scanning every trip log in a
+logbook. A `StopIndex` instead holds every stop event in the logbook, grouped by `stop_id` and sorted by time, so that
+these queries can be answered with a binary search.
+
+Each event occupies a time window, from its `minimum_time` to its `maximum_time`. Windows have no upper bound while the
+train is still en route to the stop (`maximum_time` is NaN); these "open" events are kept apart from the "closed" ones
+in each stop's group. To find the closed events overlapping a query window using a search over their start times only,
+each stop also records the length of the longest closed window it contains.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from gtfs_tripify.columnar import ColumnarLogbook
+
+EVENT_COLUMNS = ['stop', 'ref', 'action', 'minimum_time', 'maximum_time']
+
+
+def _intern(values, table, codes):
+    """Returns the integer codes of the given values in a list of unique values, appending the ones not in it yet."""
+    uniques, inverse = np.unique(np.asarray(values, dtype=object).astype(str), return_inverse=True)
+    for value in uniques:
+        if value not in codes:
+            codes[value] = len(table)
+            table.append(value)
+    return np.array([codes[value] for value in uniques], dtype=np.int64)[inverse]
+
+
+class StopIndex:
+    """
+    An index of the stop events in one or more logbooks. Build one using `from_logbook`, add further logbooks to it
+    using `add`, and query it using `query`.
+
+    `keys`, `stop_ids`, and `actions` hold the unique trip ids, stop ids, and actions in the index; events refer to
+    them by position.
+    """
+    def __init__(self):
+        self.keys, self.stop_ids, self.actions = [], [], []
+        self._key_codes, self._stop_codes, self._action_codes = dict(), dict(), dict()
+        self._events = {col: np.empty(0, dtype=np.float64 if col.endswith('_time') else np.int64)
+                        for col in EVENT_COLUMNS}
+        self._build()
+
+    def __len__(self):
+        return len(self._events['stop'])
+
+    @classmethod
+    def from_logbook(cls, logbook):
+        """Builds an index of the stop events in a logbook."""
+        index = cls()
+        index.add(logbook)
+        return index
+
+    def add(self, logbook):
+        """
+        Merges the stop events in a logbook into the index. A trip which is already in the index has its events
+        replaced by the ones in the logbook, so a trip log which was still in progress when it was first added can be
+        updated later on.
+        """
+        logbook = logbook if isinstance(logbook, ColumnarLogbook) else ColumnarLogbook.from_logbook(logbook)
+        if len(logbook) == 0:
+            return
+
+        keys = list(logbook)
+        replaced = np.array([self._key_codes[key] for key in keys if key in self._key_codes], dtype=np.int64)
+        columns = logbook.columns
+        events = {'stop': _intern(columns['stop_id'], self.stop_ids, self._stop_codes),
+                  'ref': np.repeat(_intern(keys, self.keys, self._key_codes), np.diff(logbook.offsets)),
+                  'action': _intern(columns['action'], self.actions, self._action_codes),
+                  'minimum_time': columns['minimum_time'],
+                  'maximum_time': columns['maximum_time']}
+
+        keep = ~np.isin(self._events['ref'], replaced)
+        self._events = {col: np.concatenate([self._events[col][keep], events[col]]) for col in EVENT_COLUMNS}
+        self._build()
+
+    def _build(self):
+        """Sorts the events by stop, closed before open, and start time, and rebuilds the search structures."""
+        events = self._events
+
+        # An event with no `minimum_time` (the first stop of a trip) starts at its `maximum_time` instead. Events with
+        # neither carry no information, and are dropped.
+        start = np.where(np.isnan(events['minimum_time']), events['maximum_time'], events['minimum_time'])
+        is_open = np.isnan(events['maximum_time'])
+        known = ~np.isnan(start)
+
+        order = np.lexsort((start[known], is_open[known], events['stop'][known]))
+        self._events = {col: events[col][known][order] for col in EVENT_COLUMNS}
+        self._start = start[known][order]
+
+        # Stop `s` has closed events `offsets[2s]:offsets[2s + 1]` and open events `offsets[2s + 1]:offsets[2s + 2]`.
+        group = self._events['stop'] * 2 + np.isnan(self._events['maximum_time'])
+        self._offsets = np.searchsorted(group, np.arange(2 * len(self.stop_ids) + 1), side='left')
+
+        self._max_span = np.zeros(len(self.stop_ids), dtype=np.float64)
+        closed = ~np.isnan(self._events['maximum_time'])
+        np.maximum.at(self._max_span, self._events['stop'][closed],
+                      self._events['maximum_time'][closed] - self._start[closed])
+
+    def query(self, stop_id, start=None, end=None, actions=None):
+        """
+        Returns the events at the given stop whose time window overlaps the closed interval `[start, end]`, as a
+        `DataFrame` with `unique_trip_id`, `action`, `minimum_time`, and `maximum_time` columns, in order of start time.
+        Either bound may be None to leave that side of the interval open. Pass a list of actions (for instance,
+        `['STOPPED_AT']`) to `actions` to only return events with one of those actions.
+        """
+        t1 = -np.inf if start is None else start
+        t2 = np.inf if end is None else end
+
+        if stop_id in self._stop_codes:
+            s = self._stop_codes[stop_id]
+            a, b, c = self._offsets[2 * s:2 * s + 3]
+
+            # Closed events overlapping the interval start at or before `t2`, and end at or after `t1`, so start no
+            # earlier than `t1` less the longest window at this stop.
+            lo = a + np.searchsorted(self._start[a:b], t1 - self._max_span[s], side='left')
+            hi = a + np.searchsorted(self._start[a:b], t2, side='right')
+            closed = np.arange(lo, hi)[self._events['maximum_time'][lo:hi] >= t1]
+            rows = np.concatenate([closed, np.arange(b, b + np.searchsorted(self._start[b:c], t2, side='right'))])
+            rows = rows[np.argsort(self._start[rows], kind='stable')]
+        else:
+            rows = np.empty(0, dtype=np.int64)
+
+        result = pd.DataFrame({
+            'unique_trip_id': np.array(self.keys, dtype=object)[self._events['ref'][rows]],
+            'action': np.array(self.actions, dtype=object)[self._events['action'][rows]],
+            'minimum_time': self._events['minimum_time'][rows],
+            'maximum_time': self._events['maximum_time'][rows]
+        })
+        if actions is not None:
+            result = result[result['action'].isin(actions)].reset_index(drop=True)
+        return result
+
+    def save(self, path):
+        """Saves the index to a `numpy` `.npz` file at `path`."""
+        # Write to a temporary file first and then move it into place, so that a crash never leaves a corrupt index.
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, keys=np.array(self.keys, dtype=str), stop_ids=np.array(self.stop_ids, dtype=str),
+                     actions=np.array(self.actions, dtype=str), **self._events)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path):
+        """Loads an index saved using `save`."""
+        index = cls()
+        with np.load(path) as data:
+            for attr, codes in [('keys', '_key_codes'), ('stop_ids', '_stop_codes'), ('actions', '_action_codes')]:
+                setattr(index, attr, data[attr].tolist())
+                setattr(index, codes, {value: i for i, value in enumerate(getattr(index, attr))})
+            index._events = {col: data[col] for col in EVENT_COLUMNS}
+        index._build()
+        return index
@@ -1,136 +1,14 @@
 import numpy as np
 import itertools
-from collections import defaultdict
+from array import array
+from collections import defaultdict, OrderedDict
+from collections.abc import Mapping
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 from gtfs_tripify.utils import synthesize_route
-import warnings
-
-
-def dictify(feed):
-    """
-    Parses a GTFS-Realtime feed that has been loaded into a `gtfs_realtime_pb2` object into a native dictionary
-    representation.
-    """
-    _feed = feed
-    feed = {
-        'header': {'gtfs_realtime_version': _feed.header.gtfs_realtime_version,
-                   'timestamp': _feed.header.timestamp},
-        'entity': []
-    }
-
-    # Helper functions for determining message types in the gtfs_realtime_pb2` object.
-    def is_vehicle_update(message):
-        return str(message.trip_update.trip.route_id) == '' and str(message.alert) == ''
-
-    def is_alert(message):
-        return str(message.alert) != ''
-
-    def is_trip_update(message):
-        return not is_vehicle_update(message) and not is_alert(message)
-
-    # Helper function for assigning status.
-    def munge_status(status_code):
-        statuses = {
-            0: 'INCOMING_AT',
-            1: 'STOPPED_AT',
-            2: 'IN_TRANSIT_TO'
-        }
-        return statuses[status_code]
-
-    for _message in _feed.entity:
-        if is_trip_update(_message):
-            message = {
-                'id': _message.id,
-                'trip_update': {
-                    'trip': {
-                        'trip_id': _message.trip_update.trip.trip_id,
-                        'start_date': _message.trip_update.trip.start_date,
-                        'route_id': _message.trip_update.trip.route_id
-                    },
-                    'stop_time_update': [
-                        {
-                            'stop_id': _update.stop_id,
-                            'arrival': np.nan if str(_update.arrival) == "" else _update.arrival.time,
-                            'departure': np.nan if str(_update.departure) == "" else _update.departure.time
-                        } for _update in _message.trip_update.stop_time_update]
-                },
-                'type': 'trip_update'
-            }
-            feed['entity'].append(message)
-        elif is_vehicle_update(_message):
-            message = {
-                'id': _message.id,
-                'vehicle': {
-                    'trip': {
-                        'trip_id': _message.vehicle.trip.trip_id,
-                        'start_date': _message.vehicle.trip.start_date,
-                        'route_id': _message.vehicle.trip.route_id
-                    },
-                    'current_stop_sequence': _message.vehicle.current_stop_sequence,
-                    'current_status': munge_status(_message.vehicle.current_status),
-                    'timestamp': _message.vehicle.timestamp,
-                    'stop_id': _message.vehicle.stop_id
-                },
-                'type': 'vehicle_update'
-            }
-            feed['entity'].append(message)
-        else:  # is_alert
-            message = {
-                'id': _message.id,
-                'alert': {
-                    'header_text': {
-                        'translation': {
-                            # TODO
-                            'text': _message.alert.header_text.translation[0].text
-                        }
-                    },
-                    'informed_entity': [
-                        {
-                            'trip_id': _trip.trip.trip_id,
-                            'route_id': _trip.trip.route_id
-                        } for _trip in _message.alert.informed_entity]
-                },
-                'type': 'alert'
-            }
-            feed['entity'].append(message)
-
-    # Correct and warn about feed errors.
-    feed = correct(feed)
-
-    return feed
-
-
-def correct(feed):
-    """
-    Verifies that the inputted dictified feed has the expected schema. Raises warnings wherever issues are found,
-    and attempts to cure them.
-    """
-    # Capture and throw away vehicle updates that do not also have trip updates.
-    vehicle_update_ids = {m['vehicle']['trip']['trip_id'] for m in feed['entity'] if m['type'] == 'vehicle_update'}
-    trip_update_ids = {m['trip_update']['trip']['trip_id'] for m in feed['entity'] if m['type'] == 'trip_update'}
-    trip_update_only_ids = vehicle_update_ids.difference(trip_update_ids)
-
-    if len(trip_update_only_ids) > 0:
-        warnings.warn("The trips with IDs {0} are provided vehicle updates but not trip updates in the GTFS-R feed "
-                      "for {1}. These invalid trips were removed from the feed during pre-processing.".format(
-            trip_update_only_ids, feed['header']['timestamp'])
-        )
-        feed['entity'] = [m for m in feed['entity'] if (m['type'] != 'vehicle_update' or
-                                                        m['vehicle']['trip']['trip_id'] not in trip_update_only_ids)]
-
-    # Capture and throw away messages which have a null (empty string, '') trip id.
-    nonalert_ids = vehicle_update_ids | trip_update_ids
-    if '' in nonalert_ids:
-        warnings.warn("Some of the messages in the GTFS-R feed for {0} have a null trip id. These invalid messages "
-                      "were removed from the feed during pre-processing.".format(
-            trip_update_only_ids, feed['header']['timestamp'])
-        )
-        feed['entity'] = [m for m in feed['entity'] if ((m['type'] == 'vehicle_update' and
-                                                         m['vehicle']['trip']['trip_id'] != "") or
-                                                        (m['type'] == 'trip_update') and
-                                                         m['trip_update']['trip']['trip_id'] != "")]
-
-    return feed
+from gtfs_tripify.columnar import ColumnarLogbook
+from gtfs_tripify.shared import SharedColumns
+from gtfs_tripify.decode import dictify, correct  # noqa: F401 (re-exported for backwards compatibility)
 
 
 def _tripsort(feed, include_alerts=False):
@@ -157,22 +35,32 @@ def _tripsort(feed, include_alerts=False):
     return sort
 
 
-def _feedsort(feeds, include_alerts=False):
+def _feedsort(feeds):
     """
     Sorts the messages in a timely list of dictified feeds into a list of trip-id-to-message hash tables. This
     method handles the Trip ID collisions that occur when a trip ID is recycled within the time span of the feed.
-    """
-    if include_alerts:
-        raise NotImplementedError("Processing alert messages has not been implemented yet.")
 
+    Alert messages are left out. To track the alerts in a stream of feeds, use `gtfs_tripify.alerts.AlertIndex`.
+    """
     if len(feeds) == 0:
         return []
 
-    message_tables = [_tripsort(feed, include_alerts=False) for feed in feeds]
-    trip_ids = list(set(itertools.chain(*[table.keys() for table in message_tables])))
+    return _bifurcate([_tripsort(feed, include_alerts=False) for feed in feeds])
+
+
+def _bifurcate(tables):
+    """
+    Given a timely list of trip-id-keyed hash tables, renames the trip ids in place so that every contiguous run of
+    tables containing a trip id gets a key of its own: `<trip_id>_0`, `<trip_id>_1`, and so on. Returns the tables.
+    Submethod of `_feedsort`.
+    """
+    if len(tables) == 0:
+        return tables
+
+    trip_ids = list(set(itertools.chain(*[table.keys() for table in tables])))
 
     # x dimension is categorical trip_id, y dimension is time (feed sequence number).
-    containment_matrix = np.concatenate([[np.in1d(trip_ids, list(table.keys()))] for table in message_tables], axis=0)
+    containment_matrix = np.concatenate([[np.in1d(trip_ids, list(table.keys()))] for table in tables], axis=0)
 
     for i in range(len(trip_ids)):
         n = 0
@@ -186,58 +74,40 @@ def _feedsort(feeds, include_alerts=False):
                 new_ids.append(None)
                 n += 1
 
-        for i, table in enumerate(message_tables):
+        for i, table in enumerate(tables):
             if new_ids[i] is not None:
                 table[new_ids[i]] = table.pop(trip_id)
             else:
                 continue
 
-    return message_tables
+    return tables
 
 
-def actionify(trip_message, vehicle_message, timestamp):
+def _iter_actions(trip_message, vehicle_message):
     """
-    Parses the trip update and vehicle update messages (if there is one; may be None) for a particular trip into an
-    action log.
-
-    This method is called by parse_message_list_into_action_log in a loop in order to get the complete action log.
+    Lazily yields the `(action, stop_id, time_assigned)` entries of the action log for a trip update message and
+    vehicle update message (which may be None). Submethod of `actionify`.
     """
     # If a vehicle message is not None, the trip is already in progress.
     inp = bool(vehicle_message)
-
-    # The base of the log entry is the same for all possible entries.
-    base = np.array([trip_message['trip_update']['trip']['trip_id'],
-                     trip_message['trip_update']['trip']['route_id'], timestamp])
     vehicle_status = vehicle_message['vehicle']['current_status'] if inp else 'QUEUED'
-    loglist = []
-
-    def log_arrival(stop_id, arrival_time):
-        loglist.append(np.append(base.copy(), np.array(['EXPECTED_TO_ARRIVE_AT', stop_id, arrival_time])))
-
-    def log_departure(stop_id, departure_time):
-        loglist.append(np.append(base.copy(), np.array(['EXPECTED_TO_DEPART_AT', stop_id, departure_time])))
-
-    def log_stop(stop_id, arrival_time):
-        loglist.append(np.append(base.copy(), np.array(['STOPPED_AT', stop_id, arrival_time])))
-
-    def log_skip(stop_id, skip_time):
-        loglist.append(np.append(base.copy(), np.array(['EXPECTED_TO_SKIP', stop_id, skip_time])))
+    stop_time_updates = trip_message['trip_update']['stop_time_update']
 
-    for s_i, stop_time_update in enumerate(trip_message['trip_update']['stop_time_update']):
+    for s_i, stop_time_update in enumerate(stop_time_updates):
 
         first_station = s_i == 0
-        last_station = s_i == len(trip_message['trip_update']['stop_time_update']) - 1
+        last_station = s_i == len(stop_time_updates) - 1
         stop_id = stop_time_update['stop_id']
         arrival_time = stop_time_update['arrival']
         departure_time = stop_time_update['departure']
 
         # First station, vehicle status is STOPPED_AT.
         if first_station and vehicle_status == 'STOPPED_AT':
-            log_stop(stop_id, arrival_time)
+            yield 'STOPPED_AT', stop_id, arrival_time
 
         # First station, vehicle status is QUEUED.
         elif first_station and vehicle_status == 'QUEUED':
-            log_departure(stop_id, departure_time)
+            yield 'EXPECTED_TO_DEPART_AT', stop_id, departure_time
 
         # First station, vehicle status is IN_TRANSIT_TO or INCOMING_AT, both arrival and departure fields are notnull.
         # Intermediate station, both arrival and departure fields are notnull.
@@ -249,29 +119,46 @@ def actionify(trip_message, vehicle_message, timestamp):
                not last_station and
                pd.notnull(arrival_time) and pd.notnull(departure_time))):
 
-            log_arrival(stop_id, arrival_time)
-            log_departure(stop_id, departure_time)
+            yield 'EXPECTED_TO_ARRIVE_AT', stop_id, arrival_time
+            yield 'EXPECTED_TO_DEPART_AT', stop_id, departure_time
 
         # Not the last station, one of arrival or departure is null.
         elif ((not last_station and
                (pd.isnull(arrival_time) or pd.isnull(departure_time)))):
-            log_skip(stop_id, departure_time) if pd.isnull(arrival_time) else log_skip(stop_id, arrival_time)
+            yield 'EXPECTED_TO_SKIP', stop_id, departure_time if pd.isnull(arrival_time) else arrival_time
 
         # Last station, not also the first (e.g. not length 1).
         elif last_station and not first_station:
-            log_arrival(stop_id, arrival_time)
+            yield 'EXPECTED_TO_ARRIVE_AT', stop_id, arrival_time
 
         # Last station, also first station, vehicle status is IN_TRANSIT_TO or INCOMING_AT.
         elif last_station and vehicle_status in ['IN_TRANSIT_TO', 'INCOMING_AT']:
-            log_arrival(stop_id, arrival_time)
+            yield 'EXPECTED_TO_ARRIVE_AT', stop_id, arrival_time
 
         # This shouldn't occur, and indicates an error in the input or our logic.
         else:
             raise ValueError("An error occurred while converting a message to an action log, probably due to invalid "
                              "input.")
 
-    action_log = pd.DataFrame(loglist, columns=['trip_id', 'route_id', 'information_time', 'action', 'stop_id',
-                                              'time_assigned'])
+
+ACTION_LOG_COLUMNS = ['trip_id', 'route_id', 'information_time', 'action', 'stop_id', 'time_assigned']
+
+
+def actionify(trip_message, vehicle_message, timestamp):
+    """
+    Parses the trip update and vehicle update messages (if there is one; may be None) for a particular trip into an
+    action log.
+
+    This method is called by parse_message_list_into_action_log in a loop in order to get the complete action log.
+    """
+    # The base of the log entry is the same for all possible entries.
+    base = np.array([trip_message['trip_update']['trip']['trip_id'],
+                     trip_message['trip_update']['trip']['route_id'], timestamp])
+
+    loglist = [np.append(base.copy(), np.array(list(action)))
+               for action in _iter_actions(trip_message, vehicle_message)]
+
+    action_log = pd.DataFrame(loglist, columns=ACTION_LOG_COLUMNS)
     return action_log
 
 
@@ -279,33 +166,129 @@ def _parse_message_list_into_action_log(messages, timestamp):
     """
     Parses a list of messages into a single pandas.DataFrame. Internal routine.
     """
+    messages = [message for message in messages if message['type'] != 'alert']
 
-    actions_list = []
-    nonalerts = [message for message in messages if message['type'] != 'alert']
+    actions_list = [actionify(trip_update, vehicle_update, timestamp)
+                    for trip_update, vehicle_update in _pair_trip_updates(messages)]
 
-    for i in range(0, len(nonalerts)):
-        trip_update = messages[i]
+    return pd.concat(actions_list)
 
-        # Selectively loop through trip updates.
-        if trip_update['type'] == 'vehicle_update':
-            pass
 
-        # If the entry is a trip update, find the associated vehicle update, if it exists, and pass that to the list.
-        else:
-            has_vehicle_update = False if (i == len(messages) - 1) else (messages[i + 1]['type'] == 'vehicle_update')
-            vehicle_update = messages[i + 1] if has_vehicle_update else None
+def _pair_trip_updates(messages):
+    """
+    Yields each trip update in a list of messages alongside its associated vehicle update, or None if there is none.
+    Submethod of `_parse_message_list_into_action_log` and `_lean_action_record`.
+    """
+    for i, message in enumerate(messages):
+        if message['type'] == 'trip_update':
+            has_vehicle_update = i < len(messages) - 1 and messages[i + 1]['type'] == 'vehicle_update'
+            yield message, messages[i + 1] if has_vehicle_update else None
 
-            actions = actionify(trip_update, vehicle_update, timestamp)
-            actions_list.append(actions)
 
-    return pd.concat(actions_list)
+def _lean_action_record(messages, timestamp):
+    """
+    Lean alternative to `_parse_message_list_into_action_log`. `tripify` only ever reads the first entry of each
+    action log, and the list of stops each action log covers; the remaining entries are discarded. So instead of
+    building the complete action log, this method returns just those two things: a `(lead_row, stops)` pair, where
+    `lead_row` is a tuple with the values of the first row of the action log (or None, if the action log is empty)
+    and `stops` is the ordered tuple of unique stops. Internal routine.
+    """
+    lead_row = None
+    stops = dict()
+
+    for trip_update, vehicle_update in _pair_trip_updates(messages):
+        if lead_row is None:
+            action = next(_iter_actions(trip_update, vehicle_update), None)
+            if action is not None:
+                trip = trip_update['trip_update']['trip']
+                lead_row = (trip['trip_id'], trip['route_id'], str(timestamp)) + tuple(str(v) for v in action)
+
+        # Dicts preserve insertion order, which makes them a fast ordered set.
+        stops.update((u['stop_id'], None) for u in trip_update['trip_update']['stop_time_update'])
 
+    return lead_row, tuple(stops)
 
-def tripify(tripwise_action_logs, finished=False, finish_information_time=None):
+
+def _message_signature(messages):
+    """
+    Returns a hashable summary of everything in a list of trip messages that goes into its action log, other than
+    the timestamp. Two message lists with the same signature produce the same action log, up to the information time.
+    """
+    signature = []
+    for message in messages:
+        if message['type'] == 'trip_update':
+            trip = message['trip_update']['trip']
+            # NaN does not compare equal to itself, so it is swapped out for None.
+            updates = tuple((u['stop_id'],
+                             None if u['arrival'] != u['arrival'] else u['arrival'],
+                             None if u['departure'] != u['departure'] else u['departure'])
+                            for u in message['trip_update']['stop_time_update'])
+            signature.append((trip['trip_id'], trip['route_id'], updates))
+        elif message['type'] == 'vehicle_update':
+            signature.append(message['vehicle']['current_status'])
+    return tuple(signature)
+
+
+def _delta_action_log(messages, timestamp, previous=None, lean=False):
+    """
+    Parses a list of messages into an action log, reusing the trip's previous action log if the messages have not
+    changed since. `previous` is the `(signature, action_log)` pair returned by this method for the trip's previous
+    feed, or None. Returns a new such pair. Internal routine.
+
+    Between consecutive feeds most trips are unchanged apart from the feed timestamp, so this skips most of the work
+    of `actionify`. If `lean` is True, the action log is a lean action record (see `_lean_action_record`).
+    """
+    signature = _message_signature(messages)
+
+    if previous is not None and previous[0] == signature:
+        if not lean:
+            return signature, previous[1].assign(information_time=str(timestamp))
+        lead_row, stops = previous[1]
+        if lead_row is not None:
+            lead_row = lead_row[:2] + (str(timestamp),) + lead_row[3:]
+        return signature, (lead_row, stops)
+
+    if lean:
+        return signature, _lean_action_record(messages, timestamp)
+    return signature, _parse_message_list_into_action_log(messages, timestamp)
+
+
+def action_tables(feeds):
+    """
+    Given a timely list of dictified feeds, returns a list of `(timestamp, table)` pairs, one per feed, where `table`
+    maps each trip id in the feed to its lean action record (see `_lean_action_record`). Trip ids are as they appear
+    in the feed: recycled trip ids are only told apart later, by `logify`.
+
+    This is everything `logify` needs to know about the feeds, in a much more compact form than the feeds themselves.
+    Pass the result to `logify` as `actions` to skip the work of parsing the feeds over again; see also
+    `gtfs_tripify.actionstore`, which persists action tables to disk.
+    """
+    tables = []
+    previous = dict()
+
+    for feed in feeds:
+        timestamp = feed['header']['timestamp']
+        current = {trip_id: _delta_action_log(messages, timestamp, previous.get(trip_id), lean=True)
+                   for trip_id, messages in _tripsort(feed).items()}
+        tables.append((timestamp, {trip_id: record for trip_id, (_, record) in current.items()}))
+        previous = current
+
+    return tables
+
+
+def tripify(tripwise_action_logs, finished=False, finish_information_time=None, stop_lists=None, stop_order=None):
     """
     Given a list of action logs associated with a particular trip, returns the result of their merger: a single trip
     log.
 
+    Only the first entry for each information time and the list of stops covered by each action log are actually
+    used. If the list of stops covered by each action log is passed to `stop_lists`, the action logs need contain
+    nothing more than their first entry.
+
+    The order of the stops in the trip is synthesized out of the stop lists (see `synthesize_route`). If the scheduled
+    order of the trip's stops is known (see `gtfs_tripify.schedule`), pass it to `stop_order` to use it instead. The
+    synthesized order is still used if the trip made stops that are not in the scheduled order.
+
     By default, this trip is left unterminated. To terminate the trip (replacing any remaining stops to be made with
     the appropriate information), set the `finished` flag to `True` and provide a `finish_information_time`,
     which should correspond with the time at which you learn that the trip has ended. This must be provided
@@ -322,7 +305,9 @@ def tripify(tripwise_action_logs, finished=False, finish_information_time=None):
                 .reset_index())
 
     # Get the complete (synthetic) stop list.
-    stops = synthesize_route([list(log['stop_id'].unique()) for log in tripwise_action_logs])
+    if stop_lists is None:
+        stop_lists = [list(log['stop_id'].unique()) for log in tripwise_action_logs]
+    stops = _order_stops(stop_lists, stop_order)
 
     # Get the complete list of information times.
     information_times = [np.nan] + list(all_data['information_time'].unique()) + [np.nan]
@@ -397,6 +382,31 @@ def tripify(tripwise_action_logs, finished=False, finish_information_time=None):
     return trip
 
 
+def _order_stops(stop_lists, stop_order=None):
+    """
+    Returns the stops in a list of stop lists in the order given by `stop_order`, if every stop is in it, and in their
+    synthesized order (see `synthesize_route`) otherwise. Submethod of `tripify`.
+    """
+    if stop_order is not None:
+        observed = set(itertools.chain(*stop_lists))
+        ordered = [stop for stop in dict.fromkeys(stop_order) if stop in observed]
+        if len(ordered) == len(observed):
+            return ordered
+    return synthesize_route([list(stop_list) for stop_list in stop_lists])
+
+
+def _scheduled_stop_order(schedule, trip_id, timestamp):
+    """
+    Returns the scheduled order of the stops of a trip first seen at the given time, or None if no trip running on
+    the service day it was seen on is in the schedule. Submethod of `logify`.
+    """
+    for date in schedule.service_dates(timestamp):
+        stop_order = schedule.stop_order(trip_id, date)
+        if stop_order is not None:
+            return stop_order
+    return None
+
+
 def _finish_trip(trip_log, timestamp):
     """
     Finishes a trip. We know a trip is finished when its messages stops appearing in feed files, at which time we can
@@ -409,11 +419,176 @@ def _finish_trip(trip_log, timestamp):
     return trip_log
 
 
-def logify(feeds):
+def _assemble_trip_log(actions_logs, terminated_time=None, lean=False, stop_order=None):
+    """
+    Tripifies the action logs for a trip and coerces the result to the output types. If the trip was terminated,
+    `terminated_time` is the timestamp of the first feed which no longer contained it. If `lean` is True, the action
+    logs are lean action records (see `_lean_action_record`). `stop_order` is passed through to `tripify`. Internal
+    routine.
+    """
+    if lean:
+        action_log = pd.DataFrame([lead_row for lead_row, _ in actions_logs if lead_row is not None],
+                                  columns=ACTION_LOG_COLUMNS)
+        trip_log = tripify([action_log], stop_lists=[stops for _, stops in actions_logs], stop_order=stop_order)
+    else:
+        trip_log = tripify(actions_logs, stop_order=stop_order)
+
+    # Coerce types.
+    trip_log = trip_log.assign(
+        minimum_time=trip_log.minimum_time.astype('float'),
+        maximum_time=trip_log.maximum_time.astype('float'),
+        latest_information_time=trip_log.latest_information_time.astype('int')
+    )
+
+    # If the trip was terminated sometime in the course of these feeds, update the trip log accordingly.
+    if terminated_time is not None:
+        trip_log = _finish_trip(trip_log, terminated_time)
+
+    return trip_log
+
+
+def _pack_trips(trips):
+    """
+    Packs a batch of `(key, lean action records, terminated_time, stop_order)` trips into flat columns in shared
+    memory, returning the `SharedColumns` descriptor. Inverse of `_unpack_trips`.
+    """
+    keys, terminated_times = [], array('q')
+    record_offsets, has_lead_row, stop_offsets = array('q', [0]), array('b'), array('q', [0])
+    lead_rows = {col: [] for col in ACTION_LOG_COLUMNS}
+    stops, stop_orders = [], []
+    blank = ('',) * len(ACTION_LOG_COLUMNS)
+
+    for key, records, terminated_time, stop_order in trips:
+        keys.append(key)
+        stop_orders.append(stop_order)
+        terminated_times.append(-1 if terminated_time is None else terminated_time)
+        for lead_row, record_stops in records:
+            has_lead_row.append(lead_row is not None)
+            for col, value in zip(ACTION_LOG_COLUMNS, lead_row if lead_row is not None else blank):
+                lead_rows[col].append(value)
+            stops.extend(record_stops)
+            stop_offsets.append(len(stops))
+        record_offsets.append(len(has_lead_row))
+
+    return SharedColumns.create({'keys': keys, 'terminated_time': terminated_times, 'record_offset': record_offsets,
+                                 'has_lead_row': has_lead_row, 'lead_row': lead_rows, 'stops': stops,
+                                 'stop_offset': stop_offsets, 'stop_order': stop_orders})
+
+
+def _unpack_trips(columns):
+    """Unpacks the columns written by `_pack_trips` into a list of trips. Internal routine."""
+    lead_rows = list(zip(*[columns['lead_row'][col] for col in ACTION_LOG_COLUMNS]))
+    stops, stop_offsets, record_offsets = columns['stops'], columns['stop_offset'], columns['record_offset']
+
+    trips = []
+    for i, key in enumerate(columns['keys']):
+        records = [(lead_rows[j] if columns['has_lead_row'][j] else None,
+                    tuple(stops[stop_offsets[j]:stop_offsets[j + 1]]))
+                   for j in range(record_offsets[i], record_offsets[i + 1])]
+        terminated_time = columns['terminated_time'][i]
+        trips.append((key, records, None if terminated_time == -1 else terminated_time, columns['stop_order'][i]))
+    return trips
+
+
+def _assemble_trip_logs(descriptor):
+    """
+    Assembles the trip logs for a batch of trips packed by `_pack_trips`, returning them packed into shared memory
+    by `ColumnarLogbook.to_shared`. The unit of work of the parallel mode of `logify`.
+    """
+    with descriptor.attach(unlink=True) as columns:
+        trips = _unpack_trips(columns)
+
+    return ColumnarLogbook.from_logbook({key: _assemble_trip_log(action_logs, terminated_time, lean=True,
+                                                                 stop_order=stop_order)
+                                         for key, action_logs, terminated_time, stop_order in trips}).to_shared()
+
+
+class LazyLogbook(Mapping):
+    """
+    A read-only logbook which assembles each trip log the first time it is looked up, instead of all of them up front.
+
+    The keys, and the `time_bounds` of each trip, are available immediately: `time_bounds[key]` is a `(first, last)`
+    pair holding the timestamps of the first and last feeds which contained the trip. `feed_bounds` is the same pair
+    for the feeds as a whole.
+
+    Assembled trip logs are cached. If `cache_size` is set, only that many of the most recently used ones are kept,
+    and the rest are assembled again if they are looked up again; otherwise every one of them is kept.
+    """
+    def __init__(self, trips, time_bounds, feed_bounds, lean=True, cache_size=None):
+        self._trips = trips
+        self.time_bounds = time_bounds
+        self.feed_bounds = feed_bounds
+        self.lean = lean
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+
+    def __len__(self):
+        return len(self._trips)
+
+    def __iter__(self):
+        return iter(self._trips)
+
+    def __contains__(self, key):
+        return key in self._trips
+
+    def __getitem__(self, key):
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        actions_logs, terminated_time, stop_order = self._trips[key]
+        trip_log = _assemble_trip_log(actions_logs, terminated_time, lean=self.lean, stop_order=stop_order)
+
+        self._cache[key] = trip_log
+        if self.cache_size is not None and len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return trip_log
+
+    def information_times(self, key):
+        """
+        Returns the set of information times of the action logs of a trip, without assembling its trip log. Every
+        `latest_information_time` in the trip log is one of these.
+        """
+        actions_logs = self._trips[key][0]
+        if self.lean:
+            return {int(lead_row[2]) for lead_row, _ in actions_logs if lead_row is not None}
+        return {int(t) for log in actions_logs for t in log['information_time']}
+
+    def subset(self, keys):
+        """Returns a `LazyLogbook` holding just the given trips. Trip logs which were already assembled are kept."""
+        keys = [key for key in keys if key in self._trips]
+        ret = LazyLogbook({key: self._trips[key] for key in keys}, {key: self.time_bounds[key] for key in keys},
+                          self.feed_bounds, lean=self.lean, cache_size=self.cache_size)
+        ret._cache.update((key, trip_log) for key, trip_log in self._cache.items() if key in ret._trips)
+        return ret
+
+    def to_logbook(self):
+        """Assembles every trip log, returning an ordinary logbook (a `dict` of trip log `DataFrame` objects)."""
+        return {key: self[key] for key in self._trips}
+
+
+def logify(feeds=None, lean=True, workers=1, lazy=False, cache_size=None, actions=None, schedule=None):
     """
     Given a list of feeds, returns a hash table of trip logs associated with each trip mentioned in those feeds.
+
+    By default, only the parts of each action log that `tripify` actually reads are built (see
+    `_lean_action_record`). Set `lean` to False to build the complete action logs instead; the result is the same.
+
+    Every trip log is assembled independently of every other, so this work may be spread out over a pool of
+    `workers` processes. In this case only lean action records are sent to the workers, and the trip logs come back
+    in columnar form, both by way of shared memory (see `gtfs_tripify.shared`). The result is the same regardless of
+    the number of workers.
+
+    Set `lazy` to True to return a `LazyLogbook` instead, which only assembles each trip log when it is first looked
+    up, caching up to `cache_size` of them (or all of them, if `cache_size` is None). This is much faster when only
+    some of the trips are needed. `workers` is ignored in this case.
+
+    Instead of `feeds`, the action tables of the feeds (as returned by `action_tables`, or read back out of a
+    `gtfs_tripify.actionstore.ActionStore`) may be passed to `actions`. The result is the same.
+
+    If a static GTFS schedule is passed to `schedule` (see `gtfs_tripify.schedule`), the stops of each trip found in it
+    are put in their scheduled order, instead of in an order synthesized out of the feeds (see `tripify`).
     """
-    timestamps = [feed['header']['timestamp'] for feed in feeds]
 
     # The trip IDs that are assigned by the MTA are unique during their lifetime, but get recycled over the course of
     # the day. So for example if a trip is assigned the trip ID `000000_L..S`, and that trip ends, that trip ID is
@@ -424,13 +599,23 @@ def logify(feeds):
     # messages appearing non-contiguously. This is *not* a complete solution, as it is technically possible for a
     # trip id to be released and reused inside of the "update window". However, it's difficult to do better. We will
     # see whether or not this works well enough though.
-    message_tables = _feedsort(feeds)
-    trip_ids = set(itertools.chain(*[table.keys() for table in message_tables]))
-
-    ret = dict()
+    lean = lean or workers > 1 or actions is not None
+    if lean:
+        actions = actions if actions is not None else action_tables(feeds)
+        timestamps = [timestamp for timestamp, _ in actions]
+        message_tables = _bifurcate([dict(table) for _, table in actions])
+    else:
+        timestamps = [feed['header']['timestamp'] for feed in feeds]
+        message_tables = _feedsort(feeds)
+    trip_ids = sorted(set(itertools.chain(*[table.keys() for table in message_tables])))
+
+    trips = []
+    time_bounds = dict()
 
     for trip_id in trip_ids:
         actions_logs = []
+        first_seen = last_seen = None
+        previous = None
         trip_began = False
         trip_terminated = False
         trip_terminated_time = None
@@ -438,40 +623,54 @@ def logify(feeds):
         for i, table in enumerate(message_tables):
 
             # Is the trip present in this table at all?
-            if not table[trip_id]:
+            if not table.get(trip_id):
                 # If the trip hasn't been planned yet, and will simply appear in a later trip update, do nothing.
                 if not trip_began:
                     pass
 
                 # If the trip has been planned already, and doesn't exist in the current table, then it must have
                 # been removed. This implies that this trip terminated in the interceding time. Store this
-                # information for later.
-                else:
+                # information for later. Only the first such table counts, as that is when we learn of the end.
+                elif not trip_terminated:
                     trip_terminated = True
                     trip_terminated_time = timestamps[i]
 
                 continue
             else:
                 trip_began = True
+                first_seen = timestamps[i] if first_seen is None else first_seen
+                last_seen = timestamps[i]
 
-            action_log = _parse_message_list_into_action_log(table[trip_id], timestamps[i])
-            actions_logs.append(action_log)
-
-        trip_log = tripify(actions_logs)
-
-        # Coerce types.
-        trip_log = trip_log.assign(
-            minimum_time=trip_log.minimum_time.astype('float'),
-            maximum_time=trip_log.maximum_time.astype('float'),
-            latest_information_time=trip_log.latest_information_time.astype('int')
-        )
-
-        # If the trip was terminated sometime in the course of these feeds, update the trip log accordingly.
-        if trip_terminated:
-            trip_log = _finish_trip(trip_log, trip_terminated_time)
-
-        ret[trip_id] = trip_log
-
+            if lean:
+                actions_logs.append(table[trip_id])
+            else:
+                previous = _delta_action_log(table[trip_id], timestamps[i], previous)
+                actions_logs.append(previous[1])
+
+        # Keys are the trip id plus a `_<n>` suffix (see `_bifurcate`).
+        stop_order = _scheduled_stop_order(schedule, trip_id.rsplit('_', 1)[0], first_seen) \
+            if schedule is not None else None
+        trips.append((trip_id, actions_logs, trip_terminated_time if trip_terminated else None, stop_order))
+        time_bounds[trip_id] = (first_seen, last_seen)
+
+    if lazy:
+        return LazyLogbook({key: (actions_logs, terminated_time, stop_order)
+                            for key, actions_logs, terminated_time, stop_order in trips},
+                           time_bounds, (timestamps[0], timestamps[-1]) if timestamps else (None, None), lean=lean,
+                           cache_size=cache_size)
+
+    if workers <= 1 or len(trips) < 2:
+        return {key: _assemble_trip_log(actions_logs, terminated_time, lean=lean, stop_order=stop_order)
+                for key, actions_logs, terminated_time, stop_order in trips}
+
+    # A few batches per worker balances the load without paying for too many round trips. Results come back in
+    # submission order, so the logbook is assembled in the same order however many workers there are.
+    batch_size = max(1, -(-len(trips) // (workers * 4)))
+    batches = [trips[i:i + batch_size] for i in range(0, len(trips), batch_size)]
+    ret = dict()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for descriptor in executor.map(_assemble_trip_logs, [_pack_trips(batch) for batch in batches]):
+            ret.update(ColumnarLogbook.from_shared(descriptor).to_logbook())
     return ret
 
 
@@ -123,12 +123,42 @@ def cut_cancellations(log):
             return log
 
 
+def _discard_partial_lazy_logs(logbook):
+    """
+    `discard_partial_logs` for a `LazyLogbook`. The latest information times in a trip log are always among the
+    information times of its action logs, so only the trips with an action log at a candidate earliest (or latest)
+    information time need to be assembled to check whether that time is in use, and which trips use it.
+    """
+    by_time = dict()
+    for trip_id in logbook.keys():
+        for t in logbook.information_times(trip_id):
+            by_time.setdefault(t, []).append(trip_id)
+
+    def trips_at_bound(times):
+        for t in times:
+            trip_ids = [trip_id for trip_id in by_time[t]
+                        if (logbook[trip_id]['latest_information_time'].astype(int) == t).any()]
+            if trip_ids:
+                return trip_ids
+        return []
+
+    times = sorted(by_time)
+    discard = set(trips_at_bound(times)) | set(trips_at_bound(reversed(times)))
+    return logbook.subset([trip_id for trip_id in logbook.keys() if trip_id not in discard])
+
+
 def discard_partial_logs(logbook):
     """
     Discards logs which appear in the first or last message in the feed. These logs are extremely likely to be
     partial because we do not get to "see" every single message corresponding with the trip, as some are outside our
     "viewing window".
+
+    A `gtfs_tripify.tripify.LazyLogbook` is trimmed to the same trips, but only the trip logs which could hold the
+    earliest or the latest information time are assembled to find out which those are.
     """
+    if hasattr(logbook, 'time_bounds'):
+        return _discard_partial_lazy_logs(logbook)
+
     trim = logbook.copy()
 
     times = np.array(
@@ -0,0 +1,535 @@
+"""
+A minimal GTFS-Realtime decoder which walks the Protobuf wire format directly.
+
+`gtfs_realtime_pb2` materializes complete `FeedMessage` objects, including many fields that `gtfs-tripify` never looks
+at, which `dictify` then copies the fields it does need out of. The decoder in this module reads only those fields,
+straight out of a `memoryview` of the raw feed, into flat columns (typed `array.array` buffers for the numerical
+fields, and lists for the string ones), skipping everything else without allocating it.
+
+It does not depend on `gtfs_realtime_pb2`, `pandas` or `numpy`. Run `python benchmarks/decode.py` to compare it with
+the `gtfs_realtime_pb2` path on your machine.
+
+The field numbers used here come from the GTFS-Realtime specification:
+https://github.com/google/transit/blob/master/gtfs-realtime/proto/gtfs-realtime.proto
+"""
+from array import array
+
+from gtfs_tripify.decode import correct, trip_predicate
+
+_NAN = float('nan')
+_STATUSES = {0: 'INCOMING_AT', 1: 'STOPPED_AT', 2: 'IN_TRANSIT_TO'}
+
+
+def _varint(buf, pos):
+    """Reads a varint starting at `pos`. Returns its value, and the position just past it."""
+    b = buf[pos]
+    if b < 0x80:
+        return b, pos + 1
+
+    result, shift = b & 0x7f, 7
+    while True:
+        pos += 1
+        b = buf[pos]
+        result |= (b & 0x7f) << shift
+        if b < 0x80:
+            return result, pos + 1
+        shift += 7
+
+
+def _length(buf, pos):
+    """
+    Reads the length prefix of a length-delimited field starting at `pos`. Returns the length, and the position just
+    past the prefix. Raises a `ValueError` if the field would run past the end of the buffer.
+    """
+    length, pos = _varint(buf, pos)
+    if pos + length > len(buf):
+        raise ValueError("A length-delimited field runs past the end of the feed.")
+    return length, pos
+
+
+def _fixed(buf, pos, width):
+    if pos + width > len(buf):
+        raise ValueError("A fixed-width field runs past the end of the feed.")
+    return pos + width
+
+
+def _skip(buf, pos, wire_type):
+    """Skips over a field of the given wire type starting at `pos`. Returns the position just past it."""
+    if wire_type == 0:
+        while buf[pos] & 0x80:
+            pos += 1
+        return pos + 1
+    elif wire_type == 1:
+        return _fixed(buf, pos, 8)
+    elif wire_type == 2:
+        length, pos = _length(buf, pos)
+        return pos + length
+    elif wire_type == 5:
+        return _fixed(buf, pos, 4)
+    else:
+        raise ValueError("Unsupported Protobuf wire type {0}.".format(wire_type))
+
+
+def _int64(value):
+    """Reinterprets an unsigned 64-bit varint as a signed (two's complement) integer."""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _string(buf, pos):
+    """Reads a length-delimited string starting at `pos`. Returns it, and the position just past it."""
+    length, pos = _length(buf, pos)
+    return str(buf[pos:pos + length], 'utf-8'), pos + length
+
+
+def _trip_descriptor(buf, pos, end):
+    """Reads the `trip_id`, `start_date` and `route_id` of a `TripDescriptor`."""
+    trip_id = start_date = route_id = ''
+    while pos < end:
+        key, pos = _varint(buf, pos)
+        if key == 0x0a:  # 1: trip_id
+            trip_id, pos = _string(buf, pos)
+        elif key == 0x1a:  # 3: start_date
+            start_date, pos = _string(buf, pos)
+        elif key == 0x2a:  # 5: route_id
+            route_id, pos = _string(buf, pos)
+        else:
+            pos = _skip(buf, pos, key & 7)
+    return trip_id, start_date, route_id
+
+
+def _stop_time_event(buf, pos, end):
+    """
+    Reads the `time` of a `StopTimeEvent`. As in `dictify`, an event without any fields set counts as no event at all
+    (NaN), and an event with fields set but no `time` gets the default time of 0.
+    """
+    if pos == end:
+        return _NAN
+
+    time = 0
+    while pos < end:
+        key, pos = _varint(buf, pos)
+        if key == 0x10:  # 2: time
+            time, pos = _varint(buf, pos)
+            time = _int64(time)
+        else:
+            pos = _skip(buf, pos, key & 7)
+    return time
+
+
+def _stop_time_update(buf, pos, end, columns):
+    """Reads a `StopTimeUpdate` into the stop time update columns."""
+    stop_sequence = 0
+    stop_id = ''
+    arrival = departure = _NAN
+
+    while pos < end:
+        key, pos = _varint(buf, pos)
+        if key == 0x08:  # 1: stop_sequence
+            stop_sequence, pos = _varint(buf, pos)
+        elif key == 0x12:  # 2: arrival
+            length, pos = _length(buf, pos)
+            arrival = _stop_time_event(buf, pos, pos + length)
+            pos += length
+        elif key == 0x1a:  # 3: departure
+            length, pos = _length(buf, pos)
+            departure = _stop_time_event(buf, pos, pos + length)
+            pos += length
+        elif key == 0x22:  # 4: stop_id
+            stop_id, pos = _string(buf, pos)
+        else:
+            pos = _skip(buf, pos, key & 7)
+
+    columns['stop_id'].append(stop_id)
+    columns['stop_sequence'].append(stop_sequence)
+    columns['arrival'].append(arrival)
+    columns['departure'].append(departure)
+
+
+def _trip_update(buf, pos, end, stop_time_updates):
+    """Reads a `TripUpdate`. Returns its trip descriptor fields; its stop time updates are added to the columns."""
+    trip = ('', '', '')
+    while pos < end:
+        key, pos = _varint(buf, pos)
+        if key == 0x0a:  # 1: trip
+            length, pos = _length(buf, pos)
+            trip = _trip_descriptor(buf, pos, pos + length)
+            pos += length
+        elif key == 0x12:  # 2: stop_time_update
+            length, pos = _length(buf, pos)
+            _stop_time_update(buf, pos, pos + length, stop_time_updates)
+            pos += length
+        else:
+            pos = _skip(buf, pos, key & 7)
+    return trip
+
+
+def _vehicle_position(buf, pos, end):
+    """Reads the fields of a `VehiclePosition` that `dictify` reads."""
+    trip = ('', '', '')
+    current_stop_sequence = timestamp = 0
+    current_status = 2  # The specification default, IN_TRANSIT_TO.
+    stop_id = ''
+
+    while pos < end:
+        key, pos = _varint(buf, pos)
+        if key == 0x0a:  # 1: trip
+            length, pos = _length(buf, pos)
+            trip = _trip_descriptor(buf, pos, pos + length)
+            pos += length
+        elif key == 0x18:  # 3: current_stop_sequence
+            current_stop_sequence, pos = _varint(buf, pos)
+        elif key == 0x20:  # 4: current_status
+            # Like the `gtfs_realtime_pb2` bindings, ignore values outside of the enum, keeping the last known one.
+            status, pos = _varint(buf, pos)
+            if status in _STATUSES:
+                current_status = status
+        elif key == 0x28:  # 5: timestamp
+            timestamp, pos = _varint(buf, pos)
+        elif key == 0x3a:  # 7: stop_id
+            stop_id, pos = _string(buf, pos)
+        else:
+            pos = _skip(buf, pos, key & 7)
+
+    return trip, current_stop_sequence, current_status, timestamp, stop_id
+
+
+def _alert(buf, pos, end):
+    """Reads the text of the first header text translation of an `Alert`, and the trips it informs."""
+    text = ''
+    informed = []
+
+    while pos < end:
+        key, pos = _varint(buf, pos)
+        if key == 0x2a:  # 5: informed_entity
+            length, pos = _length(buf, pos)
+            entity_end = pos + length
+            trip = ('', '', '')
+            while pos < entity_end:
+                key, pos = _varint(buf, pos)
+                if key == 0x22:  # 4: trip
+                    length, pos = _length(buf, pos)
+                    trip = _trip_descriptor(buf, pos, pos + length)
+                    pos += length
+                else:
+                    pos = _skip(buf, pos, key & 7)
+            informed.append((trip[0], trip[2]))
+        elif key == 0x52 and not text:  # 10: header_text
+            length, pos = _length(buf, pos)
+            header_end = pos + length
+            while pos < header_end:
+                key, pos = _varint(buf, pos)
+                if key == 0x0a and not text:  # 1: translation
+                    length, pos = _length(buf, pos)
+                    translation_end = pos + length
+                    while pos < translation_end:
+                        key, pos = _varint(buf, pos)
+                        if key == 0x0a:  # 1: text
+                            text, pos = _string(buf, pos)
+                        else:
+                            pos = _skip(buf, pos, key & 7)
+                else:
+                    pos = _skip(buf, pos, key & 7)
+        else:
+            pos = _skip(buf, pos, key & 7)
+
+    return text, informed
+
+
+def _new_columns():
+    return {
+        'header': {'gtfs_realtime_version': '', 'timestamp': 0},
+        # One row per trip update. Its stop time updates are rows `stop_time_update_offset[i]` (inclusive) through
+        # `stop_time_update_offset[i + 1]` (exclusive) of the stop time update columns.
+        'trip_updates': {'id': [], 'trip_id': [], 'start_date': [], 'route_id': [],
+                         'stop_time_update_offset': array('q', [0])},
+        'stop_time_updates': {'stop_id': [], 'stop_sequence': array('q'), 'arrival': array('d'),
+                              'departure': array('d')},
+        'vehicle_updates': {'id': [], 'trip_id': [], 'start_date': [], 'route_id': [],
+                            'current_stop_sequence': array('q'), 'current_status': array('B'),
+                            'timestamp': array('q'), 'stop_id': []},
+        'alerts': {'id': [], 'text': [], 'informed_entity': []},
+        # The type of each entity, in feed order: 0 for trip updates, 1 for vehicle updates, 2 for alerts.
+        'order': array('b'),
+    }
+
+
+def _trip_update_descriptor(buf, pos, end):
+    """Reads just the trip descriptor fields of a `TripUpdate`, skipping over its stop time updates."""
+    trip = ('', '', '')
+    while pos < end:
+        key, pos = _varint(buf, pos)
+        if key == 0x0a:  # 1: trip
+            length, pos = _length(buf, pos)
+            trip = _trip_descriptor(buf, pos, pos + length)
+            pos += length
+        else:
+            pos = _skip(buf, pos, key & 7)
+    return trip
+
+
+def read_header(content):
+    """
+    Reads just the header of a raw GTFS-Realtime feed, returning a dict with its `gtfs_realtime_version` and
+    `timestamp`. Stops reading as soon as the header has been read, so this is very cheap. Raises a `ValueError` or
+    `IndexError` if the feed is malformed.
+    """
+    buf = memoryview(content)
+    header = {'gtfs_realtime_version': '', 'timestamp': 0}
+    pos, end = 0, len(buf)
+
+    while pos < end:
+        key, pos = _varint(buf, pos)
+        if key == 0x0a:  # 1: header
+            length, pos = _length(buf, pos)
+            header_end = pos + length
+            while pos < header_end:
+                key, pos = _varint(buf, pos)
+                if key == 0x0a:  # 1: gtfs_realtime_version
+                    header['gtfs_realtime_version'], pos = _string(buf, pos)
+                elif key == 0x18:  # 3: timestamp
+                    header['timestamp'], pos = _varint(buf, pos)
+                else:
+                    pos = _skip(buf, pos, key & 7)
+            return header
+        else:
+            pos = _skip(buf, pos, key & 7)
+
+    return header
+
+
+def _entities(buf, header):
+    """
+    Reads the header of a `FeedMessage` into `header`, and returns the entities in it as a list of `(id, kind, start,
+    end)` tuples. `kind` is 0 for trip updates, 1 for vehicle updates and 2 for alerts, and `start` and `end` are the
+    bounds of the submessage to read (or None, for vehicle updates without a vehicle position).
+    """
+    entities = []
+    pos, end = 0, len(buf)
+
+    while pos < end:
+        key, pos = _varint(buf, pos)
+
+        if key == 0x0a:  # 1: header
+            length, pos = _length(buf, pos)
+            header_end = pos + length
+            while pos < header_end:
+                key, pos = _varint(buf, pos)
+                if key == 0x0a:  # 1: gtfs_realtime_version
+                    header['gtfs_realtime_version'], pos = _string(buf, pos)
+                elif key == 0x18:  # 3: timestamp
+                    header['timestamp'], pos = _varint(buf, pos)
+                else:
+                    pos = _skip(buf, pos, key & 7)
+
+        elif key == 0x12:  # 2: entity
+            length, pos = _length(buf, pos)
+            entity_end = pos + length
+            entity_id = ''
+            trip_update = vehicle = alert = None
+
+            # Only note where the submessages are; which one gets read depends on what else is present.
+            while pos < entity_end:
+                key, pos = _varint(buf, pos)
+                if key == 0x0a:  # 1: id
+                    entity_id, pos = _string(buf, pos)
+                elif key in (0x1a, 0x22, 0x2a):  # 3: trip_update, 4: vehicle, 5: alert
+                    length, pos = _length(buf, pos)
+                    if key == 0x1a:
+                        trip_update = (pos, pos + length)
+                    elif key == 0x22:
+                        vehicle = (pos, pos + length)
+                    else:
+                        alert = (pos, pos + length)
+                    pos += length
+                else:
+                    pos = _skip(buf, pos, key & 7)
+
+            # `dictify` classifies non-empty alerts as alerts, trip updates with a route id as trip updates, and
+            # everything else as a vehicle update.
+            if alert is not None and alert[0] != alert[1]:
+                entities.append((entity_id, 2) + alert)
+            elif trip_update is not None and _trip_update_descriptor(buf, *trip_update)[2] != '':
+                entities.append((entity_id, 0) + trip_update)
+            else:
+                entities.append((entity_id, 1) + (vehicle if vehicle is not None else (None, None)))
+
+        else:
+            pos = _skip(buf, pos, key & 7)
+
+    return entities
+
+
+def decode(content, routes=None, trip_filter=None):
+    """
+    Decodes the raw bytes of a GTFS-Realtime feed into columns. Raises a `ValueError` or `IndexError` if the feed
+    is malformed.
+
+    Entities are classified into trip updates, vehicle updates and alerts in the same way that `dictify` classifies
+    them. `routes` and `trip_filter` filter trips in the same way that they do in `dictify`; the stop time updates of
+    trips which are filtered out are never read.
+    """
+    buf = memoryview(content)
+    columns = _new_columns()
+    trip_updates, stop_time_updates = columns['trip_updates'], columns['stop_time_updates']
+    vehicle_updates, alerts, order = columns['vehicle_updates'], columns['alerts'], columns['order']
+
+    entities = _entities(buf, columns['header'])
+
+    # When filtering, find the trips that are being dropped first, so that their vehicle updates get dropped too.
+    keep = trip_predicate(routes, trip_filter)
+    kept_trip_ids = dropped_trip_ids = set()
+
+    if keep is not None:
+        kept_trip_ids, dropped_trip_ids = set(), set()
+        for _, kind, start, end in entities:
+            if kind == 0:
+                trip_id, _, route_id = _trip_update_descriptor(buf, start, end)
+                (kept_trip_ids if keep(trip_id, route_id) else dropped_trip_ids).add(trip_id)
+        dropped_trip_ids -= kept_trip_ids
+
+    for entity_id, kind, start, end in entities:
+        if kind == 0:
+            if keep is not None and _trip_update_descriptor(buf, start, end)[0] not in kept_trip_ids:
+                continue
+
+            trip = _trip_update(buf, start, end, stop_time_updates)
+            trip_updates['id'].append(entity_id)
+            trip_updates['trip_id'].append(trip[0])
+            trip_updates['start_date'].append(trip[1])
+            trip_updates['route_id'].append(trip[2])
+            trip_updates['stop_time_update_offset'].append(len(stop_time_updates['stop_id']))
+
+        elif kind == 1:
+            trip, current_stop_sequence, current_status, timestamp, stop_id = (
+                _vehicle_position(buf, start, end) if start is not None else (('', '', ''), 0, 2, 0, '')
+            )
+            if trip[0] in dropped_trip_ids:
+                continue
+
+            vehicle_updates['id'].append(entity_id)
+            vehicle_updates['trip_id'].append(trip[0])
+            vehicle_updates['start_date'].append(trip[1])
+            vehicle_updates['route_id'].append(trip[2])
+            vehicle_updates['current_stop_sequence'].append(current_stop_sequence)
+            vehicle_updates['current_status'].append(current_status)
+            vehicle_updates['timestamp'].append(timestamp)
+            vehicle_updates['stop_id'].append(stop_id)
+
+        else:
+            text, informed = _alert(buf, start, end)
+            if keep is not None and not any(trip_id in kept_trip_ids or keep(trip_id, route_id)
+                                            for trip_id, route_id in informed):
+                continue
+
+            alerts['id'].append(entity_id)
+            alerts['text'].append(text)
+            alerts['informed_entity'].append(informed)
+
+        order.append(kind)
+
+    return columns
+
+
+def to_dictified(columns):
+    """
+    Converts the columns returned by `decode` into the dictified feed representation returned by `dictify`.
+    """
+    header = columns['header']
+    trip_updates, stop_time_updates = columns['trip_updates'], columns['stop_time_updates']
+    vehicle_updates, alerts = columns['vehicle_updates'], columns['alerts']
+    offsets = trip_updates['stop_time_update_offset']
+    stop_ids, arrivals, departures = (stop_time_updates['stop_id'], stop_time_updates['arrival'],
+                                      stop_time_updates['departure'])
+
+    entities = []
+    t_i = v_i = a_i = 0
+
+    for kind in columns['order']:
+        if kind == 0:
+            entities.append({
+                'id': trip_updates['id'][t_i],
+                'trip_update': {
+                    'trip': {
+                        'trip_id': trip_updates['trip_id'][t_i],
+                        'start_date': trip_updates['start_date'][t_i],
+                        'route_id': trip_updates['route_id'][t_i]
+                    },
+                    'stop_time_update': [
+                        {
+                            'stop_id': stop_ids[i],
+                            'arrival': _NAN if arrivals[i] != arrivals[i] else int(arrivals[i]),
+                            'departure': _NAN if departures[i] != departures[i] else int(departures[i])
+                        } for i in range(offsets[t_i], offsets[t_i + 1])
+                    ]
+                },
+                'type': 'trip_update'
+            })
+            t_i += 1
+        elif kind == 1:
+            entities.append({
+                'id': vehicle_updates['id'][v_i],
+                'vehicle': {
+                    'trip': {
+                        'trip_id': vehicle_updates['trip_id'][v_i],
+                        'start_date': vehicle_updates['start_date'][v_i],
+                        'route_id': vehicle_updates['route_id'][v_i]
+                    },
+                    'current_stop_sequence': vehicle_updates['current_stop_sequence'][v_i],
+                    'current_status': _STATUSES[vehicle_updates['current_status'][v_i]],
+                    'timestamp': vehicle_updates['timestamp'][v_i],
+                    'stop_id': vehicle_updates['stop_id'][v_i]
+                },
+                'type': 'vehicle_update'
+            })
+            v_i += 1
+        else:
+            entities.append({
+                'id': alerts['id'][a_i],
+                'alert': {
+                    'header_text': {'translation': {'text': alerts['text'][a_i]}},
+                    'informed_entity': [{'trip_id': trip_id, 'route_id': route_id}
+                                        for trip_id, route_id in alerts['informed_entity'][a_i]]
+                },
+                'type': 'alert'
+            })
+            a_i += 1
+
+    return correct({'header': dict(header), 'entity': entities})
+
+
+def dictify_content(content, routes=None, trip_filter=None):
+    """
+    Drop-in replacement for `decode_content` (that is, `dictify(parse_feed_bytes(content))`) which uses the wire
+    decoder. Returns None if the feed is malformed.
+    """
+    try:
+        columns = decode(content, routes=routes, trip_filter=trip_filter)
+    except (ValueError, IndexError, OverflowError, UnicodeDecodeError):
+        return None
+    return to_dictified(columns)
+
+
+def decode_to_shared(content, routes=None, trip_filter=None):
+    """
+    Like `dictify_content`, but for use in worker processes: decodes a feed, and returns its columns in shared memory
+    (as a `gtfs_tripify.shared.SharedColumns` descriptor) instead of as a dictified feed, which would otherwise have to
+    be pickled to be sent back. Returns None if the feed is malformed. Pass the result to `from_shared`.
+    """
+    from gtfs_tripify.shared import SharedColumns
+
+    try:
+        columns = decode(content, routes=routes, trip_filter=trip_filter)
+    except (ValueError, IndexError, OverflowError, UnicodeDecodeError):
+        return None
+    return SharedColumns.create(columns)
+
+
+def from_shared(descriptor):
+    """
+    Converts the columns returned by `decode_to_shared` into a dictified feed (or None, if the feed was malformed),
+    freeing the shared memory they were held in.
+    """
+    if descriptor is None:
+        return None
+    with descriptor.attach(unlink=True) as columns:
+        return to_dictified(columns)
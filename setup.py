@@ -3,12 +3,16 @@ from setuptools import setup
 setup(
     name='gtfs-tripify',
     version='0.0.1',
+    packages=['gtfs_tripify'],
     install_requires=['numpy', 'pandas'],
     description='TODO.',
     author='Aleksey Bilogur',
     author_email='aleksey.bilogur@gmail.com',
     url='https://github.com/ResidentMario/gtfs-tripify',
     download_url='https://github.com/ResidentMario/gtfs-tripify/tarball/0.0.1',
+    entry_points={
+        'console_scripts': ['gtfs-tripify = gtfs_tripify.cli:main'],
+    },
     keywords=['TODO'],
     classifiers=[]
 )
\ No newline at end of file
@@ -0,0 +1,85 @@
+"""
+Action store test module. Asserts that action tables are persisted and read back out correctly, and that logbooks
+built out of the store are the same as ones built out of the feeds.
+"""
+import unittest
+import os
+import shutil
+import tempfile
+
+import pandas as pd
+from google.transit import gtfs_realtime_pb2
+
+import sys; sys.path.append("../")
+import gtfs_tripify as gt
+from gtfs_tripify.actionstore import ActionStore
+from gtfs_tripify.tripify import action_tables
+
+
+class TestActionStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.feeds = []
+        for name in ['gtfs-20160512T0400Z', 'gtfs-20160512T0401Z']:
+            with open('./fixtures/' + name, 'rb') as f:
+                feed = gtfs_realtime_pb2.FeedMessage()
+                feed.ParseFromString(f.read())
+            self.feeds.append(gt.dictify(feed))
+
+        # A third feed, in the next hour.
+        header = dict(self.feeds[1]['header'], timestamp=self.feeds[1]['header']['timestamp'] + 3600)
+        self.feeds.append(dict(self.feeds[1], header=header))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_round_trip(self):
+        store = ActionStore(self.tmp)
+        store.write(self.feeds)
+
+        assert sorted(os.listdir(self.tmp)) == ['1463022000', '1463025600']
+        assert store.read() == action_tables(self.feeds)
+
+    def test_read_time_range(self):
+        store = ActionStore(self.tmp)
+        store.write(self.feeds)
+
+        assert [t for t, _ in store.read(start=1463025456)] == [1463025494, 1463029094]
+        assert [t for t, _ in store.read(end=1463025494)] == [1463025455]
+        assert [t for t, _ in store.read(start=1463029094)] == [1463029094]
+        assert store.read(start=1463029095) == []
+
+    def test_read_later_feed(self):
+        """
+        Reading a later feed out of a segment on its own should give the same stop lists, including the ones it shares
+        with earlier feeds in the segment.
+        """
+        store = ActionStore(self.tmp)
+        store.write(self.feeds)
+        assert store.read(start=1463025456, end=1463025495) == action_tables(self.feeds)[1:2]
+
+    def test_overlapping_writes(self):
+        """
+        Feeds written more than once should only be read back out once.
+        """
+        store = ActionStore(self.tmp)
+        store.write(self.feeds[:2])
+        store.write(self.feeds[1:])
+
+        assert store.timestamps() == [1463025455, 1463025494, 1463029094]
+        assert [t for t, _ in store.read()] == [1463025455, 1463025494, 1463029094]
+
+    def test_logify(self):
+        """
+        A logbook built out of the store should be the same as one built out of the feeds.
+        """
+        store = ActionStore(self.tmp)
+        store.write(self.feeds)
+
+        expected = gt.logify(self.feeds)
+        result = store.logify()
+        assert list(result.keys()) == list(expected.keys())
+        for key in expected:
+            pd.testing.assert_frame_equal(result[key], expected[key])
+
+        assert len(store.logify(end=1463029094)) == len(gt.logify(self.feeds[:2]))
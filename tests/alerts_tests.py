@@ -0,0 +1,77 @@
+"""
+Alert processing test module. Asserts that alerts are indexed into intervals and joined onto trip logs correctly.
+"""
+import unittest
+import copy
+
+from google.transit import gtfs_realtime_pb2
+
+import sys; sys.path.append("../")
+import gtfs_tripify as gt
+from gtfs_tripify.alerts import AlertIndex, attach_alerts
+
+
+class TestAlertIndex(unittest.TestCase):
+    def setUp(self):
+        self.feeds = []
+        for name in ['gtfs-20160512T0400Z', 'gtfs-20160512T0401Z']:
+            with open('./fixtures/' + name, 'rb') as f:
+                feed = gtfs_realtime_pb2.FeedMessage()
+                feed.ParseFromString(f.read())
+            self.feeds.append(gt.dictify(feed))
+
+        # A later feed with the alert taken down, and a route-wide alert put up in its place.
+        feed = copy.deepcopy(self.feeds[1])
+        feed['header']['timestamp'] = 1463025600
+        alert = next(message for message in feed['entity'] if message['type'] == 'alert')
+        alert['alert'] = {'header_text': {'translation': {'text': 'Service change'}},
+                          'informed_entity': [{'trip_id': '', 'route_id': '5'}]}
+        self.feeds.append(feed)
+
+    def test_intervals(self):
+        index = AlertIndex.from_feeds(self.feeds)
+
+        assert index.texts == ['Train delayed', 'Service change']
+        assert index.intervals.values.tolist() == [
+            ['', '5', 1, 1463025600, 1463025600],
+            ['000100_3..N42R', '3', 0, 1463025455, 1463025494],
+            ['056900_5..S', '5', 0, 1463025455, 1463025494]
+        ]
+
+    def test_query(self):
+        index = AlertIndex.from_feeds(self.feeds)
+
+        result = index.query(trip_id='056900_5..S')
+        assert result['text'].tolist() == ['Train delayed']
+        assert len(index.query(trip_id='056900_5..S', start=1463025495)) == 0
+        assert index.query(route_id='5', start=1463025495)['text'].tolist() == ['Service change']
+        assert len(index.query(trip_id='nonexistent')) == 0
+
+    def test_attach_alerts(self):
+        logbook = gt.logify(self.feeds[:2])
+        index = AlertIndex.from_feeds(self.feeds[:2])
+        result = attach_alerts(logbook, index)
+
+        assert list(result.keys()) == list(logbook.keys())
+        trip_log = result['056900_5..S_0']
+        assert trip_log['alerts'].map(len).sum() > 0
+        assert set(trip_log['alerts'].sum()) == {'Train delayed'}
+        assert all(len(alerts) == 0 for key, trip_log in result.items() if key != '056900_5..S_0'
+                   for alerts in trip_log['alerts'])
+
+    def test_attach_route_alerts(self):
+        logbook = gt.logify(self.feeds)
+        index = AlertIndex.from_feeds(self.feeds)
+        result = attach_alerts(logbook, index)
+
+        for trip_log in result.values():
+            route_alerts = {text for alerts in trip_log['alerts'] for text in alerts if text == 'Service change'}
+            assert bool(route_alerts) == (trip_log['route_id'].iloc[0] == '5' and
+                                          (trip_log['maximum_time'].isnull() |
+                                           (trip_log['maximum_time'] >= 1463025600)).any())
+
+    def test_empty(self):
+        logbook = gt.logify(self.feeds[:1])
+        index = AlertIndex()
+        result = attach_alerts(logbook, index)
+        assert all(len(alerts) == 0 for trip_log in result.values() for alerts in trip_log['alerts'])
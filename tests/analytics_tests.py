@@ -0,0 +1,69 @@
+"""
+Analytics test module. Asserts that event time estimates, headways, dwell bounds and cubes are computed correctly.
+"""
+import unittest
+
+import numpy as np
+import pandas as pd
+
+import sys; sys.path.append("../")
+from gtfs_tripify import analytics
+from gtfs_tripify.columnar import ColumnarLogbook
+
+
+def trip_log(trip_id, route_id, rows):
+    return pd.DataFrame([(trip_id, route_id, action, lo, hi, stop_id, 0) for action, lo, hi, stop_id in rows],
+                        columns=['trip_id', 'route_id', 'action', 'minimum_time', 'maximum_time', 'stop_id',
+                                 'latest_information_time'])
+
+
+class TestAnalytics(unittest.TestCase):
+    def setUp(self):
+        self.logbook = {
+            'A_0': trip_log('A', '1', [('STOPPED_AT', np.nan, 100.0, 'S1'), ('STOPPED_OR_SKIPPED', 200.0, 300.0, 'S2'),
+                                       ('EN_ROUTE_TO', 300.0, np.nan, 'S3')]),
+            'B_0': trip_log('B', '1', [('STOPPED_AT', 400.0, 600.0, 'S1'), ('STOPPED_AT', 3600.0, 3700.0, 'S2')]),
+            'C_0': trip_log('C', '1', [('STOPPED_AT', 1000.0, 1100.0, 'S1')]),
+            'D_0': trip_log('D', '2', [('STOPPED_AT', 700.0, 800.0, 'S1')])
+        }
+
+    def test_estimate_times(self):
+        events = analytics.estimate_times(self.logbook)
+        assert list(events['unique_trip_id']) == ['A_0', 'A_0', 'B_0', 'B_0', 'C_0', 'D_0']
+        assert list(events['estimated_time']) == [100.0, 250.0, 500.0, 3650.0, 1050.0, 750.0]
+
+        events = analytics.estimate_times(self.logbook, method='minimum', actions=None)
+        assert list(events['estimated_time'])[:3] == [100.0, 200.0, 300.0]
+        assert list(analytics.estimate_times(self.logbook, method=0.25)['estimated_time'])[:2] == [100.0, 225.0]
+
+        with self.assertRaises(ValueError):
+            analytics.estimate_times(self.logbook, method='mean')
+
+    def test_estimate_times_columnar(self):
+        pd.testing.assert_frame_equal(analytics.estimate_times(ColumnarLogbook.from_logbook(self.logbook)),
+                                      analytics.estimate_times(self.logbook))
+
+    def test_headways(self):
+        result = analytics.headways(analytics.estimate_times(self.logbook))
+        result = result.set_index(['route_id', 'stop_id', 'unique_trip_id'])['headway']
+
+        assert np.isnan(result[('1', 'S1', 'A_0')])
+        assert result[('1', 'S1', 'B_0')] == 400.0
+        assert result[('1', 'S1', 'C_0')] == 550.0
+        assert np.isnan(result[('2', 'S1', 'D_0')])
+        assert result[('1', 'S2', 'B_0')] == 3400.0
+
+        # Across routes.
+        result = analytics.headways(analytics.estimate_times(self.logbook), by=['stop_id'])
+        assert list(result[result['stop_id'] == 'S1']['headway'])[1:] == [400.0, 250.0, 300.0]
+
+    def test_dwell_bounds(self):
+        result = analytics.dwell_bounds(analytics.estimate_times(self.logbook))
+        assert list(result['dwell_bound'].fillna(-1)) == [-1, -1, 200.0, 100.0, 100.0, 100.0]
+
+    def test_cube(self):
+        result = analytics.cube(analytics.headways(analytics.estimate_times(self.logbook)))
+        assert result.loc[('1', 'S1', 0), 'count'] == 2
+        assert result.loc[('1', 'S1', 0), 'mean'] == 475.0
+        assert result.loc[('1', 'S2', 3600), 'count'] == 1
+        assert ('1', 'S2', 3600) in result.index and ('2', 'S2', 0) not in result.index
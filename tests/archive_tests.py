@@ -0,0 +1,155 @@
+"""
+Archive index test module. Asserts that feeds are indexed and read out of archives correctly.
+"""
+import unittest
+import datetime
+import os
+import shutil
+import tarfile
+import tempfile
+
+import sys; sys.path.append("../")
+from gtfs_tripify import archive
+from gtfs_tripify.wire import read_header
+
+FIXTURES = ['gtfs-20160512T0400Z', 'gtfs-20160512T0401Z']
+
+
+class TestFeedIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.directory = os.path.join(self.tmp, 'feeds')
+        os.mkdir(self.directory)
+        for name in FIXTURES:
+            shutil.copy('./fixtures/' + name, os.path.join(self.directory, name))
+        # An exact duplicate, and a garbage file.
+        shutil.copy('./fixtures/' + FIXTURES[0], os.path.join(self.directory, 'copy'))
+        with open(os.path.join(self.directory, 'garbage'), 'wb') as f:
+            f.write(b'\xff\xff\xff')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def make_tar(self, mode):
+        path = os.path.join(self.tmp, 'feeds.tar' + ('' if mode == 'w' else '.gz'))
+        with tarfile.open(path, mode) as tar:
+            for name in sorted(os.listdir(self.directory)):
+                tar.add(os.path.join(self.directory, name), arcname=name)
+        return path
+
+    def test_read_header(self):
+        with open('./fixtures/' + FIXTURES[0], 'rb') as f:
+            header = read_header(f.read())
+        assert header['timestamp'] == 1463025455
+
+    def test_build_index(self):
+        index = archive.build_index(self.directory)
+        assert len(index) == 4
+        assert os.path.exists(archive.index_path(self.directory))
+        assert [entry[0] for entry in index.entries] == [-1, 1463025455, 1463025455, 1463025494]
+
+    def test_incremental(self):
+        """
+        Updating an index should only read the feeds which were added since it was last built, and should drop the
+        feeds which were removed.
+        """
+        archive.build_index(self.directory)
+        os.remove(os.path.join(self.directory, 'copy'))
+        shutil.copy('./fixtures/' + FIXTURES[0], os.path.join(self.directory, 'another'))
+
+        read = []
+        _index_members = archive._index_members
+        archive._index_members = lambda path, members: read.extend(members) or _index_members(path, members)
+        try:
+            index = archive.build_index(self.directory)
+        finally:
+            archive._index_members = _index_members
+
+        assert [member[0] for member in read] == ['another']
+        assert len(index) == 4
+
+    def test_stale_entries(self):
+        """
+        Entries for deleted feeds should be dropped, and feeds which were modified in place should be read again.
+        """
+        archive.build_index(self.directory)
+        os.remove(os.path.join(self.directory, 'garbage'))
+        shutil.copy('./fixtures/' + FIXTURES[1], os.path.join(self.directory, 'copy'))
+        os.utime(os.path.join(self.directory, 'copy'), ns=(0, 0))
+
+        index = archive.build_index(self.directory)
+        assert sorted(entry[4] for entry in index.entries) == ['copy'] + FIXTURES
+        assert [entry[0] for entry in index.entries] == [1463025455, 1463025494, 1463025494]
+        assert archive.FeedIndex.load(archive.index_path(self.directory)).entries == index.entries
+
+    def test_save_load_quoting(self):
+        """
+        Names containing tabs, newlines and quotes should survive a round trip through the index file.
+        """
+        path = os.path.join(self.tmp, 'index')
+        index = archive.FeedIndex([(1, 0, 10, 'abc', 'a\tb', 1), (2, 0, 10, 'def', 'c\n"d"', 2)])
+        index.save(path)
+        assert archive.FeedIndex.load(path).entries == index.entries
+
+    def test_save_load(self):
+        index = archive.build_index(self.directory)
+        assert archive.FeedIndex.load(archive.index_path(self.directory)).entries == index.entries
+
+    def test_query(self):
+        index = archive.build_index(self.directory)
+        assert len(index.query()) == 3
+        assert len(index.query(1463025455, 1463025494)) == 2
+        assert len(index.query(1463025456)) == 1
+        assert len(index.query(end=datetime.datetime(2016, 5, 12, 3, 57))) == 0
+        assert len(index.query(start=datetime.datetime(2016, 5, 12, 3, 57))) == 3
+
+    def test_read_feeds_directory(self):
+        feeds = archive.read_feeds(self.directory, start=1463025455, end=1463025494)
+        assert len(feeds) == 1
+        assert feeds[0]['header']['timestamp'] == 1463025455
+        assert len(archive.read_feeds(self.directory)) == 2
+
+    def test_read_feeds_tar(self):
+        path = self.make_tar('w')
+        index = archive.build_index(path, workers=2)
+        assert len(index) == 4
+        feeds = archive.read_feeds(path, index=index)
+        assert [feed['header']['timestamp'] for feed in feeds] == [1463025455, 1463025494]
+
+    def test_read_feeds_compressed_tar(self):
+        path = self.make_tar('w:gz')
+        feeds = archive.read_feeds(path, start=1463025456)
+        assert [feed['header']['timestamp'] for feed in feeds] == [1463025494]
+
+    def test_iter_feed_bytes_compressed_tar(self):
+        """
+        Reading from a compressed tar file should stop once the last feed wanted has been read, and should yield
+        feeds in time order even if they are stored out of order.
+        """
+        from unittest import mock
+
+        path = self.make_tar('w:gz')
+        index = archive.build_index(path)
+        with mock.patch.object(tarfile.TarFile, 'next', autospec=True, side_effect=tarfile.TarFile.next) as next_:
+            contents = list(archive.iter_feed_bytes(path, end=1463025456, index=index))
+        assert [read_header(content)['timestamp'] for content in contents] == [1463025455]
+        # Reading stops at the member after the wanted one, short of the four members in the archive.
+        assert next_.call_count < 4
+
+        with mock.patch.object(tarfile.TarFile, 'extractfile', autospec=True,
+                               side_effect=tarfile.TarFile.extractfile) as extractfile:
+            feeds = archive.iter_feed_bytes(path, index=index)
+            next(feeds)
+            assert [call.args[1].name for call in extractfile.call_args_list] == ['copy']
+
+        reversed_path = os.path.join(self.tmp, 'reversed.tar.gz')
+        with tarfile.open(reversed_path, 'w:gz') as tar:
+            for name in reversed(FIXTURES):
+                tar.add(os.path.join(self.directory, name), arcname=name)
+        contents = list(archive.iter_feed_bytes(reversed_path))
+        assert [read_header(content)['timestamp'] for content in contents] == [1463025455, 1463025494]
+
+    def test_routes(self):
+        feeds = archive.read_feeds(self.directory, routes=['1'])
+        assert all(m['trip_update']['trip']['route_id'] == '1' for m in feeds[0]['entity']
+                   if m['type'] == 'trip_update')
@@ -0,0 +1,181 @@
+"""
+`gtfs-tripify` command-line tool test module. Asserts that the ingest tool is correct.
+"""
+import unittest
+import pytest
+import io
+import os
+import sqlite3
+import tarfile
+import tempfile
+import shutil
+
+import sys; sys.path.append("../")
+from gtfs_tripify import cli
+
+
+class TestIngest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.db = os.path.join(self.tmp, 'out.db')
+        self.source = "./fixtures/gtfs-2016*"
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def count(self):
+        conn = sqlite3.connect(self.db)
+        result = conn.execute("SELECT COUNT(*) FROM Logbooks").fetchone()[0]
+        conn.close()
+        return result
+
+    def test_glob_to_sqlite(self):
+        """
+        The result should be identical to that of `stream_to_sql`.
+        """
+        assert cli.main([self.source, self.db, '--quiet']) == 0
+        assert self.count() == 2079
+
+    def test_tar_to_sqlite(self):
+        archive = os.path.join(self.tmp, 'feeds.tar.gz')
+        with tarfile.open(archive, 'w:gz') as tar:
+            for name in ['gtfs-20160512T0400Z', 'gtfs-20160512T0401Z']:
+                tar.add('./fixtures/' + name, arcname=name)
+
+        cli.main([archive, self.db, '--quiet'])
+        assert self.count() == 2079
+
+    def test_workers(self):
+        cli.main([self.source, self.db, '--quiet', '--workers', '2'])
+        assert self.count() == 2079
+
+    def test_resume(self):
+        """
+        Feeds recorded in the checkpoint should not be processed again.
+        """
+        cli.main([self.source, self.db, '--quiet', '--resume'])
+        assert os.path.exists(self.db + '.checkpoint')
+        assert cli.ingest(self.source, self.db, checkpoint=self.db + '.checkpoint') == 0
+        assert self.count() == 2079
+
+    def test_chunking(self):
+        n = cli.ingest(self.source, self.db, chunk_size=1)
+        assert n == 2
+        assert self.count() > 0
+
+    def trips(self, db, columns=('unique_trip_id', 'stop_id', 'action')):
+        conn = sqlite3.connect(db)
+        rows = conn.execute("SELECT {0} FROM Logbooks ORDER BY event_id".format(', '.join(columns))).fetchall()
+        conn.close()
+        return sorted(rows)
+
+    def test_chunking_merges_trips(self):
+        """
+        Trips spanning two chunks should be merged, so that chunking does not change the trips written or the stops
+        in them. Stop times follow `merge_logbooks`, which cannot always recover every bound a single run would.
+        """
+        single = os.path.join(self.tmp, 'single.db')
+        cli.ingest(self.source, single, chunk_size=1000)
+        cli.ingest(self.source, self.db, chunk_size=1)
+        assert self.trips(self.db) == self.trips(single)
+        assert len({row[0] for row in self.trips(self.db)}) == 94
+
+    def test_chunking_merges_trips_parquet(self):
+        pd = pytest.importorskip('pandas')
+        pytest.importorskip('pyarrow')
+
+        def read(out):
+            df = pd.concat([pd.read_parquet(os.path.join(out, name)) for name in sorted(os.listdir(out))])
+            return sorted(df[['unique_trip_id', 'stop_id', 'action']].itertuples(index=False, name=None))
+
+        single, chunked = os.path.join(self.tmp, 'single'), os.path.join(self.tmp, 'chunked')
+        cli.ingest(self.source, single, fmt='parquet', chunk_size=1000)
+        cli.ingest(self.source, chunked, fmt='parquet', chunk_size=1)
+        assert read(chunked) == read(single)
+
+    def test_parquet_keys_unique(self):
+        """
+        Keys should be unique across every part file in the output directory, including those written by earlier runs.
+        """
+        pd = pytest.importorskip('pandas')
+        pytest.importorskip('pyarrow')
+
+        out = os.path.join(self.tmp, 'out')
+        cli.ingest(self.source, out, fmt='parquet', chunk_size=1)
+        cli.ingest(self.source, out, fmt='parquet', chunk_size=1)
+
+        keys = [set(pd.read_parquet(os.path.join(out, name))['unique_trip_id']) for name in sorted(os.listdir(out))]
+        assert sum(len(part) for part in keys) == len(set().union(*keys)) == 2 * 94
+
+    def test_resume_parquet(self):
+        """
+        Trips held back when a run is cut short should be picked up again by the resumed run.
+        """
+        from unittest import mock
+        from gtfs_tripify.tripify import logify
+        pd = pytest.importorskip('pandas')
+        pytest.importorskip('pyarrow')
+
+        def read(out):
+            df = pd.concat([pd.read_parquet(os.path.join(out, name)) for name in sorted(os.listdir(out))])
+            return sorted(df[['unique_trip_id', 'stop_id', 'action']].itertuples(index=False, name=None))
+
+        single, resumed = os.path.join(self.tmp, 'single'), os.path.join(self.tmp, 'resumed')
+        checkpoint = os.path.join(self.tmp, 'resumed.checkpoint')
+        cli.ingest(self.source, single, fmt='parquet', chunk_size=1)
+
+        def crash(feeds):
+            # Cut the run short while processing its second chunk.
+            if crash.calls:
+                raise RuntimeError
+            crash.calls += 1
+            return logify(feeds)
+
+        crash.calls = 0
+        with mock.patch('gtfs_tripify.tripify.logify', crash):
+            with self.assertRaises(RuntimeError):
+                cli.ingest(self.source, resumed, fmt='parquet', chunk_size=1, checkpoint=checkpoint)
+        assert os.path.exists(resumed + '.open.parquet')
+
+        assert cli.ingest(self.source, resumed, fmt='parquet', chunk_size=1, checkpoint=checkpoint) == 1
+        assert not os.path.exists(resumed + '.open.parquet')
+        assert read(resumed) == read(single)
+
+    def test_late_feeds_dropped(self):
+        """
+        A feed older than the previous chunk cannot be merged in, and should be dropped.
+        """
+        source = os.path.join(self.tmp, 'feeds')
+        os.makedirs(source)
+        # Name the feeds so that the later one sorts first.
+        shutil.copy('./fixtures/gtfs-20160512T0401Z', os.path.join(source, 'a'))
+        shutil.copy('./fixtures/gtfs-20160512T0400Z', os.path.join(source, 'b'))
+
+        progress = io.StringIO()
+        assert cli.ingest(source, self.db, chunk_size=1, progress=progress) == 2
+        assert '1 dropped as late' in progress.getvalue().splitlines()[-1]
+
+    def test_iter_inputs(self):
+        names = [name for name, _ in cli.iter_inputs("./fixtures")]
+        assert len(names) == 3
+        assert names == sorted(names)
+
+    def test_parquet(self):
+        pd = pytest.importorskip('pandas')
+        pytest.importorskip('pyarrow')
+
+        out = os.path.join(self.tmp, 'out')
+        cli.main([self.source, out, '--quiet', '--format', 'parquet'])
+        df = pd.read_parquet(os.path.join(out, 'part-00000.parquet'))
+        assert len(df) == 2079
+
+    def test_wire_decoder(self):
+        cli.main([self.source, self.db, '--quiet', '--decoder', 'wire'])
+        assert self.count() == 2079
+
+    def test_wire_decoder_workers(self):
+        """
+        With more than one worker, decoded feeds come back through shared memory.
+        """
+        cli.main([self.source, self.db, '--quiet', '--decoder', 'wire', '--workers', '2'])
+        assert self.count() == 2079
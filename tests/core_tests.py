@@ -905,3 +905,96 @@ class TripLogbookTests(unittest.TestCase):
         logbook = gt.logify([self.log_0, self.log_1])
 
         assert len(logbook) == 94
+
+    def test_logbook_unchanged_trips(self):
+        """
+        Trips whose messages do not change between feeds should not be re-actionified, but should still be updated
+        with the latest information time.
+        """
+        from unittest import mock
+        from gtfs_tripify.tripify import _parse_message_list_into_action_log
+
+        log_2 = dict(self.log_1, header=dict(self.log_1['header'], timestamp=self.log_1['header']['timestamp'] + 60))
+
+        with mock.patch('gtfs_tripify.tripify._parse_message_list_into_action_log',
+                        wraps=_parse_message_list_into_action_log) as parse:
+            logbook = gt.logify([self.log_1, log_2], lean=False)
+            assert parse.call_count == len(logbook)
+
+        latest = max(trip_log['latest_information_time'].max() for trip_log in logbook.values())
+        assert latest == self.log_1['header']['timestamp'] + 60
+
+    def test_logbook_lean(self):
+        """
+        The lean action-log mode should produce exactly the same logbook as the full one.
+        """
+        lean = gt.logify([self.log_0, self.log_1])
+        full = gt.logify([self.log_0, self.log_1], lean=False)
+
+        assert lean.keys() == full.keys()
+        for key in full:
+            pd.testing.assert_frame_equal(lean[key].reset_index(drop=True), full[key].reset_index(drop=True))
+
+    def test_logbook_parallel(self):
+        """
+        Assembling trip logs in a process pool should produce exactly the same logbook, in the same order, as doing
+        so serially.
+        """
+        serial = gt.logify([self.log_0, self.log_1])
+
+        for workers in [2, 3]:
+            parallel = gt.logify([self.log_0, self.log_1], workers=workers)
+            assert list(parallel.keys()) == list(serial.keys())
+            for key in serial:
+                pd.testing.assert_frame_equal(parallel[key], serial[key])
+
+    def test_logbook_lazy(self):
+        """
+        A lazy logbook should expose its keys and trip time bounds without assembling any trip logs, and should
+        assemble the same trip logs as an eager one on access.
+        """
+        from unittest import mock
+        from gtfs_tripify.tripify import _assemble_trip_log
+
+        eager = gt.logify([self.log_0, self.log_1])
+        t0, t1 = self.log_0['header']['timestamp'], self.log_1['header']['timestamp']
+
+        with mock.patch('gtfs_tripify.tripify._assemble_trip_log', wraps=_assemble_trip_log) as assemble:
+            lazy = gt.logify([self.log_0, self.log_1], lazy=True)
+            assert list(lazy.keys()) == list(eager.keys())
+            assert lazy.feed_bounds == (t0, t1)
+            assert all(t0 <= first <= last <= t1 for first, last in lazy.time_bounds.values())
+            assert assemble.call_count == 0
+
+            key = next(iter(lazy))
+            pd.testing.assert_frame_equal(lazy[key], eager[key])
+            lazy[key]
+            assert assemble.call_count == 1
+
+        for key in eager:
+            pd.testing.assert_frame_equal(lazy[key], eager[key])
+
+    def test_logbook_lazy_cache_size(self):
+        """
+        A lazy logbook with a bounded cache should only hold on to the most recently used trip logs.
+        """
+        lazy = gt.logify([self.log_0, self.log_1], lazy=True, cache_size=2)
+        a, b, c = list(lazy.keys())[:3]
+
+        lazy[a], lazy[b], lazy[a], lazy[c]
+        assert list(lazy._cache.keys()) == [a, c]
+
+    def test_logbook_lazy_discard_partial_logs(self):
+        """
+        Trimming a lazy logbook should keep the same trips as trimming the equivalent eager logbook.
+        """
+        log_2 = dict(self.log_1, header=dict(self.log_1['header'], timestamp=self.log_1['header']['timestamp'] + 60))
+        feeds = [self.log_0, self.log_1, log_2]
+        lazy = gt.logify(feeds, lazy=True)
+        trimmed = gt.utils.discard_partial_logs(lazy)
+        expected = gt.utils.discard_partial_logs(gt.logify(feeds))
+
+        assert set(trimmed.keys()) == set(expected.keys())
+        assert '133300_2..S01R_0' in trimmed
+        for key in expected:
+            assert trimmed[key].equals(expected[key])
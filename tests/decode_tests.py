@@ -0,0 +1,250 @@
+"""
+`gtfs-tripify` decoding test module. Asserts that the lightweight decoding stage is correct.
+"""
+import unittest
+import subprocess
+
+import sys; sys.path.append("../")
+import gtfs_tripify as gt
+
+
+class TestLazyImport(unittest.TestCase):
+    """
+    Tests that the package defers its heavy imports until they are needed.
+    """
+    def run_isolated(self, statement):
+        return subprocess.check_output([sys.executable, '-c', "import sys; sys.path.insert(0, '../'); " + statement])
+
+    def test_package_import_is_lazy(self):
+        out = self.run_isolated("import gtfs_tripify; print('pandas' in sys.modules)")
+        assert out.strip() == b'False'
+
+    def test_decode_does_not_import_pandas(self):
+        out = self.run_isolated("from gtfs_tripify.decode import parse_feed, dictify; "
+                                "dictify(parse_feed('./fixtures/gtfs-20160512T0400Z')); "
+                                "print('pandas' in sys.modules)")
+        assert out.strip() == b'False'
+
+    def test_public_api(self):
+        assert callable(gt.tripify)
+        assert callable(gt.logify)
+        assert callable(gt.io.stream_to_sql)
+        assert callable(gt.utils.cut_cancellations)
+
+    def test_tripify_not_shadowed(self):
+        import gtfs_tripify.tripify  # noqa: F401
+        assert callable(gt.tripify)
+        assert gt.tripify.__name__ == 'tripify'
+
+
+class TestParseFeed(unittest.TestCase):
+    def test_parse_feed(self):
+        feed = gt.parse_feed("./fixtures/gtfs-20160512T0400Z")
+        assert feed.header.timestamp == 1463025455
+
+    def test_parse_bad_feed(self):
+        from gtfs_tripify.decode import parse_feed_bytes
+        assert parse_feed_bytes(b'\xff\xff\xff\xff') is None
+
+
+class TestDeduplication(unittest.TestCase):
+    """
+    Tests the ingest-stage feed deduplicator.
+    """
+    def setUp(self):
+        contents = []
+        for name in ['gtfs-20160512T0400Z', 'gtfs-20160512T0401Z']:
+            with open("./fixtures/" + name, "rb") as f:
+                contents.append(f.read())
+        self.first, self.second = contents
+
+    def test_no_op(self):
+        feeds, report = gt.decode.deduplicate_feeds([self.first, self.second])
+        assert [feed['header']['timestamp'] for feed in feeds] == [1463025455, 1463025494]
+        assert report == {'duplicates': 0, 'bad': 0, 'reordered': 0}
+
+    def test_duplicate_content(self):
+        """
+        Exact duplicates should be dropped without being decoded.
+        """
+        from unittest import mock
+
+        with mock.patch('gtfs_tripify.decode.decode_content', wraps=gt.decode.decode_content) as decode:
+            feeds, report = gt.decode.deduplicate_feeds([self.first, self.first, self.second])
+            assert decode.call_count == 2
+
+        assert len(feeds) == 2
+        assert report['duplicates'] == 1
+
+    def test_duplicate_timestamp(self):
+        """
+        Feeds which differ at the byte level but share a header timestamp are duplicates as well.
+        """
+        deduplicator = gt.decode.FeedDeduplicator()
+        feed = gt.decode.decode_content(self.first)
+        feeds = deduplicator.deduplicate([feed, dict(feed, entity=[])])
+
+        assert len(feeds) == 1
+        assert deduplicator.report()['duplicates'] == 1
+
+    def test_horizon(self):
+        """
+        Feeds more than `horizon` seconds older than the latest feed should be forgotten.
+        """
+        deduplicator = gt.decode.FeedDeduplicator(horizon=10)
+        assert not deduplicator.is_duplicate_content(self.first)
+        feed = gt.decode.decode_content(self.first)
+        deduplicator.deduplicate([feed, dict(feed, header=dict(feed['header'], timestamp=1463025460))])
+        assert deduplicator.timestamps == {1463025455, 1463025460}
+
+        assert not deduplicator.is_duplicate_content(self.second)
+        assert deduplicator.deduplicate([gt.decode.decode_content(self.second)])
+        assert deduplicator.timestamps == {1463025494}
+        assert list(deduplicator.hashes.values()) == [1463025494]
+
+        # A duplicate of a feed which has been forgotten is no longer caught.
+        assert deduplicator.deduplicate([feed]) == [feed]
+        assert deduplicator.timestamps == {1463025494}
+
+    def test_out_of_order(self):
+        feeds, report = gt.decode.deduplicate_feeds([self.second, self.first, b'\xff\xff\xff\xff'])
+        assert [feed['header']['timestamp'] for feed in feeds] == [1463025455, 1463025494]
+        assert report == {'duplicates': 0, 'bad': 1, 'reordered': 1}
+
+
+class TestWireDecoder(unittest.TestCase):
+    """
+    Tests the wire-format decoder against the `gtfs_realtime_pb2` decoding path.
+    """
+    def normalize(self, obj):
+        # NaN does not compare equal to itself, so it is swapped out for None.
+        if isinstance(obj, dict):
+            return {k: self.normalize(v) for k, v in obj.items()}
+        elif isinstance(obj, list):
+            return [self.normalize(v) for v in obj]
+        elif isinstance(obj, float) and obj != obj:
+            return None
+        return obj
+
+    def test_matches_dictify(self):
+        from gtfs_tripify import wire
+
+        for name in ['gtfs-20160512T0400Z', 'gtfs-20160512T0401Z']:
+            with open("./fixtures/" + name, "rb") as f:
+                content = f.read()
+
+            expected = self.normalize(gt.decode.decode_content(content))
+            result = self.normalize(wire.dictify_content(content))
+            assert result == expected
+
+    def test_columns(self):
+        from gtfs_tripify import wire
+
+        with open("./fixtures/gtfs-20160512T0400Z", "rb") as f:
+            columns = wire.decode(f.read())
+
+        assert columns['header']['timestamp'] == 1463025455
+        assert len(columns['trip_updates']['trip_id']) == 94
+        assert len(columns['vehicle_updates']['trip_id']) == 68
+        assert len(columns['alerts']['id']) == 1
+        assert columns['trip_updates']['stop_time_update_offset'][-1] == len(columns['stop_time_updates']['stop_id'])
+        assert columns['stop_time_updates']['arrival'].typecode == 'd'
+
+    def test_bad_feed(self):
+        from gtfs_tripify import wire
+        assert wire.dictify_content(b'\xff\xff\xff\xff') is None
+
+    def test_truncated_feed(self):
+        """
+        A length prefix pointing past the end of the feed should be rejected, not read as a shorter field.
+        """
+        from gtfs_tripify import wire
+
+        # A header holding a version string which claims to be ten bytes long, but is only three.
+        content = b'\x0a\x05\x0a\x0a1.0'
+        assert gt.decode.decode_content(content) is None
+        assert wire.dictify_content(content) is None
+        with self.assertRaises(ValueError):
+            wire.read_header(content)
+
+    def test_unknown_status(self):
+        """
+        A vehicle status outside of the enum should be ignored, keeping the last known status, as it is by the
+        `gtfs_realtime_pb2` bindings, rather than failing the feed.
+        """
+        from google.transit import gtfs_realtime_pb2
+        from gtfs_tripify import wire
+
+        def varint(n):
+            out = b''
+            while n > 0x7f:
+                out, n = out + bytes([n & 0x7f | 0x80]), n >> 7
+            return out + bytes([n])
+
+        def field(number, payload):
+            return varint(number << 3 | 2) + varint(len(payload)) + payload
+
+        header = gtfs_realtime_pb2.FeedHeader(gtfs_realtime_version='1.0', timestamp=1463025455)
+        trip_update = gtfs_realtime_pb2.TripUpdate()
+        trip_update.trip.trip_id, trip_update.trip.route_id = '000100_1..N', '1'
+        stop_time_update = trip_update.stop_time_update.add(stop_id='101N')
+        stop_time_update.arrival.time = 1463025500
+        vehicle = gtfs_realtime_pb2.VehiclePosition(stop_id='101N')
+        vehicle.trip.trip_id, vehicle.trip.route_id = '000100_1..N', '1'
+
+        for statuses, expected in [([7], 'IN_TRANSIT_TO'), ([200], 'IN_TRANSIT_TO'), ([1, 200], 'STOPPED_AT')]:
+            content = (field(1, header.SerializeToString()) +
+                       field(2, field(1, b'1') + field(3, trip_update.SerializeToString())) +
+                       field(2, field(1, b'2') + field(4, vehicle.SerializeToString() +
+                                                       b''.join(b'\x20' + varint(s) for s in statuses))))
+            expected_feed = gt.decode.decode_content(content)
+            result = wire.dictify_content(content)
+            assert expected_feed['entity'][1]['vehicle']['current_status'] == expected
+            assert self.normalize(result) == self.normalize(expected_feed)
+
+
+class TestRouteFilter(unittest.TestCase):
+    """
+    Tests filtering trips while decoding.
+    """
+    def setUp(self):
+        self.contents = []
+        for name in ['gtfs-20160512T0400Z', 'gtfs-20160512T0401Z']:
+            with open("./fixtures/" + name, "rb") as f:
+                self.contents.append(f.read())
+
+    def test_routes(self):
+        feed = gt.decode.decode_content(self.contents[0], routes=['1'])
+        trip_updates = [m for m in feed['entity'] if m['type'] == 'trip_update']
+        vehicle_updates = [m for m in feed['entity'] if m['type'] == 'vehicle_update']
+
+        assert len(trip_updates) > 0
+        assert {m['trip_update']['trip']['route_id'] for m in trip_updates} == {'1'}
+        assert ({m['vehicle']['trip']['trip_id'] for m in vehicle_updates} <=
+                {m['trip_update']['trip']['trip_id'] for m in trip_updates})
+
+    def test_trip_filter(self):
+        feed = gt.decode.decode_content(self.contents[0], trip_filter=lambda trip_id, route_id: route_id == '1')
+        expected = gt.decode.decode_content(self.contents[0], routes=['1'])
+        assert len(feed['entity']) == len(expected['entity'])
+
+    def test_logbook(self):
+        """
+        The trip logs of the trips that are kept should be the same as they are without filtering.
+        """
+        import pandas as pd
+
+        full = gt.logify([gt.decode.decode_content(content) for content in self.contents])
+        filtered = gt.logify([gt.decode.decode_content(content, routes=['1']) for content in self.contents])
+
+        assert set(filtered.keys()) == {key for key, log in full.items() if log['route_id'].iloc[0] == '1'}
+        for key in filtered:
+            pd.testing.assert_frame_equal(filtered[key], full[key])
+
+    def test_wire_decoder(self):
+        from gtfs_tripify import wire
+
+        for content in self.contents:
+            expected = gt.decode.decode_content(content, routes=['1', 'L'])
+            result = wire.dictify_content(content, routes=['1', 'L'])
+            assert [m['id'] for m in result['entity']] == [m['id'] for m in expected['entity']]
@@ -4,7 +4,13 @@
 import unittest
 import pandas as pd
 import sqlite3
+import multiprocessing
+import os
+import shutil
+import tempfile
+import pytest
 import gtfs_tripify as gt
+from gtfs_tripify.columnar import ColumnarLogbook
 
 
 class TestLogbookToSQL(unittest.TestCase):
@@ -112,6 +118,27 @@ class TestLogbookToSQL(unittest.TestCase):
         c.close()
         conn.close()
 
+    def testOpenTransaction(self):
+        """
+        Writing to a connection with a transaction open should fail, rather than commit the caller's changes.
+        """
+        conn = sqlite3.connect(":memory:")
+        gt.io.logbook_to_sql({}, conn)
+        conn.execute("CREATE TABLE Other (x INTEGER);")
+        conn.execute("INSERT INTO Other VALUES (1);")
+
+        log = pd.DataFrame(columns=self.log_columns, data=[['same_trip_id', '_', '_', '_', '_', '_', '_']])
+        feed = {'header': {'timestamp': 0}, 'entity': []}
+        with self.assertRaises(ValueError):
+            gt.io.logbook_to_sql({'same_trip_id_0': log}, conn)
+        with self.assertRaises(ValueError):
+            gt.io.upsert_logbook_to_sql({'same_trip_id_0': log}, conn, feed, feed)
+
+        conn.rollback()
+        assert conn.execute("SELECT COUNT(*) FROM Other").fetchone() == (0,)
+        assert conn.execute("SELECT COUNT(*) FROM Logbooks").fetchone() == (0,)
+        conn.close()
+
 
 class TestStreamToSQL(unittest.TestCase):
     """
@@ -161,3 +188,280 @@ class TestStreamToSQL(unittest.TestCase):
 
         c.close()
         conn.close()
+
+
+class TestUpsertLogbookToSQL(unittest.TestCase):
+    """
+    Tests the chunk-merging SQL writer utility.
+    """
+    def setUp(self):
+        self.stream = ["./fixtures/gtfs-20160512T0400Z", "./fixtures/gtfs-20160512T0401Z"]
+        self.feeds = [gt.dictify(gt.io.parse_feed(filepath)) for filepath in self.stream]
+        self.conn = sqlite3.connect(":memory:")
+
+    def tearDown(self):
+        self.conn.close()
+
+    def testSpanningTripsAreJoined(self):
+        """
+        Trips spanning two chunks are written as a single trip, the same one `merge_logbooks` produces.
+        """
+        gt.io.stream_to_sql(self.stream[:1], self.conn, upsert=True)
+        gt.io.stream_to_sql(self.stream[1:], self.conn, upsert=True)
+
+        c = self.conn.cursor()
+        assert c.execute("SELECT COUNT(DISTINCT unique_trip_id) FROM Logbooks").fetchone() == (94,)
+        assert c.execute("SELECT COUNT(*) FROM OpenTrips").fetchone() == (94,)
+
+        expected = gt.merge_logbooks([gt.logify(self.feeds[:1]), gt.logify(self.feeds[1:])])
+        result = pd.read_sql("SELECT * FROM Logbooks WHERE unique_trip_id = '000650_1..S02R_0'", self.conn)
+        assert list(result['stop_id']) == list(expected['000650_1..S02R_0']['stop_id'].astype(str))
+        assert list(result['minimum_time']) == list(expected['000650_1..S02R_0']['minimum_time'])
+        c.close()
+
+    def testAbsentTripsAreFinished(self):
+        """
+        Open trips which are absent from the first feed of the next chunk are finished as of that feed.
+        """
+        first, second = self.feeds
+        second = {'header': second['header'],
+                  'entity': [m for m in second['entity'] if m.get('trip_update', m.get('vehicle', {}))
+                             .get('trip', {}).get('trip_id') != '000650_1..S02R']}
+
+        gt.io.upsert_logbook_to_sql(gt.logify([first]), self.conn, first, first)
+        gt.io.upsert_logbook_to_sql(gt.logify([second]), self.conn, second, second)
+
+        c = self.conn.cursor()
+        actions = {r[0] for r in c.execute("SELECT action FROM Logbooks WHERE unique_trip_id = '000650_1..S02R_0'")}
+        assert actions <= {'STOPPED_AT', 'STOPPED_OR_SKIPPED'}
+        assert c.execute("SELECT COUNT(*) FROM Logbooks WHERE unique_trip_id = '000650_1..S02R_0' "
+                         "AND maximum_time IS NULL").fetchone() == (0,)
+        assert c.execute("SELECT COUNT(*) FROM OpenTrips").fetchone() == (93,)
+        c.close()
+
+    def testReusedTripIdsGetNewKeys(self):
+        """
+        A trip which reuses the trip id of a trip that has already finished is written under a new key.
+        """
+        first, second = self.feeds
+        gt.io.upsert_logbook_to_sql(gt.logify([first]), self.conn, first, first)
+        gt.io.upsert_logbook_to_sql({}, self.conn, second, second)
+        gt.io.upsert_logbook_to_sql(gt.logify([first]), self.conn, first, first)
+
+        c = self.conn.cursor()
+        assert c.execute("SELECT COUNT(DISTINCT unique_trip_id) FROM Logbooks").fetchone() == (188,)
+        assert c.execute("SELECT COUNT(*) FROM Logbooks WHERE unique_trip_id = '000650_1..S02R_1'").fetchone()[0] > 0
+        c.close()
+
+
+class TestSQLToLogbook(unittest.TestCase):
+    """
+    Tests the logbook SQL reader utility.
+    """
+    def setUp(self):
+        self.stream = ["./fixtures/gtfs-20160512T0400Z", "./fixtures/gtfs-20160512T0401Z"]
+        self.conn = sqlite3.connect(":memory:")
+        gt.io.stream_to_sql(self.stream, self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def testRoundTrip(self):
+        """
+        Reading a logbook back returns the trip logs that were written, with the same types.
+        """
+        feeds = [gt.dictify(gt.io.parse_feed(filepath)) for filepath in self.stream]
+        expected = gt.logify(feeds)
+        result = gt.io.sql_to_logbook(self.conn)
+
+        assert set(result.keys()) == set(expected.keys())
+        assert result.n_rows == 2079
+
+        for key in expected:
+            left, right = expected[key], result[key]
+            assert list(right.columns) == list(left.columns)
+            assert list(right['stop_id']) == list(left['stop_id'])
+            assert list(right['action']) == list(left['action'])
+            assert right['latest_information_time'].dtype == 'int64'
+            assert right['minimum_time'].fillna(-1).tolist() == left['minimum_time'].fillna(-1).tolist()
+
+    def testFilters(self):
+        assert len(gt.io.sql_to_logbook(self.conn, routes=['1'])) == 17
+        assert all(set(log['route_id']) == {'1'} for log in gt.io.sql_to_logbook(self.conn, routes=['1']).values())
+        assert len(gt.io.sql_to_logbook(self.conn, end=1463025455)) == 0
+        assert len(gt.io.sql_to_logbook(self.conn, start=1463025494)) == 94
+        assert len(gt.io.sql_to_logbook(self.conn, routes=['1'], end=1463025456)) < 17
+
+    def testChunking(self):
+        """
+        Reading in small chunks returns the same result as reading in one chunk.
+        """
+        left = gt.io.sql_to_logbook(self.conn, chunk_size=7).to_frame()
+        right = gt.io.sql_to_logbook(self.conn).to_frame()
+        assert left.fillna(-1).equals(right.fillna(-1))
+
+    def testEmpty(self):
+        conn = sqlite3.connect(":memory:")
+        gt.io.logbook_to_sql({}, conn)
+        result = gt.io.sql_to_logbook(conn)
+        assert len(result) == 0 and result.n_rows == 0
+        conn.close()
+
+
+class TestSchemaV2(unittest.TestCase):
+    """
+    Tests the normalized (v2) SQL schema.
+    """
+    def setUp(self):
+        self.stream = ["./fixtures/gtfs-20160512T0400Z", "./fixtures/gtfs-20160512T0401Z"]
+        self.v1 = sqlite3.connect(":memory:")
+        gt.io.stream_to_sql(self.stream, self.v1)
+        self.expected = gt.io.sql_to_logbook(self.v1).to_frame().fillna(-1)
+
+    def tearDown(self):
+        self.v1.close()
+
+    def read(self, conn, **kwargs):
+        return (gt.io.sql_to_logbook(conn, **kwargs).to_frame().sort_values('unique_trip_id', kind='stable')
+                .reset_index(drop=True).fillna(-1))
+
+    def testRoundTrip(self):
+        conn = sqlite3.connect(":memory:")
+        gt.io.logbook_to_sql(gt.io.sql_to_logbook(self.v1), conn, schema=2)
+
+        assert self.read(conn).equals(self.expected)
+        assert conn.execute("SELECT COUNT(*) FROM Events").fetchone() == (2079,)
+        assert conn.execute("SELECT typeof(latest_information_time) FROM Events LIMIT 1").fetchone() == ('integer',)
+        conn.close()
+
+    def testKeyCollisions(self):
+        conn = sqlite3.connect(":memory:")
+        logbook = gt.io.sql_to_logbook(self.v1)
+        gt.io.logbook_to_sql(logbook, conn, schema=2)
+        gt.io.logbook_to_sql(logbook, conn, schema=2)
+        assert conn.execute("SELECT COUNT(DISTINCT unique_trip_id) FROM Trips").fetchone() == (188,)
+        assert conn.execute("SELECT COUNT(*) FROM Routes").fetchone()[0] < 20
+        conn.close()
+
+    def testMigration(self):
+        gt.io.migrate_to_v2(self.v1, chunk_size=100)
+        assert self.read(self.v1).equals(self.expected)
+
+        conn = sqlite3.connect(":memory:")
+        gt.io.stream_to_sql(self.stream, conn)
+        gt.io.migrate_to_v2(conn, drop=True)
+        tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        assert 'Logbooks' not in tables
+        assert self.read(conn).equals(self.expected)
+        conn.close()
+
+    def testStreamDetectsSchema(self):
+        gt.io.migrate_to_v2(self.v1, drop=True)
+        gt.io.stream_to_sql(self.stream, self.v1)
+        tables = {r[0] for r in self.v1.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        assert 'Logbooks' not in tables
+        assert self.v1.execute("SELECT COUNT(DISTINCT unique_trip_id) FROM Trips").fetchone() == (188,)
+
+    def testUpsert(self):
+        """
+        Upserting into the v2 schema gives the same logbook as upserting into the v1 schema.
+        """
+        v1, v2 = sqlite3.connect(":memory:"), sqlite3.connect(":memory:")
+        for filepath in self.stream:
+            gt.io.stream_to_sql([filepath], v1, upsert=True)
+            gt.io.stream_to_sql([filepath], v2, upsert=True, schema=2)
+        gt.io.stream_to_sql(self.stream[1:], v2, upsert=True)
+
+        assert v2.execute("SELECT COUNT(DISTINCT unique_trip_id) FROM Trips").fetchone() == (94,)
+        assert v2.execute("SELECT COUNT(*) FROM OpenTrips").fetchone() == (94,)
+        gt.io.stream_to_sql(self.stream[1:], v1, upsert=True)
+        assert self.read(v2).equals(self.read(v1))
+        v1.close()
+        v2.close()
+
+    def testFilters(self):
+        gt.io.migrate_to_v2(self.v1, drop=True)
+        assert len(gt.io.sql_to_logbook(self.v1, routes=['1'])) == 17
+        assert len(gt.io.sql_to_logbook(self.v1, end=1463025455)) == 0
+        assert len(gt.io.sql_to_logbook(self.v1, start=1463025494)) == 94
+        assert len(gt.io.sql_to_logbook(self.v1, routes=['1'], end=1463025456)) < 17
+
+
+class TestColumnarLogbook(unittest.TestCase):
+    def testFromLogbook(self):
+        feeds = [gt.dictify(gt.io.parse_feed("./fixtures/gtfs-20160512T0400Z"))]
+        logbook = gt.logify(feeds)
+        result = ColumnarLogbook.from_logbook(logbook)
+
+        assert len(result) == len(logbook)
+        assert result.n_rows == sum(len(log) for log in logbook.values())
+        key = next(iter(logbook))
+        assert key in result
+        assert list(result[key]['stop_id']) == list(logbook[key]['stop_id'])
+        assert len(result.to_frame()) == result.n_rows
+
+
+def _write_stream(writer, filepath):
+    gt.io.stream_to_sql([filepath], writer)
+
+
+class TestSQLWriter(unittest.TestCase):
+    """
+    Tests the single-writer SQL service.
+    """
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.db = os.path.join(self.tmp, 'out.db')
+        self.stream = ["./fixtures/gtfs-20160512T0400Z", "./fixtures/gtfs-20160512T0401Z"]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def testConcurrentWriters(self):
+        """
+        Logbooks sent from several processes at once are all written, and no two trips share a key.
+        """
+        with gt.io.SQLWriter(self.db, batch_rows=10) as writer:
+            workers = [multiprocessing.Process(target=_write_stream, args=(writer, filepath))
+                       for filepath in self.stream * 2]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+
+        conn = sqlite3.connect(self.db)
+        n_rows = conn.execute("SELECT COUNT(*) FROM Logbooks").fetchone()[0]
+        n_trips = conn.execute("SELECT COUNT(DISTINCT unique_trip_id) FROM Logbooks").fetchone()[0]
+        per_trip = conn.execute("SELECT MAX(n) FROM (SELECT COUNT(DISTINCT trip_id) AS n FROM Logbooks "
+                                "GROUP BY unique_trip_id)").fetchone()[0]
+        journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        conn.close()
+
+        single = sqlite3.connect(":memory:")
+        for filepath in self.stream:
+            gt.io.stream_to_sql([filepath], single)
+        expected_rows = single.execute("SELECT COUNT(*) FROM Logbooks").fetchone()[0]
+        single.close()
+
+        assert n_rows == 2 * expected_rows
+        assert n_trips == 4 * 94
+        assert per_trip == 1
+        assert journal_mode == 'wal'
+
+    def testWriterFailure(self):
+        """
+        If the writer process dies, the exception it died with should be raised, rather than sends hanging on a queue
+        which is never read.
+        """
+        logbook = gt.logify([gt.dictify(gt.io.parse_feed(filepath)) for filepath in self.stream])
+        writer = gt.io.SQLWriter(os.path.join(self.tmp, 'missing', 'out.db'), maxsize=1).start()
+        with pytest.raises(sqlite3.OperationalError):
+            for _ in range(4):
+                writer.put(logbook)
+            writer.close()
+        writer.close()
+
+    def testUpsertIsRejected(self):
+        writer = gt.io.SQLWriter(self.db)
+        with pytest.raises(ValueError):
+            gt.io.stream_to_sql(self.stream, writer, upsert=True)
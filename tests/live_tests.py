@@ -0,0 +1,294 @@
+"""
+`gtfs-tripify` live processing test module. Asserts that incremental tripification and feed polling are correct.
+"""
+import unittest
+import asyncio
+import copy
+import gc
+import os
+import shutil
+import tempfile
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from google.transit import gtfs_realtime_pb2
+
+import pandas as pd
+
+import sys; sys.path.append("../")
+import gtfs_tripify as gt
+from gtfs_tripify.incremental import IncrementalLogifier
+from gtfs_tripify.spill import SpillStore
+from gtfs_tripify.live import iter_feeds, poll
+
+
+def load_fixture(name):
+    with open("./fixtures/" + name, "rb") as f:
+        return f.read()
+
+
+def empty_feed_content(timestamp):
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.gtfs_realtime_version = '1.0'
+    feed.header.timestamp = timestamp
+    return feed.SerializeToString()
+
+
+class FeedServer:
+    """
+    A local stand-in for a GTFS-Realtime endpoint. Serves the given payloads in order, one per request, and then
+    keeps serving the last one.
+    """
+    def __init__(self, payloads):
+        payloads = list(payloads)
+        self.requests = 0
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(handler):
+                body = payloads[min(self.requests, len(payloads) - 1)]
+                self.requests += 1
+                handler.send_response(200)
+                handler.send_header('Content-Length', str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, *args):
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{0}/feed'.format(self.server.server_address[1])
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestIncrementalLogifier(unittest.TestCase):
+    def setUp(self):
+        self.feeds = [gt.dictify(gt.decode.parse_feed_bytes(load_fixture(name)))
+                      for name in ['gtfs-20160512T0400Z', 'gtfs-20160512T0401Z']]
+
+    def test_matches_logify(self):
+        """
+        Pushing feeds through the engine and taking a snapshot should be equivalent to calling `logify`.
+        """
+        expected = gt.logify(self.feeds)
+
+        logifier = IncrementalLogifier()
+        finished = {}
+        for feed in self.feeds:
+            finished.update(logifier.push(feed))
+        result = dict(finished, **logifier.snapshot())
+
+        assert set(result.keys()) == set(expected.keys())
+        for key in expected:
+            pd.testing.assert_frame_equal(result[key].reset_index(drop=True), expected[key].reset_index(drop=True))
+
+    def test_termination(self):
+        """
+        Trips which disappear from the feed should be finished and emitted.
+        """
+        end = gt.dictify(gt.decode.parse_feed_bytes(empty_feed_content(1463025500)))
+        expected = gt.logify(self.feeds + [end])
+
+        logifier = IncrementalLogifier()
+        finished = {}
+        for feed in self.feeds + [end]:
+            finished.update(logifier.push(feed))
+
+        assert len(logifier) == 0
+        assert set(finished.keys()) == set(expected.keys())
+        for key in expected:
+            pd.testing.assert_frame_equal(finished[key].reset_index(drop=True),
+                                          expected[key].reset_index(drop=True))
+
+    def test_resume_from_state(self):
+        """
+        Saving the engine's state part of the way through a stream and resuming a new engine from it should produce
+        the same trip logs as pushing the whole stream through a single engine.
+        """
+        end = gt.dictify(gt.decode.parse_feed_bytes(empty_feed_content(1463025500)))
+        expected = gt.logify(self.feeds + [end])
+
+        first = IncrementalLogifier()
+        finished = first.push(self.feeds[0])
+
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, 'state.json')
+            first.save(path)
+            second = IncrementalLogifier.load(path)
+        finally:
+            shutil.rmtree(tmp)
+
+        assert second.active_trips == first.active_trips
+        for feed in self.feeds[1:] + [end]:
+            finished.update(second.push(feed))
+
+        assert set(finished.keys()) == set(expected.keys())
+        for key in expected:
+            pd.testing.assert_frame_equal(finished[key].reset_index(drop=True),
+                                          expected[key].reset_index(drop=True))
+
+    def test_state_requires_lean(self):
+        with self.assertRaises(ValueError):
+            IncrementalLogifier(lean=False).state()
+
+    def test_spill(self):
+        """
+        An engine spilling trips to disk to stay within its memory budget should produce the same trip logs, both
+        finished and in progress, as one which does not.
+        """
+        # Repeat the second feed a few times over, to give the trips some history to spill.
+        repeats = []
+        for i in range(1, 4):
+            feed = copy.deepcopy(self.feeds[1])
+            feed['header']['timestamp'] += 30 * i
+            repeats.append(feed)
+        end = gt.dictify(gt.decode.parse_feed_bytes(empty_feed_content(1463025600)))
+        feeds = self.feeds + repeats
+        expected = gt.logify(feeds + [end])
+
+        tmp = tempfile.mkdtemp()
+        try:
+            logifier = IncrementalLogifier(max_records=100, spill_path=tmp)
+            finished = {}
+            for feed in feeds:
+                finished.update(logifier.push(feed))
+                assert logifier.metrics['records_in_memory'] <= 100
+
+            metrics = logifier.metrics
+            assert metrics['spills'] > 0 and metrics['spilled_records'] > 0 and metrics['spilled_bytes'] > 0
+            assert metrics['paged_records'] == 0
+            snapshot = logifier.snapshot()
+            for key, trip_log in IncrementalLogifier.from_state(logifier.state()).snapshot().items():
+                pd.testing.assert_frame_equal(trip_log, snapshot[key])
+
+            finished.update(logifier.push(end))
+            metrics = logifier.metrics
+            assert metrics['paged_records'] == metrics['spilled_records']
+            assert metrics['segments'] == 0 and metrics['bytes_on_disk'] == 0
+            assert os.listdir(tmp) == []
+
+            assert set(finished.keys()) == set(expected.keys())
+            for key in expected:
+                pd.testing.assert_frame_equal(finished[key].reset_index(drop=True),
+                                              expected[key].reset_index(drop=True))
+            logifier.close()
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_spill_cleanup(self):
+        """
+        A temporary spill directory should be removed on leaving a `with` block, or once its store is garbage
+        collected if it was never closed.
+        """
+        with IncrementalLogifier(max_records=10) as logifier:
+            for feed in self.feeds:
+                logifier.push(feed)
+            path = logifier._spill.path
+            assert os.listdir(path)
+        assert not os.path.exists(path)
+
+        store = SpillStore()
+        store.write({'trip_0': [(None, ('101N',))]})
+        path = store.path
+        del store
+        gc.collect()
+        assert not os.path.exists(path)
+
+    def test_spill_requires_lean(self):
+        with self.assertRaises(ValueError):
+            IncrementalLogifier(lean=False, max_records=100)
+
+    def test_ttl(self):
+        """
+        With a TTL set, trips missing from a feed for less than it should carry on as though the feed never happened,
+        and trips missing for longer should be finished as of the first feed they were missing from.
+        """
+        later = copy.deepcopy(self.feeds[1])
+        later['header']['timestamp'] += 60
+        glitch = gt.dictify(gt.decode.parse_feed_bytes(empty_feed_content(1463025520)))
+        ends = [gt.dictify(gt.decode.parse_feed_bytes(empty_feed_content(timestamp)))
+                for timestamp in [1463025600, 1463025630, 1463025660]]
+        expected = gt.logify(self.feeds + [later, ends[0]])
+
+        for kwargs in [{'ttl_feeds': 2}, {'ttl_seconds': 50}, {'ttl_feeds': 3, 'ttl_seconds': 50}]:
+            logifier = IncrementalLogifier(**kwargs)
+            finished = {}
+            for feed in self.feeds + [glitch]:
+                finished.update(logifier.push(feed))
+            assert finished == {}
+            assert logifier.metrics['absent_trips'] == len(logifier) == len(expected)
+
+            for feed in [later] + ends:
+                finished.update(logifier.push(feed))
+            assert len(logifier) == 0
+            assert logifier.metrics['tracked_trip_ids'] == 0
+
+            assert set(finished.keys()) == set(expected.keys())
+            for key in expected:
+                pd.testing.assert_frame_equal(finished[key].reset_index(drop=True),
+                                              expected[key].reset_index(drop=True))
+
+    def test_ttl_resume_from_state(self):
+        """
+        Trips missing from the feed as of the saved state should still be finished as of the first feed they were
+        missing from.
+        """
+        glitch = gt.dictify(gt.decode.parse_feed_bytes(empty_feed_content(1463025520)))
+        expected = gt.logify(self.feeds + [glitch])
+
+        logifier = IncrementalLogifier(ttl_feeds=2)
+        for feed in self.feeds + [glitch]:
+            logifier.push(feed)
+        resumed = IncrementalLogifier.from_state(logifier.state(), ttl_feeds=2)
+        assert resumed.metrics['absent_trips'] == len(resumed) == len(expected)
+
+        finished = resumed.push(gt.dictify(gt.decode.parse_feed_bytes(empty_feed_content(1463025600))))
+        assert len(resumed) == 0
+        assert set(finished.keys()) == set(expected.keys())
+        for key in expected:
+            pd.testing.assert_frame_equal(finished[key].reset_index(drop=True),
+                                          expected[key].reset_index(drop=True))
+
+
+class TestPoller(unittest.TestCase):
+    def test_iter_feeds_deduplicates(self):
+        """
+        Feeds with a header timestamp that has already been seen should not be yielded again.
+        """
+        payloads = [load_fixture('gtfs-20160512T0400Z')] * 2 + [load_fixture('gtfs-20160512T0401Z')]
+
+        async def collect(url):
+            feeds = []
+            async for feed in iter_feeds(url, interval=0.01, timeout=5):
+                feeds.append(feed)
+                if len(feeds) == 2:
+                    break
+            return feeds
+
+        with FeedServer(payloads) as server:
+            feeds = asyncio.run(collect(server.url))
+
+        assert [feed['header']['timestamp'] for feed in feeds] == [1463025455, 1463025494]
+        assert server.requests == 3
+
+    def test_poll_emits_finished_trips(self):
+        payloads = [load_fixture('gtfs-20160512T0400Z'), load_fixture('gtfs-20160512T0401Z'),
+                    empty_feed_content(1463025600)]
+
+        async def collect(url):
+            async for logbook in poll(url, interval=0.01, timeout=5):
+                return logbook
+
+        with FeedServer(payloads) as server:
+            logbook = asyncio.run(collect(server.url))
+
+        assert len(logbook) == 94
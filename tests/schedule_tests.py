@@ -0,0 +1,216 @@
+"""
+Schedule test module. Asserts that static GTFS schedules are read, persisted, matched to trips, and joined against
+logbooks correctly.
+"""
+import unittest
+import os
+import shutil
+import tempfile
+import zipfile
+
+import numpy as np
+import pandas as pd
+from google.transit import gtfs_realtime_pb2
+
+import sys; sys.path.append("../")
+import gtfs_tripify as gt
+from gtfs_tripify.analytics import estimate_times
+from gtfs_tripify.schedule import Schedule, load_schedule, adherence
+
+
+def write_gtfs(path, trips, stop_times, calendar=None, calendar_dates=None, stops=None, agency=None):
+    os.makedirs(path, exist_ok=True)
+    tables = {'trips.txt': trips, 'stop_times.txt': stop_times, 'calendar.txt': calendar,
+              'calendar_dates.txt': calendar_dates, 'stops.txt': stops, 'agency.txt': agency}
+    for name, table in tables.items():
+        if table is not None:
+            pd.DataFrame(table).to_csv(os.path.join(path, name), index=False)
+
+
+def hms(seconds):
+    seconds = int(seconds)
+    return '{0:02d}:{1:02d}:{2:02d}'.format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+class TestSchedule(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.gtfs = os.path.join(self.tmpdir, 'gtfs')
+        weekday = {'service_id': ['WKD'], 'monday': ['1'], 'tuesday': ['1'], 'wednesday': ['1'], 'thursday': ['1'],
+                   'friday': ['1'], 'saturday': ['0'], 'sunday': ['0'], 'start_date': ['20160101'],
+                   'end_date': ['20161231']}
+        write_gtfs(
+            self.gtfs,
+            trips={'route_id': ['1', '1'], 'service_id': ['WKD', 'SUN'],
+                   'trip_id': ['A20160101WKD_000100_1..N', 'A20160101SUN_000100_1..N']},
+            stop_times={'trip_id': ['A20160101WKD_000100_1..N'] * 3 + ['A20160101SUN_000100_1..N'] * 2,
+                        'arrival_time': ['', '08:01:00', '24:02:30', '', '09:01:00'],
+                        'departure_time': ['08:00:00', '08:01:30', '', '09:00:00', ''],
+                        'stop_id': ['103N', '101N', '102N', '101N', '103N'],
+                        'stop_sequence': ['3', '1', '2', '1', '2']},
+            calendar=weekday,
+            calendar_dates={'service_id': ['SUN', 'WKD'], 'date': ['20160530', '20160530'],
+                            'exception_type': ['1', '2']},
+            stops={'stop_id': ['101N', '102N', '103N'], 'stop_name': ['A', 'B', 'C']},
+            agency={'agency_name': ['MTA'], 'agency_timezone': ['America/New_York']}
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_load_schedule(self):
+        schedule = load_schedule(self.gtfs)
+        assert len(schedule) == 2
+        assert schedule.timezone == 'America/New_York'
+        assert schedule.stop_name('102N') == 'B'
+        assert schedule.stop_name('999N') is None
+
+        # Stop times are sorted by stop sequence, and times past midnight are kept.
+        assert schedule.columns['stop_id'].tolist() == ['101N', '102N', '103N', '101N', '103N']
+        assert schedule.columns['arrival'].tolist() == [8 * 3600 + 60, 24 * 3600 + 150, -1, -1, 9 * 3600 + 60]
+        assert schedule.columns['offset'].tolist() == [0, 3, 5]
+
+    def test_load_schedule_zip(self):
+        archive = os.path.join(self.tmpdir, 'gtfs.zip')
+        with zipfile.ZipFile(archive, 'w') as z:
+            for name in os.listdir(self.gtfs):
+                z.write(os.path.join(self.gtfs, name), name)
+        from_zip, from_dir = load_schedule(archive), load_schedule(self.gtfs)
+        for col in from_dir.columns:
+            assert from_zip.columns[col].tolist() == from_dir.columns[col].tolist()
+
+    def test_services(self):
+        schedule = load_schedule(self.gtfs)
+        assert schedule.services('20160512') == {'WKD'}
+        assert schedule.services(20160514) == set()
+        # Memorial Day: the weekday service is replaced by the Sunday service.
+        assert schedule.services('20160530') == {'SUN'}
+
+    def test_stop_order(self):
+        schedule = load_schedule(self.gtfs)
+        assert schedule.stop_order('A20160101WKD_000100_1..N') == ('101N', '102N', '103N')
+        assert schedule.stop_order('000100_1..N', date='20160512') == ('101N', '102N', '103N')
+        assert schedule.stop_order('000100_1..N', date='20160530') == ('101N', '103N')
+        assert schedule.stop_order('000200_1..N') is None
+
+    def test_service_dates(self):
+        schedule = load_schedule(self.gtfs)
+        # 23:57 on 2016-05-11 in New York, but 03:57 on 2016-05-12 in UTC.
+        assert schedule.service_dates(1463025455) == [20160511, 20160510]
+        assert schedule.service_dates(1463025455 + 3600) == [20160512, 20160511]
+
+    def test_blank_calendar_cells(self):
+        # Calendar rows with blank or malformed dates are dropped, rather than failing the load.
+        with open(os.path.join(self.gtfs, 'calendar.txt'), 'a') as f:
+            f.write('BAD,1,1,1,1,1,1,1,,20161231\nWORSE,1,1,1,1,1,1,1,2016-01-01,20161231\n')
+        with open(os.path.join(self.gtfs, 'calendar_dates.txt'), 'a') as f:
+            f.write('BAD,,1\n')
+        schedule = load_schedule(self.gtfs)
+        assert schedule.columns['calendar_service_id'].tolist() == ['WKD']
+        assert schedule.columns['exception_service_id'].tolist() == ['SUN', 'WKD']
+        assert schedule.services('20160512') == {'WKD'}
+
+    def test_save_load(self):
+        schedule = load_schedule(self.gtfs)
+        schedule.save(os.path.join(self.tmpdir, 'index'))
+        loaded = Schedule.load(os.path.join(self.tmpdir, 'index'))
+        assert isinstance(loaded.columns['stop_id'], np.memmap)
+        assert loaded.timezone == schedule.timezone
+        assert loaded.stop_order('000100_1..N', date='20160512') == ('101N', '102N', '103N')
+        assert loaded.services('20160530') == {'SUN'}
+
+    def test_scheduled_times(self):
+        times = load_schedule(self.gtfs).scheduled_times('20160512')
+        # Midnight on 2016-05-12 in New York, which is on daylight saving time.
+        midnight = 1463025600
+        assert times['trip_id'].tolist() == ['000100_1..N'] * 3
+        assert times['scheduled_arrival'].tolist()[:2] == [midnight + 8 * 3600 + 60, midnight + 24 * 3600 + 150]
+        assert np.isnan(times['scheduled_arrival'].iloc[2])
+        assert np.isnan(times['scheduled_departure'].iloc[1])
+
+
+class TestScheduleLogify(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.feeds = []
+        for name in ['gtfs-20160512T0400Z', 'gtfs-20160512T0401Z']:
+            with open('./fixtures/' + name, 'rb') as f:
+                feed = gtfs_realtime_pb2.FeedMessage()
+                feed.ParseFromString(f.read())
+            self.feeds.append(gt.dictify(feed))
+        self.logbook = gt.logify(self.feeds)
+        self.key = '000100_2..S08R_0'
+        self.stops = self.logbook[self.key]['stop_id'].tolist()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_schedule(self, stop_times, weekdays=True):
+        """
+        Writes a weekday (or, if `weekdays` is False, a weekend) schedule with the given `{trip_id: (stop_ids,
+        times)}` stop times, and loads it.
+        """
+        running, idle = ['1'], ['0']
+        if not weekdays:
+            running, idle = idle, running
+        trip_ids = ['A20160101WKD_' + trip_id for trip_id in stop_times]
+        rows = [(trip_id, stop_id, time, str(i)) for trip_id, (stop_ids, times) in zip(trip_ids, stop_times.values())
+                for i, (stop_id, time) in enumerate(zip(stop_ids, times))]
+        write_gtfs(
+            self.tmpdir,
+            trips={'route_id': [''] * len(trip_ids), 'service_id': ['WKD'] * len(trip_ids), 'trip_id': trip_ids},
+            stop_times={'trip_id': [row[0] for row in rows], 'stop_id': [row[1] for row in rows],
+                        'arrival_time': [row[2] for row in rows], 'departure_time': [row[2] for row in rows],
+                        'stop_sequence': [row[3] for row in rows]},
+            calendar={'service_id': ['WKD'], 'monday': running, 'tuesday': running, 'wednesday': running,
+                      'thursday': running, 'friday': running, 'saturday': idle, 'sunday': idle,
+                      'start_date': ['20160101'], 'end_date': ['20161231']},
+            agency={'agency_name': ['MTA'], 'agency_timezone': ['America/New_York']}
+        )
+        return load_schedule(self.tmpdir)
+
+    def test_logify_uses_schedule_order(self):
+        # Scheduled stops that the trip was never seen making are left out of its log.
+        stops = ['999S'] + self.stops[::-1]
+        schedule = self.write_schedule({'000100_2..S08R': (stops, [''] * len(stops))})
+        for logbook in [gt.logify(self.feeds, schedule=schedule),
+                        gt.logify(self.feeds, schedule=schedule, workers=2),
+                        gt.logify(self.feeds, schedule=schedule, lazy=True)]:
+            assert logbook[self.key]['stop_id'].tolist() == self.stops[::-1]
+            other = '000650_1..S02R_0'
+            assert logbook[other].equals(self.logbook[other])
+
+    def test_logify_uses_service_day(self):
+        # The trips in the feeds ran on a Wednesday, so a trip only scheduled on weekends does not match them.
+        stops = self.stops[::-1]
+        schedule = self.write_schedule({'000100_2..S08R': (stops, [''] * len(stops))}, weekdays=False)
+        logbook = gt.logify(self.feeds, schedule=schedule)
+        assert logbook[self.key].equals(self.logbook[self.key])
+
+    def test_logify_incomplete_schedule(self):
+        # The synthesized order is used if the trip made stops that are not in the schedule.
+        stops = self.stops[:0:-1]
+        schedule = self.write_schedule({'000100_2..S08R': (stops, [''] * len(stops))})
+        logbook = gt.logify(self.feeds, schedule=schedule)
+        assert logbook[self.key].equals(self.logbook[self.key])
+
+    def test_adherence(self):
+        # Schedule every stop that a train was seen passing through a minute before it was estimated to do so.
+        events = estimate_times(self.logbook).drop_duplicates(['unique_trip_id', 'stop_id'])
+        events = events.assign(trip_id=events['unique_trip_id'].astype(str).str.rsplit('_', n=1).str[0])
+        base = 1463025600 - 86400  # Midnight on 2016-05-11 in New York; these trips ran past midnight.
+        schedule = self.write_schedule({
+            trip_id: (group['stop_id'].astype(str).tolist(), [hms(t - base - 60) for t in group['estimated_time']])
+            for trip_id, group in events.groupby('trip_id')
+        })
+
+        result = adherence(self.logbook, schedule, '20160511')
+        assert len(events) > 0
+        assert len(result) == len(events)
+        assert set(result['unique_trip_id']) == set(events['unique_trip_id'])
+        assert np.allclose(result['delay'], 60, atol=1)
+
+        assert len(adherence(self.logbook, schedule, '20160514')) == 0
+
+if __name__ == '__main__':
+    unittest.main()
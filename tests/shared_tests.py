@@ -0,0 +1,65 @@
+"""
+Shared memory test module. Asserts that columns survive the round trip through shared memory intact.
+"""
+import unittest
+import multiprocessing
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import sys; sys.path.append("../")
+from gtfs_tripify import wire
+from gtfs_tripify.columnar import ColumnarLogbook
+from gtfs_tripify.shared import SharedColumns, SharedStrings
+import gtfs_tripify as gt
+
+
+def _double(descriptor):
+    with descriptor.attach(unlink=True) as columns:
+        values = np.asarray(columns['values']) * 2
+        names = [name.upper() for name in columns['names']]
+    return SharedColumns.create({'values': values, 'names': names})
+
+
+class TestSharedColumns(unittest.TestCase):
+    def test_round_trip(self):
+        descriptor = SharedColumns.create({
+            'floats': array('d', [1.5, float('nan')]), 'ints': np.arange(3), 'strings': ['a', '', 'ünïcode'],
+            'nested': {'empty': array('q'), 'other': [('a', 'b')]}, 'scalar': 7
+        })
+        with descriptor.attach(unlink=True) as columns:
+            assert isinstance(columns['floats'], memoryview)
+            assert columns['floats'][0] == 1.5 and columns['floats'][1] != columns['floats'][1]
+            assert list(columns['ints']) == [0, 1, 2]
+            assert isinstance(columns['strings'], SharedStrings)
+            assert list(columns['strings']) == ['a', '', 'ünïcode']
+            assert columns['strings'][-1] == 'ünïcode' and columns['strings'][:2] == ['a', '']
+            assert len(columns['nested']['empty']) == 0
+            assert columns['nested']['other'] == [('a', 'b')]
+            assert columns['scalar'] == 7
+
+    def test_between_processes(self):
+        """
+        Workers should be able to attach to a block sent to them, and send a result block back.
+        """
+        descriptor = SharedColumns.create({'values': np.arange(1000, dtype=np.float64), 'names': ['x', 'y']})
+        with ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context('spawn')) as executor:
+            result = executor.submit(_double, descriptor).result()
+
+        with result.attach(unlink=True) as columns:
+            assert np.asarray(columns['values']).sum() == 999 * 1000
+            assert list(columns['names']) == ['X', 'Y']
+
+    def test_wire(self):
+        with open("./fixtures/gtfs-20160512T0400Z", "rb") as f:
+            content = f.read()
+        assert wire.from_shared(wire.decode_to_shared(content)) == wire.dictify_content(content)
+        assert wire.decode_to_shared(b'\xff\xff\xff') is None
+
+    def test_columnar_logbook(self):
+        feeds = [gt.dictify(gt.io.parse_feed("./fixtures/gtfs-20160512T0400Z"))]
+        logbook = ColumnarLogbook.from_logbook(gt.logify(feeds))
+        result = ColumnarLogbook.from_shared(logbook.to_shared())
+        assert list(result.keys()) == list(logbook.keys())
+        assert result.to_frame().fillna(-1).equals(logbook.to_frame().fillna(-1))
@@ -0,0 +1,165 @@
+"""
+Quantile sketch test module. Asserts that sketches estimate quantiles accurately, merge associatively, and are kept
+up to date from logbooks correctly.
+"""
+import unittest
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+import sys; sys.path.append("../")
+import gtfs_tripify as gt
+from gtfs_tripify.sketches import QuantileSketch, TravelTimeSketches
+from gtfs_tripify.tripify import _finish_trip
+
+
+def trip_log(trip_id, route_id, rows):
+    return pd.DataFrame([(trip_id, route_id, action, lo, hi, stop_id, 0) for action, lo, hi, stop_id in rows],
+                        columns=['trip_id', 'route_id', 'action', 'minimum_time', 'maximum_time', 'stop_id',
+                                 'latest_information_time'])
+
+
+class TestQuantileSketch(unittest.TestCase):
+    def setUp(self):
+        self.values = np.random.default_rng(0).lognormal(4, 1, 20000)
+
+    def test_accuracy(self):
+        sketch = QuantileSketch(relative_accuracy=0.01)
+        sketch.add(self.values)
+
+        assert sketch.count == len(self.values)
+        for q in [0.01, 0.5, 0.9, 0.99]:
+            expected = np.quantile(self.values, q, method='lower')
+            assert abs(sketch.quantile(q) - expected) <= 0.011 * expected + 1e-9
+        assert sketch.quantile(0) == self.values.min() and sketch.quantile(1) == self.values.max()
+
+    def test_merge(self):
+        """
+        Merging sketches of shards of the data should be the same as sketching all of it, in any order.
+        """
+        whole = QuantileSketch()
+        whole.add(self.values)
+
+        shards = []
+        for shard in np.array_split(self.values, 3):
+            sketch = QuantileSketch()
+            sketch.add(shard)
+            shards.append(sketch)
+
+        left = QuantileSketch().merge(QuantileSketch().merge(shards[0]).merge(shards[1])).merge(shards[2])
+        right = QuantileSketch().merge(shards[2]).merge(QuantileSketch().merge(shards[1]).merge(shards[0]))
+        assert left.to_dict() == right.to_dict() == whole.to_dict()
+
+        with self.assertRaises(ValueError):
+            whole.merge(QuantileSketch(relative_accuracy=0.05))
+
+    def test_update_many(self):
+        """
+        Adding an array of values in one go should be the same as adding each value one by one.
+        """
+        bulk, single = QuantileSketch(), QuantileSketch()
+        bulk.update_many(np.concatenate([[0], self.values[:500]]), np.arange(501) % 3 + 1)
+        for value, count in zip(np.concatenate([[0], self.values[:500]]), np.arange(501) % 3 + 1):
+            for _ in range(count):
+                single.add(value)
+        assert bulk.to_dict() == single.to_dict()
+
+    def test_zeros_and_empty(self):
+        sketch = QuantileSketch()
+        assert np.isnan(sketch.quantile(0.5))
+
+        sketch.add([0, 0, 0, 10])
+        assert sketch.quantile(0.5) == 0
+        assert abs(sketch.quantile(1) - 10) < 1e-9
+        with self.assertRaises(ValueError):
+            sketch.add([-1])
+
+    def test_serialization(self):
+        sketch = QuantileSketch()
+        sketch.add(self.values)
+        restored = QuantileSketch.from_dict(json.loads(json.dumps(sketch.to_dict())))
+        assert restored.to_dict() == sketch.to_dict()
+        assert restored.quantile(0.9) == sketch.quantile(0.9)
+
+
+class TestTravelTimeSketches(unittest.TestCase):
+    def setUp(self):
+        self.logbook = {
+            'A_0': trip_log('A', '1', [('STOPPED_AT', np.nan, 100.0, 'S1'), ('STOPPED_AT', 150.0, 250.0, 'S2'),
+                                       ('STOPPED_OR_SKIPPED', 250.0, 350.0, 'S3')]),
+            'B_0': trip_log('B', '1', [('STOPPED_AT', 3600.0, 3700.0, 'S1'), ('STOPPED_AT', 3800.0, 3900.0, 'S2')]),
+            # Still in progress, and so not counted.
+            'C_0': trip_log('C', '1', [('STOPPED_AT', 100.0, 200.0, 'S1'), ('STOPPED_AT', 300.0, 400.0, 'S2'),
+                                       ('EN_ROUTE_TO', 400.0, np.nan, 'S3')])
+        }
+
+    def test_segments(self):
+        segments = TravelTimeSketches().segments(self.logbook)
+        assert segments.values.tolist() == [['1', 'S1', 'S2', 0, 100.0], ['1', 'S2', 'S3', 0, 100.0],
+                                            ['1', 'S1', 'S2', 3600, 200.0]]
+
+    def test_update_and_quantiles(self):
+        sketches = TravelTimeSketches()
+        sketches.update(self.logbook)
+
+        assert set(sketches.sketches.keys()) == {('1', 'S1', 'S2', 0), ('1', 'S2', 'S3', 0), ('1', 'S1', 'S2', 3600)}
+        quantiles = sketches.quantiles()
+        assert list(quantiles.columns) == ['count', 'p50', 'p90', 'p99']
+        assert abs(quantiles.loc[('1', 'S1', 'S2', 3600), 'p50'] - 200) <= 2
+
+        merged = sketches.quantiles(bucketed=False)
+        assert merged.loc[('1', 'S1', 'S2'), 'count'] == 2
+        assert len(sketches.quantiles(route_id='2')) == 0
+
+    def test_update_matches_add(self):
+        """
+        Updating the sketches in bulk should give the same sketches as adding each travel time one by one.
+        """
+        sketches = TravelTimeSketches()
+        sketches.update(self.logbook)
+
+        for _, segment in TravelTimeSketches().segments(self.logbook).groupby(['route_id', 'from_stop', 'to_stop',
+                                                                             'bucket']):
+            sketch = QuantileSketch()
+            sketch.add(segment['travel_time'].values)
+            key = tuple(segment.iloc[0][['route_id', 'from_stop', 'to_stop', 'bucket']])
+            assert sketches.sketches[key].to_dict() == sketch.to_dict()
+
+    def test_merge_and_save(self):
+        first, second = TravelTimeSketches(), TravelTimeSketches()
+        first.update({'A_0': self.logbook['A_0']})
+        second.update({'B_0': self.logbook['B_0']})
+        whole = TravelTimeSketches()
+        whole.update(self.logbook)
+        assert first.merge(second).to_dict()['sketches'] == whole.to_dict()['sketches']
+
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, 'sketches.json')
+            whole.save(path)
+            assert TravelTimeSketches.load(path).to_dict() == whole.to_dict()
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_stream_to_sql(self):
+        """
+        Sketches passed to `stream_to_sql` should be updated with the finished trips in the logbook written.
+        """
+        def finish(logbook):
+            return {key: _finish_trip(trip_log.copy(), 1463025600) for key, trip_log in logbook.items()}
+
+        stream = ["./fixtures/gtfs-20160512T0400Z", "./fixtures/gtfs-20160512T0401Z"]
+        sketches = TravelTimeSketches()
+        conn = sqlite3.connect(":memory:")
+        gt.io.stream_to_sql(stream, conn, transform=finish, sketches=sketches)
+        conn.close()
+
+        expected = TravelTimeSketches().segments(finish(gt.logify([gt.dictify(gt.decode.parse_feed(path))
+                                                                     for path in stream])))
+        assert len(expected) > 0
+        assert sum(sketch.count for sketch in sketches.sketches.values()) == len(expected)
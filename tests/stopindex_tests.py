@@ -0,0 +1,89 @@
+"""
+Stop index test module. Asserts that stop events are indexed, merged, persisted and queried correctly.
+"""
+import unittest
+import os
+import random
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+from google.transit import gtfs_realtime_pb2
+
+import sys; sys.path.append("../")
+import gtfs_tripify as gt
+from gtfs_tripify.stopindex import StopIndex
+
+
+def scan(logbook, stop_id, start, end):
+    """The reference implementation: scan every trip log in the logbook."""
+    matches = []
+    for key, trip_log in logbook.items():
+        lo = trip_log['minimum_time'].fillna(trip_log['maximum_time'])
+        hi = trip_log['maximum_time'].fillna(np.inf)
+        hits = trip_log[(trip_log['stop_id'] == stop_id) & lo.notnull() & (lo <= end) & (hi >= start)]
+        matches.extend((key, action) for action in hits['action'])
+    return sorted(matches)
+
+
+class TestStopIndex(unittest.TestCase):
+    def setUp(self):
+        feeds = []
+        for name in ['gtfs-20160512T0400Z', 'gtfs-20160512T0401Z']:
+            with open('./fixtures/' + name, 'rb') as f:
+                feed = gtfs_realtime_pb2.FeedMessage()
+                feed.ParseFromString(f.read())
+            feeds.append(gt.dictify(feed))
+        self.logbook = gt.logify(feeds)
+        self.stop_ids = sorted({stop_id for trip_log in self.logbook.values() for stop_id in trip_log['stop_id']})
+
+    def assert_matches_scan(self, index, logbook):
+        rng = random.Random(0)
+        for _ in range(100):
+            stop_id = rng.choice(self.stop_ids)
+            start = rng.randint(1463022000, 1463030000)
+            end = start + rng.randint(0, 3600)
+            result = index.query(stop_id, start, end)
+            assert sorted(zip(result['unique_trip_id'], result['action'])) == scan(logbook, stop_id, start, end)
+
+    def test_query(self):
+        index = StopIndex.from_logbook(self.logbook)
+        self.assert_matches_scan(index, self.logbook)
+
+        result = index.query(self.stop_ids[0])
+        assert list(result['minimum_time'].fillna(result['maximum_time'])) == \
+            sorted(result['minimum_time'].fillna(result['maximum_time']))
+        assert len(index.query('nonexistent')) == 0
+
+    def test_query_actions(self):
+        index = StopIndex.from_logbook(self.logbook)
+        for stop_id in self.stop_ids[:10]:
+            assert set(index.query(stop_id, actions=['STOPPED_AT'])['action']) <= {'STOPPED_AT'}
+
+    def test_add(self):
+        """
+        Building an index incrementally should be the same as building it all at once. Trips added again should have
+        their events replaced.
+        """
+        keys = list(self.logbook.keys())
+        first = {key: self.logbook[key] for key in keys[:50]}
+        second = {key: self.logbook[key] for key in keys[40:]}
+
+        index = StopIndex.from_logbook(first)
+        index.add(second)
+        assert len(index) == len(StopIndex.from_logbook(self.logbook))
+        self.assert_matches_scan(index, self.logbook)
+
+    def test_save_load(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, 'logbook.stopindex.npz')
+            StopIndex.from_logbook(self.logbook).save(path)
+            index = StopIndex.load(path)
+        finally:
+            shutil.rmtree(tmp)
+
+        self.assert_matches_scan(index, self.logbook)
+        pd.testing.assert_frame_equal(index.query(self.stop_ids[0]),
+                                      StopIndex.from_logbook(self.logbook).query(self.stop_ids[0]))